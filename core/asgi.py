@@ -12,5 +12,14 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Sync code of every ASGI request runs in a new thread: a persistent connection would be
+# left behind by each request. Close them per request (or pool them, see DB_POOL)
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+# The server's event loop lives as long as the process: keep an async LLM client on it
+os.environ.setdefault('LLM_ASYNC_CLIENTS', 'True')
 
 application = get_asgi_application()
+
+from tracker.categories import preload_categories  # noqa: E402
+
+preload_categories()
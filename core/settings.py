@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -67,16 +68,53 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': os.getenv('DB_NAME', 'ai_finance_db'),
-        'USER': os.getenv('DB_USER', 'root'),
-        'PASSWORD': os.getenv('DB_PASSWORD', ''),
-        'HOST': os.getenv('DB_HOST', '127.0.0.1'),
-        'PORT': os.getenv('DB_PORT', '3306'),
+# DB_ENGINE: mysql (default), postgresql, or sqlite for local runs without a server
+# (DB_NAME is then the database file, db.sqlite3 by default)
+DB_ENGINE = os.getenv('DB_ENGINE', 'mysql')
+# Connections are kept open for DB_CONN_MAX_AGE seconds (0: a new one per request) and
+# pinged before a request reuses them, so a connection the server dropped is replaced
+# instead of failing the request. Under ASGI every request runs in a thread of its own,
+# core/asgi.py defaults DB_CONN_MAX_AGE to 0 there: use DB_POOL instead.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+# PostgreSQL only (needs psycopg[pool]): a pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE
+# connections per process, requests wait up to DB_POOL_TIMEOUT seconds for a free one
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+elif DB_ENGINE in ('mysql', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': f'django.db.backends.{DB_ENGINE}',
+            'NAME': os.getenv('DB_NAME', 'ai_finance_db'),
+            'USER': os.getenv('DB_USER', 'root'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', '127.0.0.1'),
+            'PORT': os.getenv('DB_PORT', '3306' if DB_ENGINE == 'mysql' else '5432'),
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"DB_ENGINE must be mysql, postgresql or sqlite, not {DB_ENGINE!r}")
+
+DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+DATABASES['default']['CONN_HEALTH_CHECKS'] = DB_CONN_HEALTH_CHECKS
+if DB_POOL:
+    if DB_ENGINE != 'postgresql':
+        raise ImproperlyConfigured("DB_POOL needs DB_ENGINE=postgresql, use DB_CONN_MAX_AGE with MySQL and SQLite")
+    # Pooled connections go back to the pool after each request, Django rejects persistent ones on top
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE, 'timeout': DB_POOL_TIMEOUT},
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,4 +160,107 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Login Configuration
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
-LOGOUT_REDIRECT_URL = '/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/login/'
+
+# Expenses per page on the history page and /api/expenses/
+EXPENSE_PAGE_SIZE = int(os.getenv('EXPENSE_PAGE_SIZE', '50'))
+
+# Cache backend: locmem (default, per process), file (shared by the processes of one box,
+# CACHE_LOCATION is the directory) or redis (CACHE_LOCATION is the URL, needs the redis package)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'ai-finance-tracker'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/0'),
+}
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"CACHE_BACKEND must be one of {', '.join(CACHE_BACKENDS)}, not {CACHE_BACKEND!r}")
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv('CACHE_LOCATION', CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'aft'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))} if CACHE_BACKEND != 'redis' else {},
+    }
+}
+
+# Seconds a user's dashboard analytics and their other cached data (budget statuses, API
+# lists) stay cached; any change to their expenses or budgets drops all of it at once
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '300'))
+USER_CACHE_TIMEOUT = int(os.getenv('USER_CACHE_TIMEOUT', '300'))
+
+# Background exports: histories with more expenses than the threshold are exported by
+# `manage.py run_export_worker` into EXPORT_ROOT instead of inside the request
+EXPORT_ROOT = os.getenv('EXPORT_ROOT', str(BASE_DIR / 'exports'))
+EXPORT_ASYNC_THRESHOLD = int(os.getenv('EXPORT_ASYNC_THRESHOLD', '5000'))
+# A running job without progress for this many seconds is assumed dead and requeued, until
+# it has been claimed EXPORT_JOB_MAX_ATTEMPTS times (a job that kills its worker then fails)
+EXPORT_JOB_STALE_SECONDS = int(os.getenv('EXPORT_JOB_STALE_SECONDS', '600'))
+EXPORT_JOB_MAX_ATTEMPTS = int(os.getenv('EXPORT_JOB_MAX_ATTEMPTS', '3'))
+# Hours finished exports stay downloadable
+EXPORT_RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', '24'))
+
+# AI expense parsing cache: an in-process LRU of AI_PARSE_CACHE_SIZE entries in front of
+# the AI_PARSE_CACHE_ALIAS Django cache (empty to keep results per process only)
+AI_PARSE_CACHE_SIZE = int(os.getenv('AI_PARSE_CACHE_SIZE', '1024'))
+AI_PARSE_CACHE_TIMEOUT = int(os.getenv('AI_PARSE_CACHE_TIMEOUT', str(7 * 24 * 3600)))
+AI_PARSE_CACHE_ALIAS = os.getenv('AI_PARSE_CACHE_ALIAS', 'default')
+# Share of the user's matching past expenses that must agree on a category before an
+# expense text is parsed locally instead of by the LLM (above 1 disables the local parser)
+AI_LOCAL_PARSE_MIN_CONFIDENCE = float(os.getenv('AI_LOCAL_PARSE_MIN_CONFIDENCE', '0.8'))
+# Lines accepted by one /api/expenses/add_batch_with_ai/ request
+AI_BATCH_MAX_LINES = int(os.getenv('AI_BATCH_MAX_LINES', '500'))
+# LLM requests in flight at once per event loop (async views)
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '32'))
+# Deferred AI enrichment: save new expenses at once with a local guess and let
+# `manage.py run_enrichment_worker` parse them (the API's "defer" field overrides it).
+# Failed parses are retried after AI_ENRICH_RETRY_SECONDS, up to AI_ENRICH_MAX_ATTEMPTS times;
+# rows a worker holds longer than AI_ENRICH_STALE_SECONDS are handed to another one
+AI_DEFER_ENRICHMENT = os.getenv('AI_DEFER_ENRICHMENT', 'False') == 'True'
+AI_ENRICH_RETRY_SECONDS = int(os.getenv('AI_ENRICH_RETRY_SECONDS', '60'))
+AI_ENRICH_MAX_ATTEMPTS = int(os.getenv('AI_ENRICH_MAX_ATTEMPTS', '3'))
+AI_ENRICH_STALE_SECONDS = int(os.getenv('AI_ENRICH_STALE_SECONDS', '300'))
+# Token caps of the LLM calls: expense texts are cut to AI_PARSE_TEXT_MAX_TOKENS, answers to
+# AI_PARSE_MAX_TOKENS per expense and AI_ADVICE_MAX_TOKENS per tip; the advice prompt lists
+# the AI_ADVICE_MAX_CATEGORIES largest categories and sums up the rest
+AI_PARSE_TEXT_MAX_TOKENS = int(os.getenv('AI_PARSE_TEXT_MAX_TOKENS', '128'))
+AI_PARSE_MAX_TOKENS = int(os.getenv('AI_PARSE_MAX_TOKENS', '64'))
+AI_ADVICE_MAX_CATEGORIES = int(os.getenv('AI_ADVICE_MAX_CATEGORIES', '8'))
+AI_ADVICE_MAX_TOKENS = int(os.getenv('AI_ADVICE_MAX_TOKENS', '100'))
+# Categories are kept in memory per process; each process reloads them from the database
+# every CATEGORY_REGISTRY_CHECK_SECONDS to see categories changed elsewhere
+CATEGORY_REGISTRY_CHECK_SECONDS = int(os.getenv('CATEGORY_REGISTRY_CHECK_SECONDS', '10'))
+# Identical concurrent LLM calls always share one request within a process; with a
+# CACHES alias (e.g. 'default' on a shared cache) also across processes, through a lock
+AI_SINGLE_FLIGHT_ALIAS = os.getenv('AI_SINGLE_FLIGHT_ALIAS', '')
+# Savings advice is reused while the month's category totals are unchanged when rounded
+# to ADVICE_FINGERPRINT_DIGITS significant digits, for at most ADVICE_CACHE_TIMEOUT seconds
+ADVICE_FINGERPRINT_DIGITS = int(os.getenv('ADVICE_FINGERPRINT_DIGITS', '2'))
+ADVICE_CACHE_TIMEOUT = int(os.getenv('ADVICE_CACHE_TIMEOUT', str(24 * 3600)))
+
+# LLM gateway: Groq endpoint (empty for the SDK default), seconds per attempt and for
+# the whole call including retries, retries of transient errors with jittered backoff
+# starting at LLM_RETRY_BACKOFF seconds, pooled connections per client
+LLM_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '15'))
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '30'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+# Consecutive failed calls that open the circuit, seconds before a trial call is let through
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+# Async views get an async client per event loop, only worth it where the loop outlives the
+# requests (an ASGI server, core.asgi turns it on). Under WSGI and runserver every async
+# view runs in a loop of its own, their calls use the pooled sync client from a thread
+LLM_ASYNC_CLIENTS = os.getenv('LLM_ASYNC_CLIENTS', 'False') == 'True'
+# 'groq', or 'simulator' to answer locally (CI, benchmarks): responses recorded in the
+# LLM_RECORDINGS JSON file are replayed (with 'groq' they are recorded there when it is set),
+# other prompts get synthesized answers. Latency is log-normal around LLM_SIM_LATENCY_MS,
+# LLM_SIM_ERRORS injects failures, e.g. 'server:0.02,rate_limit:0.01,timeout:0.01'
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'groq')
+LLM_RECORDINGS = os.getenv('LLM_RECORDINGS', '')
+LLM_SIM_LATENCY_MS = float(os.getenv('LLM_SIM_LATENCY_MS', '800'))
+LLM_SIM_LATENCY_SIGMA = float(os.getenv('LLM_SIM_LATENCY_SIGMA', '0.5'))
+LLM_SIM_ERRORS = os.getenv('LLM_SIM_ERRORS', '')
+LLM_SIM_SEED = int(os.getenv('LLM_SIM_SEED', '0'))
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Category, Expense, Budget
+from .models import Category, Expense, Budget, SpendingRollup, ExportJob, TokenUsage
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -11,10 +11,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Expense)
 class ExpenseAdmin(admin.ModelAdmin):
-    list_display = ('user', 'item', 'amount', 'category', 'created_at')
-    list_filter = ('category', 'created_at', 'user')
+    list_display = ('user', 'item', 'amount', 'category', 'ai_status', 'created_at')
+    list_filter = ('category', 'ai_status', 'created_at', 'user')
     search_fields = ('item', 'raw_text', 'user__username')
     date_hierarchy = 'created_at'
+    list_select_related = ('user', 'category')
 
 
 @admin.register(Budget)
@@ -23,4 +24,42 @@ class BudgetAdmin(admin.ModelAdmin):
     list_filter = ('period', 'created_at', 'category')
     search_fields = ('user__username', 'category__name')
     date_hierarchy = 'created_at'
+    list_select_related = ('user', 'category')
     
+
+
+@admin.register(SpendingRollup)
+class SpendingRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'category', 'granularity', 'period_start', 'total', 'count')
+    list_filter = ('granularity', 'category')
+    search_fields = ('user__username',)
+    list_select_related = ('user', 'category')
+    
+    # Maintained from Expense writes, rebuild with `manage.py rebuild_rollups`
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'format', 'status', 'processed_rows', 'total_rows', 'created_at', 'finished_at')
+    list_filter = ('status', 'format')
+    search_fields = ('user__username',)
+    list_select_related = ('user',)
+
+
+@admin.register(TokenUsage)
+class TokenUsageAdmin(admin.ModelAdmin):
+    list_display = ('day', 'purpose', 'model', 'calls', 'prompt_tokens', 'completion_tokens')
+    list_filter = ('purpose', 'model')
+    date_hierarchy = 'day'
+    
+    # Counted by the LLM calls, see `manage.py token_report`
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
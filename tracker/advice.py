@@ -0,0 +1,139 @@
+"""
+Savings advice on the current month's spending, shared by the dashboard
+widget and /api/advice/.
+
+Advice is cached per user under a fingerprint of the month's category totals
+rounded to ADVICE_FINGERPRINT_DIGITS significant digits, so a new coffee
+doesn't cost a completion but a real change in spending does. The
+refresh_savings_advice command fills the cache ahead of time.
+"""
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .ai_utils import arequest_budget_advice, get_fallback_advice, request_budget_advice
+from .metrics import LatencyStats
+from .models import SpendingRollup
+from .prompts import ADVICE_PROMPT_VERSION
+
+NO_EXPENSES_ADVICE = "No expenses recorded this month yet! Add some expenses to get advice."
+
+# Which path served each advice: cache, llm or fallback
+advice_path_stats = LatencyStats()
+
+
+def get_month_summary(user, today=None):
+    """[{'category', 'total'}] of the month so far, highest first, from the monthly rollups"""
+    month_start = (today or timezone.localdate()).replace(day=1)
+    rows = SpendingRollup.objects.filter(
+        user=user, granularity=SpendingRollup.MONTH, period_start=month_start
+    ).values('category__name').annotate(total=Sum('total')).filter(total__gt=0).order_by('-total')
+    return [
+        {'category': row['category__name'] or "Uncategorized", 'total': float(row['total'])}
+        for row in rows
+    ]
+
+
+def get_summary_fingerprint(summary):
+    digits = settings.ADVICE_FINGERPRINT_DIGITS
+    totals = sorted((item['category'], float(f"{item['total']:.{digits}g}")) for item in summary)
+    return hashlib.sha1(json.dumps(totals).encode()).hexdigest()
+
+
+def get_advice_cache_key(user_id, summary):
+    return f"advice:{user_id}:v{ADVICE_PROMPT_VERSION}:{get_summary_fingerprint(summary)}"
+
+
+def lookup_advice(user):
+    """(summary, cached advice or None)"""
+    summary = get_month_summary(user)
+    if not summary:
+        return summary, None
+    return summary, cache.get(get_advice_cache_key(user.pk, summary))
+
+
+def finish_advice(user, summary, advice, source, elapsed):
+    """Cache fresh LLM advice, fall back to the rule based tip when there is none. Returns (advice, source)"""
+    if advice is None:
+        advice, source = get_fallback_advice(summary), 'fallback'
+    elif source == 'llm':
+        cache.set(get_advice_cache_key(user.pk, summary), advice, settings.ADVICE_CACHE_TIMEOUT)
+    advice_path_stats.record(source, elapsed)
+    return advice, source
+
+
+def get_savings_advice(user):
+    started = time.perf_counter()
+    summary, advice = lookup_advice(user)
+    if not summary:
+        return NO_EXPENSES_ADVICE
+    source = 'cache'
+    if advice is None:
+        advice, source = request_budget_advice(summary), 'llm'
+    advice, _ = finish_advice(user, summary, advice, source, time.perf_counter() - started)
+    return advice
+
+
+async def aget_savings_advice_and_source(user):
+    """
+    (advice, source) without holding a thread on the LLM call. The source is
+    cache, llm, fallback or None when there is no spending this month.
+    """
+    started = time.perf_counter()
+    summary, advice = await sync_to_async(lookup_advice)(user)
+    if not summary:
+        return NO_EXPENSES_ADVICE, None
+    source = 'cache'
+    if advice is None:
+        advice, source = await arequest_budget_advice(summary), 'llm'
+    return await sync_to_async(finish_advice)(user, summary, advice, source, time.perf_counter() - started)
+
+
+async def aget_savings_advice(user):
+    """Async get_savings_advice"""
+    advice, _ = await aget_savings_advice_and_source(user)
+    return advice
+
+
+def is_advice_cache_shared():
+    """False when the cache lives in this process only (locmem) or nowhere (dummy)"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def refresh_savings_advice(users=None):
+    """
+    Compute the advice of every user with spending this month whose current
+    fingerprint is not cached yet. Returns (refreshed, up to date, failed) counts.
+    """
+    if users is None:
+        users = User.objects.filter(
+            spendingrollup__granularity=SpendingRollup.MONTH,
+            spendingrollup__period_start=timezone.localdate().replace(day=1),
+            spendingrollup__total__gt=0,
+        ).distinct()
+    refreshed = fresh = failed = 0
+    for user in users:
+        summary, advice = lookup_advice(user)
+        if not summary:
+            continue
+        if advice is not None:
+            fresh += 1
+            continue
+        started = time.perf_counter()
+        advice = request_budget_advice(summary)
+        if advice is None:
+            # The LLM is down, leave it to the next run rather than caching the fallback
+            failed += 1
+            continue
+        finish_advice(user, summary, advice, 'llm', time.perf_counter() - started)
+        refreshed += 1
+    return refreshed, fresh, failed
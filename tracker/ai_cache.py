@@ -0,0 +1,201 @@
+"""
+Cache in front of the expense parsing LLM call.
+
+Two tiers: a small in-process LRU for the hottest phrases, backed by one of
+the Django caches (CACHES alias) so workers share what any of them learned.
+Amounts are templated out of the key, "coffee 200" and "coffee 250" share one
+entry and only the amount is taken from the new text.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import caches
+
+# An amount with an optional currency marker, "1,200", "rs. 350", "$4.50".
+# Not inside a word, "flowers 200" keeps its "rs" (same boundary as local_parser.AMOUNT_TOKEN_RE)
+AMOUNT_RE = re.compile(r'(?<![\w.])(?:(?:rs\.?|inr|₹|\$)\s*)?(\d[\d,]*(?:\.\d+)?)', re.IGNORECASE)
+AMOUNT_PLACEHOLDER = '#'
+# Part of the cache keys, bump when templatize() changes what texts share a template
+TEMPLATE_VERSION = 2
+
+
+def normalize_text(text):
+    return ' '.join(text.lower().split()).strip(' .,!')
+
+
+def templatize(text):
+    """Normalized text with every amount replaced by a placeholder, and the amounts in order"""
+    amounts = []
+
+    def replace(match):
+        try:
+            amounts.append(Decimal(match.group(1).replace(',', '')))
+        except InvalidOperation:
+            return match.group(0)
+        return f' {AMOUNT_PLACEHOLDER} '
+
+    template = ' '.join(AMOUNT_RE.sub(replace, normalize_text(text)).split())
+    return template, amounts
+
+
+def get_amount_rule(amount, amounts):
+    """
+    How the model's amount relates to the amounts in the text: ('index', i)
+    when it is one of them, ('sum',) when it is their total, None otherwise.
+    """
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, ValueError):
+        return None
+    if amount in amounts:
+        return ('index', amounts.index(amount))
+    if len(amounts) > 1 and amount == sum(amounts):
+        return ('sum',)
+    return None
+
+
+def apply_amount_rule(rule, amounts):
+    # Texts sharing a template always have the same number of amounts
+    if rule[0] == 'index':
+        return float(amounts[rule[1]])
+    return float(sum(amounts))
+
+
+class LocalLRUCache:
+    """Thread-safe in-process LRU with per-entry expiry"""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ParseCache:
+    """
+    Parse results keyed on (model, prompt version, normalized text). Results
+    whose amount can be traced back to the text are stored once per template.
+    """
+
+    def __init__(self, model, prompt_version, max_size=1024, timeout=86400, alias='default'):
+        self.namespace = f'aiparse:{model}:v{prompt_version}:t{TEMPLATE_VERSION}'
+        self.timeout = timeout
+        self.local = LocalLRUCache(max_size, timeout)
+        self.shared = caches[alias] if alias else None
+        self.stats_lock = threading.Lock()
+        self.stats = dict.fromkeys(['local_hits', 'shared_hits', 'templated_hits', 'misses'], 0)
+
+    def make_key(self, kind, text):
+        return f'{self.namespace}:{kind}:{hashlib.sha1(text.encode()).hexdigest()}'
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def lookup(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.count('local_hits')
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.count('shared_hits')
+                self.local.set(key, value)
+                return value
+        return None
+
+    def store(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, self.timeout)
+
+    def get(self, text):
+        """Cached parse result for `text` (a new dict), None on a miss"""
+        normalized = normalize_text(text)
+        value = self.lookup(self.make_key('text', normalized))
+        if value is not None:
+            return dict(value)
+
+        template, amounts = templatize(text)
+        if amounts:
+            value = self.lookup(self.make_key('template', template))
+            if value is not None:
+                self.count('templated_hits')
+                return {
+                    'item': value['item'],
+                    'category': value['category'],
+                    'amount': apply_amount_rule(value['amount_rule'], amounts),
+                }
+
+        self.count('misses')
+        return None
+
+    def set(self, text, data):
+        template, amounts = templatize(text)
+        rule = get_amount_rule(data.get('amount'), amounts) if amounts else None
+        if rule:
+            self.store(self.make_key('template', template), {
+                'item': data.get('item'),
+                'category': data.get('category'),
+                'amount_rule': rule,
+            })
+        else:
+            # The amount is not in the text as such, only this exact phrase can reuse it
+            self.store(self.make_key('text', normalize_text(text)), dict(data))
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        hits = stats['local_hits'] + stats['shared_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['local_size'] = len(self.local.entries)
+        return stats
+
+    def clear(self):
+        """Empty the local tier and reset the counters, shared entries expire on their own"""
+        self.local.clear()
+        with self.stats_lock:
+            for stat in self.stats:
+                self.stats[stat] = 0
+
+
+def build_parse_cache(model, prompt_version):
+    return ParseCache(
+        model,
+        prompt_version,
+        max_size=settings.AI_PARSE_CACHE_SIZE,
+        timeout=settings.AI_PARSE_CACHE_TIMEOUT,
+        alias=settings.AI_PARSE_CACHE_ALIAS,
+    )
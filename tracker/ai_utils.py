@@ -1,128 +1,482 @@
-import os
+import copy
 import json
 import re
-from groq import Groq
-from dotenv import load_dotenv
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from .ai_cache import build_parse_cache, normalize_text
+from .llm_gateway import LLMGateway, LLMUnavailable
+from .local_parser import parse_fallback, parse_locally
+from .metrics import LatencyStats
+from .prompts import (
+    ADVICE_SYSTEM_PROMPT, BATCH_PARSE_SYSTEM_PROMPT, PARSE_PROMPT_VERSION, PARSE_SYSTEM_PROMPT, clip_text,
+    format_batch_lines, format_summary,
+)
+from .token_usage import record_token_usage
 
-# Environment variables loading
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Groq Client Initialize 
-try:
-    client = Groq(
-        api_key=os.getenv("GROQ_API_KEY")
-    )
-except Exception:
-    client = None
+_gateway = None
 
-def parse_expense_with_ai(user_text):
+def get_gateway():
+    """The process wide LLM gateway (Groq clients, retries, circuit breaker)"""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway.from_settings()
+    return _gateway
+
+def complete(purpose, request):
+    """One completion through the gateway, its tokens booked under `purpose`"""
+    chat_completion = get_gateway().complete(**request)
+    record_token_usage(purpose, request, chat_completion)
+    return chat_completion
+
+async def acomplete(purpose, request):
+    chat_completion = await get_gateway().acomplete(**request)
+    await sync_to_async(record_token_usage)(purpose, request, chat_completion)
+    return chat_completion
+
+class CallAbandoned(Exception):
+    """The leader of a shared call was cancelled or interrupted, a follower runs it instead"""
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller
+    (thread or asyncio task, any event loop) runs it and the others wait for
+    its result. With a cache alias the call is also shared across processes:
+    the leader holds a lock in that cache and publishes the result there,
+    the other processes poll for it.
+    """
+    # Seconds a result stays in the shared cache for the processes polling for it
+    SHARED_RESULT_TIMEOUT = 10
+
+    def __init__(self, alias=None, timeout=30, poll_interval=0.05):
+        self.alias = alias
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = dict.fromkeys(['leaders', 'followers', 'shared'], 0)
+
+    def claim(self, key):
+        """(future of the call, whether the caller has to run it)"""
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.counters['followers'] += 1
+                return future, False
+            future = self.calls[key] = Future()
+            self.counters['leaders'] += 1
+            return future, True
+
+    def settle(self, key, future, result=None, error=None):
+        with self.lock:
+            self.calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def get_shared_keys(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return f"singleflight:lock:{digest}", f"singleflight:result:{digest}"
+
+    def count_shared(self):
+        with self.lock:
+            self.counters['shared'] += 1
+
+    def do(self, key, fn, *args):
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                # Every caller gets its own copy, results are dicts the callers modify
+                return copy.deepcopy(future.result())
+            except CallAbandoned:
+                continue
+        try:
+            result = self.run_shared(key, fn, *args) if self.alias else fn(*args)
+        except Exception as e:
+            self.settle(key, future, error=e)
+            raise
+        except BaseException:
+            self.settle(key, future, error=CallAbandoned())
+            raise
+        # The followers copy from a snapshot of their own, the leader's result is its caller's
+        self.settle(key, future, copy.deepcopy(result))
+        return result
+
+    async def ado(self, key, fn, *args):
+        """do() for coroutine functions"""
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                # Shielded, a cancelled follower must not cancel the call for everyone else
+                return copy.deepcopy(await asyncio.shield(asyncio.wrap_future(future)))
+            except CallAbandoned:
+                continue
+        try:
+            result = await (self.arun_shared(key, fn, *args) if self.alias else fn(*args))
+        except Exception as e:
+            self.settle(key, future, error=e)
+            raise
+        except BaseException:
+            # Cancelled when its client disconnects: not an answer, a follower takes over
+            self.settle(key, future, error=CallAbandoned())
+            raise
+        self.settle(key, future, copy.deepcopy(result))
+        return result
+
+    def run_shared(self, key, fn, *args):
+        shared = caches[self.alias]
+        lock_key, result_key = self.get_shared_keys(key)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = shared.get(result_key)
+            if entry is not None:
+                self.count_shared()
+                return entry['value']
+            if shared.add(lock_key, 1, self.timeout):
+                break
+            if time.monotonic() >= deadline:
+                # The other process is stuck or gone, don't wait any longer
+                return fn(*args)
+            time.sleep(self.poll_interval)
+        try:
+            result = fn(*args)
+            shared.set(result_key, {'value': result}, self.SHARED_RESULT_TIMEOUT)
+            return result
+        finally:
+            shared.delete(lock_key)
+
+    async def arun_shared(self, key, fn, *args):
+        shared = caches[self.alias]
+        lock_key, result_key = self.get_shared_keys(key)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = await shared.aget(result_key)
+            if entry is not None:
+                self.count_shared()
+                return entry['value']
+            if await shared.aadd(lock_key, 1, self.timeout):
+                break
+            if time.monotonic() >= deadline:
+                return await fn(*args)
+            await asyncio.sleep(self.poll_interval)
+        try:
+            result = await fn(*args)
+            await shared.aset(result_key, {'value': result}, self.SHARED_RESULT_TIMEOUT)
+            return result
+        finally:
+            await shared.adelete(lock_key)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.counters, 'in_flight': len(self.calls)}
+
+_single_flight = None
+
+def get_single_flight():
+    """Coalesces identical concurrent LLM calls, across processes when AI_SINGLE_FLIGHT_ALIAS is set"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight(alias=settings.AI_SINGLE_FLIGHT_ALIAS or None, timeout=settings.LLM_DEADLINE)
+    return _single_flight
+
+AI_MODEL = "llama-3.3-70b-versatile"
+
+_parse_cache = None
+
+def get_parse_cache():
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = build_parse_cache(AI_MODEL, PARSE_PROMPT_VERSION)
+    return _parse_cache
+
+# Which path served each parse: local, cache, llm, fallback (or failed)
+parse_path_stats = LatencyStats()
+
+def lookup_parse(user_text, user=None):
+    """(data, source) from the local parser or the parse cache, (None, None) when the LLM is needed"""
+    data = parse_locally(user_text, user) if user is not None else None
+    if data is not None:
+        return data, 'local'
+    data = get_parse_cache().get(user_text)
+    if data is not None:
+        return data, 'cache'
+    return None, None
+
+def finish_parse(user_text, data, source, elapsed):
+    """Record which path answered, cache fresh LLM results and tag the result with its source"""
+    parse_path_stats.record(source if data else 'failed', elapsed)
+    logger.info("Expense parsed via %s in %.1f ms", source if data else 'failed', elapsed * 1000)
+    if data:
+        if source == 'llm':
+            get_parse_cache().set(user_text, data)
+        data['source'] = source
+    return data
+
+def parse_expense_with_ai(user_text, user=None):
+    """
+    Text to structured JSON. Tried in order: the local rule-based parser (when
+    the user is known), the parse cache, the LLM, and when that fails the
+    lenient local fallback. The result's "source" says which one answered.
+    """
+    started = time.perf_counter()
+    data, source = lookup_parse(user_text, user)
+    if data is None:
+        data, source = request_expense_parse(user_text), 'llm'
+    if data is None:
+        data, source = parse_fallback(user_text, user), 'fallback'
+    return finish_parse(user_text, data, source, time.perf_counter() - started)
+
+async def aparse_expense_with_ai(user_text, user=None):
+    """Async parse_expense_with_ai, the LLM call doesn't hold a thread"""
+    started = time.perf_counter()
+    data, source = await sync_to_async(lookup_parse)(user_text, user)
+    if data is None:
+        data, source = await arequest_expense_parse(user_text), 'llm'
+    if data is None:
+        data, source = await sync_to_async(parse_fallback)(user_text, user), 'fallback'
+    return await sync_to_async(finish_parse)(user_text, data, source, time.perf_counter() - started)
+
+def get_parse_stats():
+    """Counters of the parse pipeline, with the share of parses that didn't need the LLM"""
+    paths = parse_path_stats.snapshot()
+    served = sum(path['count'] for path in paths.values())
+    offloaded = sum(paths.get(source, {}).get('count', 0) for source in ('local', 'cache'))
+    return {
+        'paths': paths,
+        'llm_offload_ratio': round(offloaded / served, 4) if served else 0.0,
+        'parse_cache': get_parse_cache().get_stats(),
+    }
+
+def clean_parse_result(data):
+    # Validate data types
+    if 'amount' in data:
+        if isinstance(data['amount'], str):
+            # cleanup string amount
+             data['amount'] = float(re.sub(r'[^\d.]', '', data['amount']))
+        elif isinstance(data['amount'], bool) or not isinstance(data['amount'], (int, float)):
+            raise TypeError(f"amount is not a number: {data['amount']!r}")
+    return data
+
+def get_parse_request(user_text):
+    """chat.completions.create() arguments of the parse call"""
+    return {
+        'messages': [
+            {"role": "system", "content": PARSE_SYSTEM_PROMPT},
+            {"role": "user", "content": clip_text(user_text, settings.AI_PARSE_TEXT_MAX_TOKENS)},
+        ],
+        'model': AI_MODEL,
+        'temperature': 0.1,
+        'max_tokens': settings.AI_PARSE_MAX_TOKENS,
+    }
+
+def read_parse_response(chat_completion):
+    # Response handling
+    res_text = chat_completion.choices[0].message.content.strip()
+
+    # Regex to extract JSON if there's extra text
+    json_match = re.search(r'\{.*\}', res_text, re.DOTALL)
+    if json_match:
+        res_text = json_match.group(0)
+
+    # String ko JSON dictionary mein convert karna
+    try:
+        data = json.loads(res_text)
+    except json.JSONDecodeError:
+        logger.warning("JSON Decode Error. Raw text: %s", res_text)
+        return None
+    # Malformed answers go to the local fallback like unreadable ones
+    if not isinstance(data, dict):
+        logger.warning("Parse answer is not an object. Raw text: %s", res_text)
+        return None
+    try:
+        return clean_parse_result(data)
+    except (ValueError, TypeError):
+        logger.warning("Parse answer has an invalid amount. Raw text: %s", res_text)
+        return None
+
+def get_parse_flight_key(user_text):
+    return f"parse:{PARSE_PROMPT_VERSION}:{normalize_text(user_text)}"
+
+def request_expense_parse(user_text):
     """
     Groq (Llama 3) use for text to structured JSON.
+    Concurrent requests for the same text share one call.
     """
-    if not client:
-        print("Groq Client not initialized. Check API Key.")
+    return get_single_flight().do(get_parse_flight_key(user_text), fetch_expense_parse, user_text)
+
+async def arequest_expense_parse(user_text):
+    return await get_single_flight().ado(get_parse_flight_key(user_text), afetch_expense_parse, user_text)
+
+def fetch_expense_parse(user_text):
+    try:
+        # Groq API Call
+        return read_parse_response(complete('parse', get_parse_request(user_text)))
+    except LLMUnavailable as e:
+        logger.warning("Expense parse failed: %s", e)
         return None
 
+async def afetch_expense_parse(user_text):
     try:
-        #Prompt for better consistency
-        prompt = f"""
-        Extract expense details from this text: "{user_text}"
-        
-        Return ONLY a raw JSON object (no markdown, no backticks) with this exact format:
-        {{
-            "item": "capitalized name of item",
-            "amount": numeric_value,
-            "category": "Food/Transport/Shopping/Bills/Health/Entertainment/Education/Housing/Others"
-        }}
-        
-        Rules:
-        1. If currency symbol (Rs, $, etc) is present, strip it. Use only numbers.
-        2. Categorize intelligently. If not clear, use "Others".
-        3. Do NOT add any explanation, preambles, or markdown formatting. Just the JSON string.
-        4. If multiple amounts are mentioned, sum them up if they belong to the same logical expense, or pick the main one.
-        """
+        return read_parse_response(await acomplete('parse', get_parse_request(user_text)))
+    except LLMUnavailable as e:
+        logger.warning("Expense parse failed: %s", e)
+        return None
 
-        # Groq API Call
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a precise JSON extractor. You output only valid JSON."
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="llama-3.3-70b-versatile", 
-            temperature=0.1, 
-        )
-
-        # Response handling
-        res_text = chat_completion.choices[0].message.content.strip()
-
-        # Regex to extract JSON if there's extra text
-        json_match = re.search(r'\{.*\}', res_text, re.DOTALL)
-        if json_match:
-            res_text = json_match.group(0)
-
-        # String ko JSON dictionary mein convert karna
-        data = json.loads(res_text)
-        
-        # Validate data types
-        if 'amount' in data:
-            if isinstance(data['amount'], str):
-                # cleanup string amount
-                 data['amount'] = float(re.sub(r'[^\d.]', '', data['amount']))
-        
-        return data
+# Limits of one batched parse call: the answer needs ~30 tokens per line, the
+# prompt is kept well inside the context window
+BATCH_PARSE_MAX_LINES = 40
+BATCH_PARSE_MAX_CHARS = 12000
+
+def chunk_batch(texts):
+    """Split [(index, text)] into chunks that each fit one batched parse call"""
+    chunk, size = [], 0
+    for index, text in texts:
+        if chunk and (len(chunk) >= BATCH_PARSE_MAX_LINES or size + len(text) > BATCH_PARSE_MAX_CHARS):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((index, text))
+        size += len(text)
+    if chunk:
+        yield chunk
+
+def parse_expenses_with_ai(texts, user=None):
+    """
+    Batch version of parse_expense_with_ai, results in the order of `texts`
+    (None where a line could not be parsed). Lines the local parser and the
+    cache can't answer go to the LLM together, in as few calls as fit.
+    """
+    results = [None] * len(texts)
+    pending = []
+    for index, text in enumerate(texts):
+        started = time.perf_counter()
+        data, source = lookup_parse(text, user)
+        if data is None:
+            pending.append((index, text))
+        else:
+            results[index] = finish_parse(text, data, source, time.perf_counter() - started)
+
+    for chunk in chunk_batch(pending):
+        started = time.perf_counter()
+        parsed = request_expense_parse_batch([text for _, text in chunk])
+        # One call served the whole chunk, every line gets its share of the time
+        elapsed = (time.perf_counter() - started) / len(chunk)
+        for (index, text), data in zip(chunk, parsed):
+            source = 'llm'
+            if data is None:
+                data, source = parse_fallback(text, user), 'fallback'
+            results[index] = finish_parse(text, data, source, elapsed)
+    return results
 
+def get_batch_parse_request(texts):
+    return {
+        'messages': [
+            {"role": "system", "content": BATCH_PARSE_SYSTEM_PROMPT},
+            {"role": "user", "content": format_batch_lines(texts, settings.AI_PARSE_TEXT_MAX_TOKENS)},
+        ],
+        'model': AI_MODEL,
+        'temperature': 0.1,
+        'max_tokens': settings.AI_PARSE_MAX_TOKENS * len(texts),
+    }
+
+def request_expense_parse_batch(texts):
+    """
+    One Groq call for several texts, a list of results (None for the lines
+    the model skipped or returned garbage for).
+    """
+    try:
+        chat_completion = complete('parse_batch', get_batch_parse_request(texts))
+    except LLMUnavailable as e:
+        logger.warning("Batch expense parse failed: %s", e)
+        return [None] * len(texts)
+
+    res_text = chat_completion.choices[0].message.content.strip()
+    json_match = re.search(r'\[.*\]', res_text, re.DOTALL)
+    if json_match:
+        res_text = json_match.group(0)
+    try:
+        items = json.loads(res_text)
     except json.JSONDecodeError:
-        print(f"JSON Decode Error. Raw text: {res_text}")
+        logger.warning("JSON Decode Error. Raw text: %s", res_text)
+        return [None] * len(texts)
+
+    results = [None] * len(texts)
+    for data in items if isinstance(items, list) else []:
+        index = data.pop('index', None) if isinstance(data, dict) else None
+        if isinstance(index, int) and 0 <= index < len(texts):
+            try:
+                results[index] = clean_parse_result(data)
+            except (ValueError, TypeError):
+                pass
+    return results
+
+def get_advice_request(expenses_summary):
+    """chat.completions.create() arguments of the advice call"""
+    return {
+        'messages': [
+            {"role": "system", "content": ADVICE_SYSTEM_PROMPT},
+            {"role": "user", "content": format_summary(expenses_summary, settings.AI_ADVICE_MAX_CATEGORIES)},
+        ],
+        'model': AI_MODEL,
+        'temperature': 0.7,
+        'max_tokens': settings.AI_ADVICE_MAX_TOKENS,
+    }
+
+def get_fallback_advice(expenses_summary):
+    """Rule based tip on the highest spending category, for when the LLM is unavailable"""
+    total = sum(item['total'] for item in expenses_summary)
+    if not total:
+        return "Could not generate advice at this time."
+    top = max(expenses_summary, key=lambda item: item['total'])
+    share = top['total'] / total * 100
+    return (f"You spent {share:.0f}% on {top['category']} this month. "
+            f"Cutting it by 10% would save you Rs. {top['total'] * 0.1:.0f}.")
+
+def get_advice_flight_key(expenses_summary):
+    return f"advice:{json.dumps(expenses_summary, sort_keys=True)}"
+
+def request_budget_advice(expenses_summary):
+    """The model's tip, None when the LLM is unavailable. Concurrent requests for the same summary share one call."""
+    return get_single_flight().do(get_advice_flight_key(expenses_summary), fetch_budget_advice, expenses_summary)
+
+async def arequest_budget_advice(expenses_summary):
+    return await get_single_flight().ado(get_advice_flight_key(expenses_summary), afetch_budget_advice, expenses_summary)
+
+def fetch_budget_advice(expenses_summary):
+    try:
+        chat_completion = complete('advice', get_advice_request(expenses_summary))
+    except LLMUnavailable as e:
+        logger.warning("AI Advice Error: %s", e)
         return None
-    except Exception as e:
-        print(f"Groq AI Error: {e}")
+    return chat_completion.choices[0].message.content.strip()
+
+async def afetch_budget_advice(expenses_summary):
+    try:
+        chat_completion = await acomplete('advice', get_advice_request(expenses_summary))
+    except LLMUnavailable as e:
+        logger.warning("AI Advice Error: %s", e)
         return None
+    return chat_completion.choices[0].message.content.strip()
 
 def get_ai_budget_advice(expenses_summary):
     """
     Generates a personalized budget advice tip based on spending summary.
     summary format: [{'category': 'Food', 'total': 5000}, ...]
     """
-    if not client:
-        return "AI client not initialized."
-        
-    try:
-        # Construct a readable summary string
-        summary_text = ", ".join([f"{item['category']}: {item['total']}" for item in expenses_summary])
-        
-        prompt = f"""
-        Analyze this monthly spending breakdown: {summary_text}.
-        
-        Provide ONE short, specific, and actionable savings tip (max 2 sentences).
-        Focus on the highest spending category.
-        Example: "You spent 40% on Food. diverse cooking at home could save you Rs. 3000."
-        Do NOT be generic. Be direct and helpful.
-        """
-        
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a financial advisor giving brief, actionable tips."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_tokens=100,
-        )
-        
-        return chat_completion.choices[0].message.content.strip()
-        
-    except Exception as e:
-        print(f"AI Advice Error: {e}")
-        return "Could not generate advice at this time."
\ No newline at end of file
+    return request_budget_advice(expenses_summary) or get_fallback_advice(expenses_summary)
+
+async def aget_ai_budget_advice(expenses_summary):
+    """Async get_ai_budget_advice, the LLM call doesn't hold a thread"""
+    return await arequest_budget_advice(expenses_summary) or get_fallback_advice(expenses_summary)
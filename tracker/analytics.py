@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .budget_utils import evaluate_budgets
+from .models import Expense, SpendingRollup
+from .user_cache import cached_for_user, get_user_cache_key
+
+TREND_DAYS = 30
+TREND_MONTHS = 6
+RECENT_EXPENSES = 5
+BUDGET_ALERT_PERCENTAGE = 80
+
+
+def get_dashboard_cache_key(user_id, today=None):
+    # The date is part of the key so trends and budget periods roll over at midnight
+    today = today or timezone.localdate()
+    return get_user_cache_key(user_id, 'dashboard', today.isoformat())
+
+
+def get_dashboard_payload(user):
+    """
+    Cached dashboard analytics for a user, see build_dashboard_payload.
+    Invalidated with the rest of the user's cache namespace.
+    """
+    return cached_for_user(user.pk, 'dashboard', lambda: build_dashboard_payload(user),
+                           parts=[timezone.localdate().isoformat()], timeout=settings.DASHBOARD_CACHE_TIMEOUT)
+
+
+def build_dashboard_payload(user):
+    """
+    Every dashboard series as one JSON serializable dict.
+    Chart data comes from a single rollup query, plus one query for the recent
+    expenses and the budget evaluation.
+    """
+    today = timezone.localdate()
+    trend_start = today - timedelta(days=TREND_DAYS)
+    month = today.replace(day=1)
+    for _ in range(TREND_MONTHS - 1):
+        month = (month - timedelta(days=1)).replace(day=1)
+    months_start = month
+
+    rows = SpendingRollup.objects.filter(
+        Q(granularity=SpendingRollup.MONTH) |
+        Q(granularity=SpendingRollup.DAY, period_start__gte=trend_start),
+        user=user,
+    ).values('granularity', 'period_start', 'category__name').annotate(
+        total=Sum('total'), expense_count=Sum('count')
+    ).order_by('period_start')
+
+    category_totals = {}
+    daily_totals = {}
+    monthly_totals = {}
+    total_spent = 0.0
+    total_expenses = 0
+    for row in rows:
+        if not row['expense_count']:
+            continue
+        amount = float(row['total'])
+        if row['granularity'] == SpendingRollup.DAY:
+            daily_totals[row['period_start']] = daily_totals.get(row['period_start'], 0.0) + amount
+            continue
+        # Month buckets cover the whole history
+        name = row['category__name'] or "Uncategorized"
+        category_totals[name] = category_totals.get(name, 0.0) + amount
+        total_spent += amount
+        total_expenses += row['expense_count']
+        if row['period_start'] >= months_start:
+            monthly_totals[row['period_start']] = monthly_totals.get(row['period_start'], 0.0) + amount
+
+    recent_expenses = Expense.objects.filter(user=user).select_related('category').order_by('-created_at')[:RECENT_EXPENSES]
+
+    budget_alerts = [
+        {
+            'budget_id': status.budget.pk,
+            'category_name': status.budget.category.name if status.budget.category else "Overall",
+            'period': status.budget.period,
+            'amount': float(status.budget.amount),
+            'spent': float(status.spent),
+            'remaining': status.remaining,
+            'percentage': status.percentage,
+            'exceeded': status.exceeded,
+        }
+        for status in evaluate_budgets(user)
+        if status.percentage >= BUDGET_ALERT_PERCENTAGE
+    ]
+
+    return {
+        'labels': list(category_totals),
+        'values': list(category_totals.values()),
+        'total_spent': total_spent,
+        'total_expenses': total_expenses,
+        'avg_expense': total_spent / total_expenses if total_expenses else 0,
+        'trend_dates': [day.strftime('%Y-%m-%d') for day in daily_totals],
+        'trend_amounts': list(daily_totals.values()),
+        'monthly_labels': [month.strftime('%b %Y') for month in monthly_totals],
+        'monthly_values': list(monthly_totals.values()),
+        'recent_expenses': [
+            {
+                'id': expense.pk,
+                'item': expense.item,
+                'amount': float(expense.amount),
+                'category_name': expense.category.name if expense.category else "Uncategorized",
+                'raw_text': expense.raw_text,
+                'created_at': expense.created_at.isoformat(),
+            }
+            for expense in recent_expenses
+        ],
+        'budget_alerts': budget_alerts,
+    }
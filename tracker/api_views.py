@@ -1,11 +1,40 @@
 from rest_framework import viewsets, permissions, status, views
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import Expense, Category, Budget
 from .serializers import ExpenseSerializer, CategorySerializer, BudgetSerializer
-from .ai_utils import parse_expense_with_ai, get_ai_budget_advice
+from asgiref.sync import sync_to_async
+from .advice import advice_path_stats, aget_savings_advice_and_source
+from .ai_utils import aparse_expense_with_ai, get_gateway, get_parse_stats, get_single_flight
+from .analytics import get_dashboard_payload
+from .async_api import AsyncAPIView
+from .budget_utils import get_expense_alerts
+from .conditional import conditional_get
+from .enrichment import defer_expense
+from .ingest import add_expenses_from_lines, create_expense
+from .pagination import ExpenseCursorPagination
+from .user_cache import cached_for_user
+
+# Expenses one enrichment_status request may poll
+ENRICHMENT_STATUS_MAX_IDS = 100
+
+class UserCachedListMixin:
+    """
+    list() responses cached in the user's namespace, one entry per URL (filters
+    and cursor included) and day, until the user's expenses or budgets change.
+    """
+    cache_name = None
+
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return Response(cached_for_user(
+            request.user.pk, self.cache_name, lambda: build(request, *args, **kwargs).data,
+            parts=[timezone.localdate().isoformat(), request.get_host(), request.get_full_path()],
+        ))
 
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
@@ -15,75 +44,178 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Category.objects.all()
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(UserCachedListMixin, viewsets.ModelViewSet):
     serializer_class = ExpenseSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ExpenseCursorPagination
+    cache_name = 'api_expenses'
 
     def get_queryset(self):
-        return Expense.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = Expense.objects.filter(user=self.request.user).select_related('category').order_by('-created_at', '-id')
+        updated_since = self.request.query_params.get('updated_since')
+        if updated_since:
+            # Incremental sync: only what changed since the client's last pull. Deletions are not
+            # reported, clients catch them with a full pull (a 304 while nothing changed)
+            try:
+                updated_since = parse_datetime(updated_since)
+            except ValueError:
+                updated_since = None
+            if updated_since is None:
+                raise ValidationError({'updated_since': "Expected an ISO 8601 datetime"})
+            if timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since)
+            queryset = queryset.filter(updated_at__gt=updated_since)
+        return queryset
+
+    @conditional_get('expenses')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_update(self, serializer):
+        # A manual edit settles the expense, the enrichment worker leaves it alone
+        serializer.save(ai_status=Expense.AI_DONE)
+
+    @action(detail=False, methods=['get'])
+    def enrichment_status(self, request):
+        """
+        Poll expenses saved with "defer": GET ?ids=12,13
+        Enriched ones come with the budget alerts of their category.
+        """
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            return Response({"error": "ids must be comma separated expense ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > ENRICHMENT_STATUS_MAX_IDS:
+            return Response({"error": f"Pass 1 to {ENRICHMENT_STATUS_MAX_IDS} ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        alerts = {}
+        for expense in self.get_queryset().filter(pk__in=ids):
+            data = self.get_serializer(expense).data
+            if expense.ai_status == Expense.AI_DONE:
+                if expense.category_id not in alerts:
+                    alerts[expense.category_id] = get_expense_alerts(request.user, expense.category_id)
+                data['budget_alerts'] = alerts[expense.category_id]
+            results.append(data)
+        return Response({"results": results})
+
     @action(detail=False, methods=['post'])
-    def add_with_ai(self, request):
+    def add_batch_with_ai(self, request):
+        """
+        Add many expenses at once, one per line (bank SMS dumps, notes).
+        Body: { "text": "Uber 350\nCoffee 200" } or { "lines": ["Uber 350", "Coffee 200"] }
+        """
+        lines = request.data.get('lines')
+        if lines is None:
+            text = request.data.get('text')
+            lines = text.splitlines() if isinstance(text, str) else None
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            return Response({"error": "text or lines field is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(lines) > settings.AI_BATCH_MAX_LINES:
+            return Response({"error": f"At most {settings.AI_BATCH_MAX_LINES} lines per request"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = add_expenses_from_lines(request.user, lines)
+        for result in results:
+            if 'expense' in result:
+                result['expense'] = self.get_serializer(result['expense']).data
+        created = sum('expense' in result for result in results)
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
+
+class BudgetViewSet(UserCachedListMixin, viewsets.ModelViewSet):
+    cache_name = 'api_budgets'
+    serializer_class = BudgetSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Budget.objects.filter(user=self.request.user).select_related('category').order_by('-created_at')
+
+    @conditional_get('budgets')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class AddExpenseWithAIView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def post(self, request):
         """
         Custom endpoint to add expense via AI natural language processing.
-        Body: { "text": "Spent 500 on burger" }
+        Body: { "text": "Spent 500 on burger", "defer": false }
+        With "defer" (default AI_DEFER_ENRICHMENT) the expense is saved at once and
+        parsed in the background, the answer is 202 while it is pending.
         """
         text = request.data.get('text')
         if not text:
             return Response({"error": "text field is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        ai_data = parse_expense_with_ai(text)
+        defer = request.data.get('defer', settings.AI_DEFER_ENRICHMENT)
+        if isinstance(defer, str):
+            defer = defer.lower() in ('1', 'true', 'yes')
+        if defer:
+            data, source = await sync_to_async(self.defer_expense)(request.user, text)
+            # Pending expenses are parsed by run_enrichment_worker, poll enrichment_status
+            return Response(data, status=status.HTTP_202_ACCEPTED if source == 'pending' else status.HTTP_201_CREATED,
+                            headers={'X-Parse-Source': source})
+
+        ai_data = await aparse_expense_with_ai(text, user=request.user)
         if not ai_data:
             return Response({"error": "AI could not parse the text"}, status=status.HTTP_400_BAD_REQUEST)
 
-        category_name = ai_data.get('category', 'Others')
-        category, _ = Category.objects.get_or_create(name=category_name)
+        data = await sync_to_async(self.save_expense)(request.user, text, ai_data)
+        # local, cache or llm
+        return Response(data, status=status.HTTP_201_CREATED,
+                        headers={'X-Parse-Source': ai_data['source']})
 
-        expense = Expense.objects.create(
-            user=request.user,
-            item=ai_data.get('item', 'Miscellaneous'),
-            amount=ai_data.get('amount', 0),
-            category=category,
-            raw_text=text
-        )
+    def save_expense(self, user, text, ai_data):
+        expense = create_expense(user, text, ai_data)
+        return ExpenseSerializer(expense, context={'request': self.request}).data
 
-        serializer = self.get_serializer(expense)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def defer_expense(self, user, text):
+        expense, source = defer_expense(user, text)
+        return ExpenseSerializer(expense, context={'request': self.request}).data, source
 
-class BudgetViewSet(viewsets.ModelViewSet):
-    serializer_class = BudgetSerializer
+class AISavingsAdviceView(AsyncAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        return Budget.objects.filter(user=self.request.user).order_by('-created_at')
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+    @conditional_get('advice')
+    async def get(self, request):
+        """
+        Get AI savings advice based on current month's spending.
+        """
+        advice, source = await aget_savings_advice_and_source(request.user)
+        # The rule based tip only stands in while the model is down: no validators, ask again next time
+        headers = {'Cache-Control': 'no-store'} if source == 'fallback' else None
+        return Response({'advice': advice}, headers=headers)
 
-class AISavingsAdviceView(views.APIView):
+class DashboardView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_get('dashboard')
     def get(self, request):
         """
-        Get AI savings advice based on current month's spending.
+        All dashboard series (charts, stats, recent expenses, budget alerts) in one payload.
+        """
+        return Response(get_dashboard_payload(request.user))
+
+class AIStatsView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """
+        Counters of the AI layer in this worker process (staff only).
         """
-        current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        expenses = Expense.objects.filter(
-            user=request.user,
-            created_at__gte=current_month
-        ).values('category__name').annotate(total=Sum('amount')).order_by('-total')
-        
-        summary = []
-        for item in expenses:
-            cat_name = item['category__name'] if item['category__name'] else "Uncategorized"
-            summary.append({'category': cat_name, 'total': float(item['total'])})
-        
-        if not summary:
-            return Response({'advice': "No expenses recorded this month yet! Add some expenses to get advice."})
-            
-        advice = get_ai_budget_advice(summary)
-        return Response({'advice': advice})
+        return Response({
+            'parse': get_parse_stats(),
+            'advice': advice_path_stats.snapshot(),
+            'llm': get_gateway().get_stats(),
+            'single_flight': get_single_flight().get_stats(),
+        })
@@ -0,0 +1,39 @@
+import inspect
+
+from asgiref.sync import sync_to_async
+from rest_framework import views
+
+
+class AsyncAPIView(views.APIView):
+    """
+    APIView whose handlers may be coroutines, for endpoints that mostly wait
+    on the LLM. DRF itself dispatches synchronously: authentication,
+    permissions, throttling and exception handling run through sync_to_async,
+    only the handler runs on the event loop.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = await sync_to_async(self.handle_exception)(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
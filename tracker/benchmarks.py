@@ -0,0 +1,178 @@
+"""
+Helpers shared by the bench_* management commands.
+
+Every measured case runs in a fresh `manage.py` subprocess, so peak RSS of one
+case is not inherited by the next. Benchmarks need a persistent database
+(MySQL, or a SQLite file), an in-memory SQLite database is not shared with
+the subprocesses.
+"""
+import json
+import math
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from .models import Category, Expense
+
+BENCH_USERNAME_PREFIX = '__bench__'
+SEED_BATCH_SIZE = 5000
+
+
+def read_proc_status_kb(field):
+    """A memory field of /proc/self/status in KB, None where procfs is unavailable"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def get_rss_kb():
+    rss = read_proc_status_kb('VmRSS')
+    return rss if rss is not None else get_peak_rss_kb()
+
+
+def get_peak_rss_kb():
+    peak = read_proc_status_kb('VmHWM')
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KB on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def reset_peak_rss():
+    """Reset the RSS high water mark (Linux only), so startup spikes don't count as the case's peak"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def measure(func, *args, **kwargs):
+    """Run func once and report wall time plus peak RSS growth over the process baseline"""
+    reset_peak_rss()
+    baseline_kb = get_rss_kb()
+    started = time.perf_counter()
+    # DEBUG query logging would keep growing with the amount of work, like in production it's off
+    with override_settings(DEBUG=False):
+        result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    peak_kb = get_peak_rss_kb()
+    return {
+        'seconds': round(elapsed, 4),
+        'baseline_rss_kb': baseline_kb,
+        'peak_rss_kb': peak_kb,
+        'peak_rss_growth_kb': max(peak_kb - baseline_kb, 0),
+        'result': result,
+    }
+
+
+def run_case_in_subprocess(command, *args):
+    """Run `manage.py <command> <args>` and parse the JSON it prints last"""
+    output = subprocess.run(
+        [sys.executable, str(settings.BASE_DIR / 'manage.py'), command, *map(str, args)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def seed_bench_user(rows, categories=8):
+    """Create a throwaway user owning `rows` expenses, committed so subprocesses can read them"""
+    user = User.objects.create_user(f'{BENCH_USERNAME_PREFIX}{int(time.time() * 1000)}')
+    category_objs = [
+        Category.objects.get_or_create(name=f'{BENCH_USERNAME_PREFIX}{i}')[0]
+        for i in range(categories)
+    ]
+    with transaction.atomic():
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            Expense.objects.bulk_create([
+                Expense(
+                    user=user,
+                    item=f'Item {i}',
+                    amount=Decimal(i % 5000) + Decimal('0.99'),
+                    category=category_objs[i % categories] if i % 10 else None,
+                    raw_text=f'spent {i % 5000} on item {i}',
+                )
+                for i in range(start, min(start + SEED_BATCH_SIZE, rows))
+            ])
+    return user
+
+
+def drop_bench_user(user):
+    """Remove seeded rows with plain DELETEs, the ORM would load every expense for signals"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {Expense._meta.db_table} WHERE user_id = %s', [user.pk])
+    user.delete()
+    Category.objects.filter(name__startswith=BENCH_USERNAME_PREFIX).delete()
+
+
+def format_kb(kb):
+    return f'{kb / 1024:.1f} MB'
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (0-100) of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)]
+
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_importtime(output):
+    """
+    Totals of `python -X importtime` output: {'import_us', 'modules',
+    'packages': {top level package: microseconds spent in its own modules}}
+    """
+    total = modules = 0
+    packages = Counter()
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        modules += 1
+        packages[name.split('.')[0]] += own
+        if not indent:
+            total += cumulative
+    return {'import_us': total, 'modules': modules, 'packages': dict(packages)}
+
+
+def run_startup(args):
+    """
+    Run `python -X importtime <args>` in a fresh process: wall time, peak RSS
+    and the parsed import times.
+    """
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', *args], cwd=settings.BASE_DIR,
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 instead of wait: the rusage of that one child is its peak RSS
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - started
+        stderr.seek(0)
+        output = stderr.read()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, stderr=output)
+    # ru_maxrss is in bytes on macOS and KB on Linux
+    peak_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return {'seconds': round(elapsed, 4), 'peak_rss_kb': peak_kb, **parse_importtime(output)}
+
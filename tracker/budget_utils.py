@@ -0,0 +1,144 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .user_cache import cached_for_user
+
+
+def get_period_start(period, now=None):
+    """Return the start datetime of the current budget period"""
+    now = now or timezone.now()
+
+    if period == 'daily':
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'weekly':
+        start_date = now - timedelta(days=now.weekday())
+        return start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'yearly':
+        return now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    # 'monthly' and any unknown period
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+@dataclass(frozen=True)
+class BudgetStatus:
+    """Immutable snapshot of a budget against the user's spending"""
+    budget: object
+    spent: Decimal
+    remaining: float
+    percentage: float
+    exceeded: bool
+
+    @classmethod
+    def from_spent(cls, budget, spent):
+        limit = float(budget.amount)
+        percentage = (float(spent) / limit) * 100 if limit else 0
+        return cls(
+            budget=budget,
+            spent=spent,
+            remaining=limit - float(spent),
+            percentage=percentage,
+            exceeded=spent > budget.amount,
+        )
+
+
+def get_rollup_filter(period, now=None):
+    """Rollup buckets that together cover the current budget period"""
+    from .models import SpendingRollup
+
+    start = get_period_start(period, timezone.localtime(now or timezone.now())).date()
+    if period == 'daily':
+        return Q(granularity=SpendingRollup.DAY, period_start=start)
+    if period == 'weekly':
+        return Q(granularity=SpendingRollup.DAY, period_start__gte=start)
+    if period == 'yearly':
+        return Q(granularity=SpendingRollup.YEAR, period_start=start)
+    return Q(granularity=SpendingRollup.MONTH, period_start=start)
+
+
+def get_spent_totals(user, periods, now=None):
+    """
+    Spent totals for every (period, category_id) pair in a single grouped
+    query over the spending rollups. The overall total of a period is stored
+    under category_id None.
+    """
+    from .models import SpendingRollup
+
+    filters = {period: get_rollup_filter(period, now) for period in set(periods)}
+    totals = {}
+    if not filters:
+        return totals
+
+    # The user is repeated inside every branch so each one can be served
+    # by the (user, granularity, period_start) index on its own
+    any_period = Q()
+    for period_filter in filters.values():
+        any_period |= Q(period_filter, user=user)
+
+    rows = SpendingRollup.objects.filter(any_period).values('category_id').annotate(**{
+        period: Sum('total', filter=period_filter)
+        for period, period_filter in filters.items()
+    }).order_by()
+
+    for row in rows:
+        for period in filters:
+            amount = row[period] or Decimal('0')
+            overall_key = (period, None)
+            totals[overall_key] = totals.get(overall_key, Decimal('0')) + amount
+            # Uncategorized expenses only count towards the overall budget
+            if row['category_id'] is not None:
+                totals[(period, row['category_id'])] = amount
+    return totals
+
+
+def evaluate_budgets(user, budgets=None, now=None):
+    """
+    Evaluate budgets of a user in one pass.
+    Pass `budgets` to evaluate a subset, otherwise all of the user's budgets are loaded.
+    Returns a list of BudgetStatus in the same order.
+    """
+    from .models import Budget
+
+    if budgets is None:
+        budgets = Budget.objects.filter(user=user).select_related('category').order_by('-created_at')
+    budgets = list(budgets)
+
+    totals = get_spent_totals(user, [budget.period for budget in budgets], now=now)
+    return [
+        BudgetStatus.from_spent(
+            budget,
+            totals.get((budget.period, budget.category_id), Decimal('0'))
+        )
+        for budget in budgets
+    ]
+
+
+def get_cached_budget_statuses(user):
+    """evaluate_budgets() of all the user's budgets, cached until their expenses or budgets change"""
+    return cached_for_user(user.pk, 'budgets', lambda: evaluate_budgets(user),
+                           parts=[timezone.localdate().isoformat()])
+
+
+def get_expense_alerts(user, category_id):
+    """Warnings for the budgets an expense in `category_id` counts against (its category and overall)"""
+    from .models import Budget
+
+    budgets = Budget.objects.filter(
+        Q(category=category_id) | Q(category__isnull=True),
+        user=user
+    ).select_related('category')
+    alerts = []
+    for status in evaluate_budgets(user, budgets):
+        budget = status.budget
+        if status.exceeded:
+            alerts.append(
+                f"⚠️ Budget Exceeded! {budget.category.name if budget.category else 'Overall'} budget ({budget.period}) exceeded by Rs. {abs(status.remaining):.2f}"
+            )
+        elif status.percentage >= 90:
+            alerts.append(
+                f"⚠️ Budget Alert! {budget.category.name if budget.category else 'Overall'} budget ({budget.period}) is {status.percentage:.1f}% used."
+            )
+    return alerts
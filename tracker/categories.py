@@ -0,0 +1,143 @@
+"""
+Process-local registry of the categories.
+
+Categories are a handful of nearly static rows that every expense insert,
+budget form and serializer needs, so each process keeps them in memory
+instead of querying (and racing on get_or_create) per request. Names are
+matched case and whitespace insensitively.
+
+Saving or deleting a Category clears the registry of this process at once.
+Changes made by other processes are read from the database: the registry
+reloads the table (a handful of rows, one query) once it is
+CATEGORY_REGISTRY_CHECK_SECONDS old, whatever the cache backend. An unknown
+name or id always reloads once before giving up, so a category created
+elsewhere is found before that.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import Category
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = 'Others'
+NAME_MAX_LENGTH = Category._meta.get_field('name').max_length
+
+
+def clean_category_name(name):
+    """The name to store: on one line, within the column, 'Others' when empty"""
+    return ' '.join(str(name or '').split())[:NAME_MAX_LENGTH] or DEFAULT_CATEGORY
+
+
+def normalize_category_name(name):
+    return clean_category_name(name).casefold()
+
+
+class CategoryRegistry:
+    def __init__(self, check_interval=10):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.by_name = None
+        self.by_id = None
+        self.loaded_at = 0
+        self.loads = 0
+
+    def clear(self):
+        with self.lock:
+            self.by_name = self.by_id = None
+
+    def load(self):
+        categories = list(Category.objects.order_by('name', 'pk'))
+        by_name = {}
+        for category in categories:
+            # Names differing only in case: the oldest row wins
+            previous = by_name.get(normalize_category_name(category.name))
+            if previous is None or category.pk < previous.pk:
+                by_name[normalize_category_name(category.name)] = category
+        by_id = {category.pk: category for category in categories}
+        with self.lock:
+            self.by_name, self.by_id = by_name, by_id
+            self.loaded_at = time.monotonic()
+            self.loads += 1
+        return by_name, by_id
+
+    def get_maps(self):
+        """(by normalized name, by id), loaded or refreshed when needed"""
+        by_name, by_id = self.by_name, self.by_id
+        if by_id is None or time.monotonic() - self.loaded_at >= self.check_interval:
+            return self.load()
+        return by_name, by_id
+
+    def get(self, pk):
+        """Category with that id, None if there is none"""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        _, by_id = self.get_maps()
+        if pk not in by_id:
+            _, by_id = self.load()
+        return by_id.get(pk)
+
+    def get_by_name(self, name):
+        key = normalize_category_name(name)
+        by_name, _ = self.get_maps()
+        if key not in by_name:
+            by_name, _ = self.load()
+        return by_name.get(key)
+
+    def all(self):
+        """Every category, by name"""
+        _, by_id = self.get_maps()
+        return sorted(by_id.values(), key=lambda category: (category.name, category.pk))
+
+    def resolve(self, names):
+        """{name: Category} for every name, creating the missing ones in one INSERT"""
+        keys = {name: normalize_category_name(name) for name in names}
+        by_name, _ = self.get_maps()
+        if any(key not in by_name for key in keys.values()):
+            by_name, _ = self.load()
+            missing = {}
+            for name, key in keys.items():
+                if key not in by_name:
+                    missing.setdefault(key, clean_category_name(name))
+            if missing:
+                # Another process may create the same names meanwhile, the unique name makes that harmless
+                Category.objects.bulk_create([Category(name=name) for name in missing.values()],
+                                             ignore_conflicts=True)
+                by_name, _ = self.load()
+        return {name: by_name[key] for name, key in keys.items()}
+
+    def get_stats(self):
+        return {'categories': len(self.by_id or ()), 'loads': self.loads}
+
+
+_registry = None
+
+
+def get_category_registry():
+    global _registry
+    if _registry is None:
+        _registry = CategoryRegistry(check_interval=settings.CATEGORY_REGISTRY_CHECK_SECONDS)
+    return _registry
+
+
+def invalidate_categories():
+    """A Category changed: reload this process now and after the commit, the others reload on their own"""
+    registry = get_category_registry()
+    registry.clear()
+    # Another thread may reload before the change is committed
+    transaction.on_commit(registry.clear)
+
+
+def preload_categories():
+    """Fill the registry when a server process starts, so the first requests don't wait on it"""
+    try:
+        get_category_registry().load()
+    except DatabaseError as e:
+        # Not migrated yet or the database is down: the first lookup loads it
+        logger.warning("Categories not preloaded: %s", e)
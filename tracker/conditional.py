@@ -0,0 +1,101 @@
+"""
+Conditional GET for the API endpoints clients poll.
+
+Every write to a user's expenses or budgets bumps their DataVersion row
+(from the model signals, and from ingest for its bulk inserts). Responses
+carry an ETag built from that version and the URL, and a Last-Modified of
+the last change; a client sending them back gets a 304 after one primary key
+lookup, before any serializer, cache or LLM call runs.
+"""
+import functools
+import hashlib
+import inspect
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import DataVersion
+
+
+def bump_data_version(user_id):
+    now = timezone.now()
+    if DataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, changed_at=now):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(user_id=user_id, version=1, changed_at=now)
+    except IntegrityError:
+        # Another request created the row first
+        DataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, changed_at=now)
+
+
+def get_data_version(user_id):
+    """(version, changed_at) of the user's data, (0, None) before their first write"""
+    return DataVersion.objects.filter(user_id=user_id).values_list('version', 'changed_at').first() or (0, None)
+
+
+def get_validators(request, name):
+    """
+    (ETag, Last-Modified timestamp) of the `name` response at the request's URL.
+    Last-Modified has whole seconds, so it is None while the second of the last
+    change isn't over: a second write within it would not move it.
+    """
+    version, changed_at = get_data_version(request.user.pk)
+    today = timezone.localdate()
+    # Budget periods and the dashboard series roll over at midnight without any write
+    midnight = timezone.make_aware(datetime.combine(today, time.min))
+    last_modified = max(changed_at, midnight) if changed_at else midnight
+    variant = f"{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}|{today.isoformat()}"
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:16]
+    last_modified = int(last_modified.timestamp())
+    if int(timezone.now().timestamp()) <= last_modified:
+        last_modified = None
+    return quote_etag(f"{name}-{request.user.pk}-{version}-{digest}"), last_modified
+
+
+def set_validators(response, etag, last_modified):
+    # Only full answers, and not the ones the view asked clients not to keep
+    if response.status_code not in (200, 304) or 'no-store' in response.get('Cache-Control', ''):
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_get(name):
+    """
+    Decorates the get()/list() of an API view (sync or async): a 304 when the
+    client's If-None-Match / If-Modified-Since still match, else the view's
+    response with ETag and Last-Modified set, unless it says Cache-Control:
+    no-store. The version is read before the view reads the data, so a write
+    in between only costs the client a 200.
+    """
+    def decorator(method):
+        def check(request):
+            etag, last_modified = get_validators(request, name)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            return not_modified, etag, last_modified
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                not_modified, etag, last_modified = await sync_to_async(check)(request)
+                if not_modified is not None:
+                    return set_validators(not_modified, etag, last_modified)
+                return set_validators(await method(self, request, *args, **kwargs), etag, last_modified)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            not_modified, etag, last_modified = check(request)
+            if not_modified is not None:
+                return set_validators(not_modified, etag, last_modified)
+            return set_validators(method(self, request, *args, **kwargs), etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,147 @@
+"""
+Deferred AI enrichment. With AI_DEFER_ENRICHMENT (or "defer" on the API) an
+expense the local parser and the parse cache can't answer is saved at once
+as "pending", with the amount guessed from the text and no category, and
+`manage.py run_enrichment_worker` parses the pending rows in batches later.
+
+Like the export queue this is DB-backed: workers claim rows with a
+conditional UPDATE, any number of them can poll the same table.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .ai_utils import finish_parse, lookup_parse, parse_expenses_with_ai
+from .ingest import clean_amount, create_expense, resolve_categories
+from .local_parser import get_item_phrase, parse_amounts
+from .models import Expense
+
+logger = logging.getLogger(__name__)
+
+
+def guess_expense(text):
+    """(item, amount) from the text alone, good enough to show until the LLM answers"""
+    amounts = parse_amounts(text)
+    amount = clean_amount(sum(amount for amount, _ in amounts)) if amounts else None
+    phrase = get_item_phrase(text, amounts[0][1]) if len(amounts) == 1 else text.strip()
+    item = ' '.join(word.capitalize() for word in phrase.split())[:255] or 'Miscellaneous'
+    return item, amount or 0
+
+
+def defer_expense(user, text):
+    """
+    Save an expense without waiting on the LLM, returns (expense, source).
+    Texts the local parser or the cache know are saved complete, the others
+    as pending.
+    """
+    started = time.perf_counter()
+    data, source = lookup_parse(text, user)
+    if data is not None:
+        finish_parse(text, data, source, time.perf_counter() - started)
+        return create_expense(user, text, data), source
+
+    item, amount = guess_expense(text)
+    expense = Expense.objects.create(
+        user=user, item=item, amount=amount, category=None, raw_text=text, ai_status=Expense.AI_PENDING
+    )
+    return expense, 'pending'
+
+
+def requeue_stale_expenses():
+    """
+    Put back rows claimed by a worker that died before finishing them. The
+    claim counts as an attempt, a row that keeps killing workers ends failed.
+    Returns (requeued, failed) counts.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_ENRICH_STALE_SECONDS)
+    stale = Expense.objects.filter(ai_status=Expense.AI_PROCESSING, ai_claimed_at__lt=cutoff)
+    failed = stale.filter(ai_attempts__gte=settings.AI_ENRICH_MAX_ATTEMPTS - 1).update(
+        ai_status=Expense.AI_FAILED, ai_attempts=F('ai_attempts') + 1
+    )
+    requeued = stale.update(ai_status=Expense.AI_PENDING, ai_attempts=F('ai_attempts') + 1)
+    return requeued, failed
+
+
+def claim_pending_expenses(limit):
+    """
+    Atomically move up to `limit` of the oldest pending expenses to processing.
+    Rows that already failed an attempt wait AI_ENRICH_RETRY_SECONDS first.
+    """
+    retry_cutoff = timezone.now() - timedelta(seconds=settings.AI_ENRICH_RETRY_SECONDS)
+    pending = Expense.objects.filter(
+        Q(ai_claimed_at__isnull=True) | Q(ai_claimed_at__lt=retry_cutoff), ai_status=Expense.AI_PENDING
+    ).order_by('created_at')
+    claimed = []
+    for expense_id in pending.values_list('pk', flat=True)[:limit]:
+        # Another worker may have been faster
+        if Expense.objects.filter(pk=expense_id, ai_status=Expense.AI_PENDING).update(
+            ai_status=Expense.AI_PROCESSING, ai_claimed_at=timezone.now()
+        ):
+            claimed.append(expense_id)
+    return list(Expense.objects.filter(pk__in=claimed).select_related('user').order_by('created_at'))
+
+
+def enrich_expenses(expenses):
+    """
+    Parse claimed expenses, one batched parse per user, and save the results.
+    Returns {'done', 'retry', 'failed', 'skipped'} counts.
+    """
+    counts = dict.fromkeys(['done', 'retry', 'failed', 'skipped'], 0)
+    by_user = defaultdict(list)
+    for expense in expenses:
+        by_user[expense.user].append(expense)
+
+    for user, user_expenses in by_user.items():
+        try:
+            parsed = parse_expenses_with_ai([expense.raw_text for expense in user_expenses], user=user)
+        except Exception:
+            # Don't leave the claimed rows in processing, count the attempt like a failed parse
+            logger.exception("Enrichment of %s expense(s) of user %s failed", len(user_expenses), user.pk)
+            for expense in user_expenses:
+                counts[save_enrichment(expense, None, None, {})] += 1
+            continue
+        # The lenient fallback parse only stands in for the LLM, retry those rows later
+        results = [
+            (expense, data if data and data['source'] != 'fallback' else None)
+            for expense, data in zip(user_expenses, parsed)
+        ]
+        categories = resolve_categories({data.get('category') or 'Others' for _, data in results if data})
+        for expense, data in results:
+            amount = clean_amount(data.get('amount', 0)) if data else None
+            counts[save_enrichment(expense, data, amount, categories)] += 1
+    return counts
+
+
+def save_enrichment(expense, data, amount, categories):
+    with transaction.atomic():
+        # Skip rows the user edited meanwhile (they are no longer processing)
+        current = Expense.objects.select_for_update().filter(
+            pk=expense.pk, ai_status=Expense.AI_PROCESSING
+        ).first()
+        if current is None:
+            return 'skipped'
+        if data and amount is not None:
+            current.item = (data.get('item') or 'Miscellaneous')[:255]
+            current.amount = amount
+            current.category = categories[data.get('category') or 'Others']
+            current.ai_status = Expense.AI_DONE
+            current.ai_claimed_at = None
+            outcome = 'done'
+        else:
+            # ai_claimed_at stays as the time of this attempt, for the retry delay
+            current.ai_attempts += 1
+            failed = current.ai_attempts >= settings.AI_ENRICH_MAX_ATTEMPTS
+            current.ai_status = Expense.AI_FAILED if failed else Expense.AI_PENDING
+            outcome = 'failed' if failed else 'retry'
+            if failed:
+                # The guess stays, the user can still edit it
+                logger.warning("Expense %s could not be parsed after %s attempts", current.pk, current.ai_attempts)
+        # Signals move the rollups to the new category/amount
+        current.save()
+    return outcome
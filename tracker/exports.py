@@ -0,0 +1,128 @@
+"""
+Expense exports. The Excel and PDF writers live in exports_excel and
+exports_pdf and are imported on first use, so processes that never export
+don't pay for importing openpyxl and ReportLab.
+"""
+import csv
+import tempfile
+from dataclasses import dataclass
+from io import StringIO
+
+from django.db.models import Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Expense
+from .pagination import paginate_by_keyset
+
+EXPORT_HEADERS = ['Date', 'Item', 'Category', 'Amount', 'Original Text']
+EXPORT_BATCH_SIZE = 2000
+EXCEL_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def get_export_queryset(user):
+    return Expense.objects.filter(user=user).select_related('category').order_by('-created_at')
+
+
+def get_export_filename(extension):
+    return f'expenses_{timezone.now().strftime("%Y%m%d")}.{extension}'
+
+
+def iter_expenses(queryset, batch_size=None, progress=None):
+    """
+    Newest first iteration in keyset batches (EXPORT_BATCH_SIZE by default).
+    Unlike QuerySet.iterator() this keeps memory flat on MySQL too, where the
+    driver buffers whole result sets. `progress(rows_done)` is called after
+    every batch.
+    """
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    cursor = None
+    done = 0
+    while True:
+        page = paginate_by_keyset(queryset, cursor=cursor, page_size=batch_size)
+        yield from page
+        done += len(page)
+        if progress:
+            progress(done)
+        if not page.next_cursor:
+            return
+        cursor = page.next_cursor
+
+
+def get_export_row(expense):
+    return [
+        expense.created_at.strftime("%Y-%m-%d %H:%M"),
+        expense.item,
+        expense.category.name if expense.category else "Uncategorized",
+        expense.amount,
+        expense.raw_text,
+    ]
+
+
+def iter_csv(queryset, batch_size=None, progress=None):
+    """Yield the CSV file in chunks of `batch_size` rows"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+
+    for count, expense in enumerate(iter_expenses(queryset, batch_size, progress), start=1):
+        writer.writerow(get_export_row(expense))
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_csv(queryset, file, user=None, progress=None):
+    for chunk in iter_csv(queryset, progress=progress):
+        file.write(chunk.encode('utf-8'))
+
+
+def csv_response(queryset):
+    response = StreamingHttpResponse(iter_csv(queryset), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{get_export_filename("csv")}"'
+    return response
+
+
+def write_excel(queryset, file, user=None, progress=None):
+    """openpyxl is only imported by the first Excel export"""
+    from .exports_excel import write_workbook
+    write_workbook(iter_expenses(queryset, progress=progress), file)
+
+
+def excel_response(queryset):
+    """Build the workbook in an anonymous temp file and stream it back in blocks"""
+    file = tempfile.TemporaryFile()
+    try:
+        write_excel(queryset, file)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    # FileResponse closes (and so deletes) the temp file once it has been sent
+    return FileResponse(file, as_attachment=True, filename=get_export_filename('xlsx'),
+                        content_type=EXCEL_CONTENT_TYPE)
+
+
+def write_pdf(queryset, file, user=None, progress=None):
+    # The total comes from one aggregate, the rows are only read once, in keyset batches
+    total = queryset.order_by().aggregate(total=Sum('amount'))['total'] or 0
+    from .exports_pdf import PdfReport
+    PdfReport(file, user, total).write(iter_expenses(queryset, progress=progress))
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    writer: object
+    extension: str
+    content_type: str
+
+
+# Every format can be written to a file, used by the background export jobs
+EXPORT_FORMATS = {
+    'csv': ExportFormat(write_csv, 'csv', 'text/csv'),
+    'excel': ExportFormat(write_excel, 'xlsx', EXCEL_CONTENT_TYPE),
+    'pdf': ExportFormat(write_pdf, 'pdf', 'application/pdf'),
+}
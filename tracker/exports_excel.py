@@ -0,0 +1,35 @@
+"""
+Excel export, imported on the first Excel export only: openpyxl takes
+longer to import than the rest of the app.
+"""
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from .exports import EXPORT_HEADERS
+
+
+def write_workbook(expenses, file):
+    """
+    Write the workbook in openpyxl's write-only mode, rows are flushed to disk
+    as they are appended instead of being kept as cell objects in memory.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Expenses")
+    ws.append(EXPORT_HEADERS)
+
+    # Excel has no time zones, dates are stored as local wall clock time
+    tz = timezone.get_current_timezone()
+    for expense in expenses:
+        date_cell = WriteOnlyCell(ws, value=expense.created_at.astimezone(tz).replace(tzinfo=None))
+        date_cell.number_format = 'yyyy-mm-dd hh:mm'
+        amount_cell = WriteOnlyCell(ws, value=expense.amount)
+        amount_cell.number_format = '#,##0.00'
+        ws.append([
+            date_cell,
+            expense.item,
+            expense.category.name if expense.category else "Uncategorized",
+            amount_cell,
+            expense.raw_text,
+        ])
+    wb.save(file)
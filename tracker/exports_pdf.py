@@ -0,0 +1,140 @@
+"""
+PDF export drawn with ReportLab, imported on the first PDF export only.
+"""
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+
+# PDF layout, in points. Mirrors tracker/expense_report_pdf.html
+PDF_MARGIN = 2 * cm
+PDF_ROW_HEIGHT = 18
+PDF_FONT_SIZE = 10
+PDF_ACCENT = colors.HexColor('#4f46e5')
+PDF_MUTED = colors.HexColor('#9ca3af')
+PDF_BORDER = colors.HexColor('#e5e7eb')
+PDF_HEADER_FILL = colors.HexColor('#f3f4f6')
+# (title, share of the table width, right aligned)
+PDF_COLUMNS = [('Date', 0.2, False), ('Item', 0.3, False), ('Category', 0.2, False), ('Amount (Rs.)', 0.3, True)]
+
+
+def fit_text(text, width, font='Helvetica', size=PDF_FONT_SIZE):
+    """Cut `text` with an ellipsis so it fits in `width` points"""
+    if stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + '...', font, size) > width:
+        text = text[:-1]
+    return text + '...'
+
+
+class PdfReport:
+    """
+    Draws the expense report straight onto a ReportLab canvas, one row at a
+    time. Nothing is laid out ahead, so time and memory grow linearly with
+    the number of rows, unlike xhtml2pdf on one big HTML table.
+    """
+
+    def __init__(self, file, user, total_amount, today=None):
+        self.canvas = Canvas(file, pagesize=A4, pageCompression=1)
+        self.canvas.setTitle('Expense Report')
+        self.width, self.height = A4
+        self.user = user
+        self.total_amount = total_amount
+        self.today = timezone.localtime(today or timezone.now())
+        self.table_width = self.width - 2 * PDF_MARGIN
+        self.page_number = 0
+        self.columns = []
+        x = PDF_MARGIN
+        for title, share, right in PDF_COLUMNS:
+            col_width = self.table_width * share
+            self.columns.append((title, x, col_width, right))
+            x += col_width
+
+    def draw_report_header(self):
+        c = self.canvas
+        y = self.height - PDF_MARGIN - 24
+        c.setFillColor(PDF_ACCENT)
+        c.setFont('Helvetica-Bold', 24)
+        c.drawCentredString(self.width / 2, y, 'Expense History Report')
+        y -= 20
+        c.setFillColor(colors.black)
+        c.setFont('Helvetica', PDF_FONT_SIZE)
+        c.drawCentredString(self.width / 2, y, 'Finance Tracker')
+        y -= 10
+        c.setStrokeColor(PDF_ACCENT)
+        c.setLineWidth(2)
+        c.line(PDF_MARGIN, y, self.width - PDF_MARGIN, y)
+        y -= 30
+        c.setFont('Helvetica-Bold', PDF_FONT_SIZE)
+        c.drawString(PDF_MARGIN, y, 'User:')
+        c.drawString(PDF_MARGIN, y - 16, 'Date Generated:')
+        c.setFont('Helvetica', PDF_FONT_SIZE)
+        c.drawString(PDF_MARGIN + 30, y, self.user.username if self.user else '')
+        c.drawString(PDF_MARGIN + 85, y - 16, self.today.strftime('%d %b %Y, %I:%M %p'))
+        return y - 36
+
+    def start_page(self):
+        """Open a new page and draw the table header, returns the y of the first row"""
+        if self.page_number:
+            self.finish_page()
+        self.page_number += 1
+        y = self.draw_report_header() if self.page_number == 1 else self.height - PDF_MARGIN
+        c = self.canvas
+        c.setFillColor(PDF_HEADER_FILL)
+        c.rect(PDF_MARGIN, y - PDF_ROW_HEIGHT, self.table_width, PDF_ROW_HEIGHT, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor('#4b5563'))
+        c.setFont('Helvetica-Bold', PDF_FONT_SIZE)
+        self.draw_cells([title for title, _, _, _ in self.columns], y)
+        c.setFillColor(colors.HexColor('#333333'))
+        c.setFont('Helvetica', PDF_FONT_SIZE)
+        return y - PDF_ROW_HEIGHT
+
+    def finish_page(self):
+        c = self.canvas
+        c.setStrokeColor(PDF_BORDER)
+        c.setLineWidth(1)
+        c.line(PDF_MARGIN, PDF_MARGIN, self.width - PDF_MARGIN, PDF_MARGIN)
+        c.setFillColor(PDF_MUTED)
+        c.setFont('Helvetica', 8)
+        c.drawCentredString(self.width / 2, PDF_MARGIN - 12,
+                            f'\u00a9 {self.today.year} Finance Tracker. All rights reserved. Page {self.page_number}')
+        c.showPage()
+
+    def draw_cells(self, values, y):
+        c = self.canvas
+        baseline = y - PDF_ROW_HEIGHT + 6
+        for value, (_, x, col_width, right) in zip(values, self.columns):
+            if right:
+                c.drawRightString(x + col_width - 6, baseline, value)
+            else:
+                c.drawString(x + 6, baseline, fit_text(value, col_width - 12))
+        c.setStrokeColor(PDF_BORDER)
+        c.setLineWidth(0.5)
+        c.line(PDF_MARGIN, y - PDF_ROW_HEIGHT, self.width - PDF_MARGIN, y - PDF_ROW_HEIGHT)
+
+    def write(self, expenses):
+        # Room for the footer below the last row
+        bottom = PDF_MARGIN + PDF_ROW_HEIGHT
+        tz = timezone.get_current_timezone()
+        y = self.start_page()
+        for expense in expenses:
+            if y - PDF_ROW_HEIGHT < bottom:
+                y = self.start_page()
+            self.draw_cells([
+                expense.created_at.astimezone(tz).strftime('%d %b %Y'),
+                expense.item,
+                expense.category.name if expense.category else "Uncategorized",
+                str(expense.amount),
+            ], y)
+            y -= PDF_ROW_HEIGHT
+
+        if y - 30 < bottom:
+            y = self.start_page()
+        c = self.canvas
+        c.setFillColor(PDF_ACCENT)
+        c.setFont('Helvetica-Bold', 14)
+        c.drawRightString(self.width - PDF_MARGIN, y - 30, f'Total Spent: Rs. {self.total_amount:.2f}')
+        self.finish_page()
+        self.canvas.save()
@@ -0,0 +1,99 @@
+"""
+Bulk expense creation from natural language, one expense per line.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from . import rollups
+from .ai_utils import parse_expenses_with_ai
+from .categories import get_category_registry
+from .conditional import bump_data_version
+from .local_parser import invalidate_keyword_index
+from .models import Expense
+
+AMOUNT_FIELD = Expense._meta.get_field('amount')
+MAX_AMOUNT = Decimal(10) ** (AMOUNT_FIELD.max_digits - AMOUNT_FIELD.decimal_places)
+
+
+def resolve_categories(names):
+    """{name: Category} for every name, from the registry, creating the missing ones in one INSERT"""
+    return get_category_registry().resolve(names)
+
+
+def create_expense(user, text, data):
+    """Save one parsed expense (add_expense, add_with_ai)"""
+    # Safely handle category mapping
+    name = data.get('category') or 'Others'
+    category = resolve_categories([name])[name]
+    return Expense.objects.create(
+        user=user,
+        item=data.get('item', 'Miscellaneous'),
+        amount=data.get('amount', 0),
+        category=category,
+        raw_text=text,
+    )
+
+
+def clean_amount(amount):
+    try:
+        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+    return amount if 0 < amount < MAX_AMOUNT else None
+
+
+def add_expenses_from_lines(user, lines):
+    """
+    Parse every non blank line and save the expenses in one transaction.
+    Returns one result per line: {'line', 'text', 'source', 'expense'} for
+    saved lines, {'line', 'text', 'error'} for the others.
+    """
+    entries = [(number, text.strip()) for number, text in enumerate(lines, start=1) if text and text.strip()]
+    parsed = parse_expenses_with_ai([text for _, text in entries], user=user)
+
+    results = []
+    valid = []
+    for (number, text), data in zip(entries, parsed):
+        if not data:
+            results.append({'line': number, 'text': text, 'error': "AI could not parse the text"})
+            continue
+        amount = clean_amount(data.get('amount', 0))
+        if amount is None:
+            results.append({'line': number, 'text': text, 'error': "No valid amount found"})
+            continue
+        result = {'line': number, 'text': text, 'source': data['source']}
+        results.append(result)
+        valid.append((result, data, amount))
+
+    if not valid:
+        return results
+
+    categories = resolve_categories({data.get('category') or 'Others' for _, data, _ in valid})
+    expenses = [
+        Expense(
+            user=user,
+            item=(data.get('item') or 'Miscellaneous')[:255],
+            amount=amount,
+            category=categories[data.get('category') or 'Others'],
+            raw_text=result['text'],
+        )
+        for result, data, amount in valid
+    ]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Expense.objects.bulk_create(expenses)
+            # bulk_create sends no signals, do what the save handlers would do
+            rollups.record_expenses_added(expenses)
+            invalidate_keyword_index(user.pk)
+            # Also moves the user's cached pages and API lists to a new namespace
+            bump_data_version(user.pk)
+        else:
+            # MySQL does not report the ids of a bulk insert, and a concurrent insert for the
+            # same user can take ids in between: one INSERT per row, the save handlers do the rest
+            for expense in expenses:
+                expense.save()
+
+    for (result, _, _), expense in zip(valid, expenses):
+        result['expense'] = expense
+    return results
@@ -0,0 +1,121 @@
+"""
+DB-backed queue for report exports, drained by `manage.py run_export_worker`.
+No broker is needed: workers claim pending rows with a conditional UPDATE, so
+any number of them can poll the same table.
+"""
+import logging
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .exports import EXPORT_FORMATS, get_export_filename, get_export_queryset
+from .models import ExportJob, SpendingRollup
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_MIN_INTERVAL = 1  # seconds between progress writes
+
+
+def get_expense_count(user):
+    """Number of expenses of a user, read from the yearly rollups"""
+    return SpendingRollup.objects.filter(
+        user=user, granularity=SpendingRollup.YEAR
+    ).aggregate(count=Sum('count'))['count'] or 0
+
+
+def should_run_in_background(user, format):
+    """Large exports are queued instead of being rendered inside the request"""
+    return get_expense_count(user) > settings.EXPORT_ASYNC_THRESHOLD
+
+
+def enqueue_export(user, format):
+    """The user's unfinished job for that format (a refresh or a prefetch of the link), else a new one"""
+    job = ExportJob.objects.filter(
+        user=user, format=format, status__in=[ExportJob.PENDING, ExportJob.RUNNING]
+    ).order_by('-created_at').first()
+    if job is None:
+        job = ExportJob.objects.create(user=user, format=format, total_rows=get_expense_count(user))
+    return job
+
+
+def claim_next_job():
+    """Atomically move the oldest pending job to running, None if the queue is empty"""
+    pending = ExportJob.objects.filter(status=ExportJob.PENDING).order_by('created_at')
+    for job_id in pending.values_list('pk', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(pk=job_id, status=ExportJob.PENDING).update(
+            status=ExportJob.RUNNING, started_at=now, updated_at=now, attempts=F('attempts') + 1
+        )
+        # Another worker may have been faster
+        if claimed:
+            return ExportJob.objects.select_related('user').get(pk=job_id)
+    return None
+
+
+def run_export_job(job):
+    """Write the job's report into EXPORT_ROOT and record the outcome"""
+    export_format = EXPORT_FORMATS[job.format]
+    file_name = f"{job.pk}_{get_export_filename(export_format.extension)}"
+    path = Path(settings.EXPORT_ROOT) / file_name
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    last_report = [timezone.now()]
+
+    def progress(rows_done):
+        # Throttled, every write also serves as the job's heartbeat
+        now = timezone.now()
+        if (now - last_report[0]).total_seconds() >= PROGRESS_MIN_INTERVAL:
+            ExportJob.objects.filter(pk=job.pk).update(processed_rows=rows_done, updated_at=now)
+            last_report[0] = now
+
+    try:
+        with open(path, 'wb') as file:
+            export_format.writer(get_export_queryset(job.user), file, user=job.user, progress=progress)
+    except Exception as e:
+        logger.exception("Export job %s failed", job.pk)
+        path.unlink(missing_ok=True)
+        job.status = ExportJob.FAILED
+        job.error = str(e) or e.__class__.__name__
+    else:
+        job.status = ExportJob.DONE
+        job.file_name = file_name
+        job.processed_rows = job.total_rows
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'file_name', 'processed_rows', 'finished_at', 'updated_at'])
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Jobs whose worker died mid-way stop sending progress, put them back in the
+    queue. Those that already had EXPORT_JOB_MAX_ATTEMPTS tries fail instead,
+    they may be what kills the worker. Returns (requeued, failed) counts.
+    """
+    now = timezone.now()
+    stale = ExportJob.objects.filter(
+        status=ExportJob.RUNNING, updated_at__lt=now - timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS)
+    )
+    failed = stale.filter(attempts__gte=settings.EXPORT_JOB_MAX_ATTEMPTS).update(
+        status=ExportJob.FAILED, error="The export worker stopped responding", finished_at=now, updated_at=now
+    )
+    requeued = stale.filter(attempts__lt=settings.EXPORT_JOB_MAX_ATTEMPTS).update(
+        status=ExportJob.PENDING, processed_rows=0, started_at=None, updated_at=now
+    )
+    return requeued, failed
+
+
+def purge_expired_jobs():
+    """Delete finished jobs (and their files) older than EXPORT_RETENTION_HOURS"""
+    cutoff = timezone.now() - timedelta(hours=settings.EXPORT_RETENTION_HOURS)
+    expired = ExportJob.objects.filter(status__in=[ExportJob.DONE, ExportJob.FAILED], finished_at__lt=cutoff)
+    count = 0
+    for job in expired:
+        path = job.get_file_path()
+        if path:
+            path.unlink(missing_ok=True)
+        job.delete()
+        count += 1
+    return count
@@ -0,0 +1,326 @@
+"""
+Every call to the model goes through the LLMGateway: per-call deadlines,
+jittered retries of transient errors, a circuit breaker that fails fast while
+Groq is down, one pooled HTTP transport per process (per event loop for the
+async client, where the loop is long-lived) and metrics for /api/ai/stats/.
+
+The backend is the Groq SDK, or with LLM_BACKEND = 'simulator' the local
+replay/latency simulator of tracker.llm_simulator. The gateway only needs
+clients shaped like groq.Groq (chat.completions.create), so tests and
+benchmarks can plug in their own. Point LLM_BASE_URL at a local stub server
+to exercise the real SDK offline.
+
+The SDK (groq, httpx, pydantic) is imported and the clients are built on the
+first call, not when the module is imported: worker boots, management
+commands and tests that never reach the model don't pay for it.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .llm_simulator import LLMRecorder, LLMSimulator
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+UNSET = object()
+
+
+def get_retryable_errors():
+    import groq
+    return (
+        groq.APIConnectionError,  # includes APITimeoutError
+        groq.RateLimitError,
+        groq.InternalServerError,
+    )
+
+
+class LLMUnavailable(Exception):
+    """No answer from the model: not configured, circuit open, or every attempt failed"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls, then rejects calls
+    for `reset_timeout` seconds. After that a single trial call is let through
+    (half open): success closes the circuit, failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("LLM circuit opened after %s failure(s)", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+
+    def abandon(self):
+        """A call let through ended without a verdict on the model (cancelled, unexpected error)"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                # Give the trial back, the next call tries again
+                self.trial_running = False
+
+    def get_state(self):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.state
+
+
+class LLMGateway:
+
+    def __init__(self, api_key, base_url=None, timeout=15, deadline=30, max_retries=2, backoff=0.5,
+                 max_connections=20, failure_threshold=5, reset_timeout=30, max_concurrency=32,
+                 async_clients=True, simulator=None, recorder=None):
+        self.api_key = api_key
+        self.simulator = simulator
+        # Successful completions are saved for the simulator to replay
+        self.recorder = recorder
+        self.base_url = base_url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        # Without long-lived event loops acomplete() runs complete() in a thread instead
+        self.async_clients = async_clients
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.client_lock = threading.Lock()
+        self._client = UNSET
+        # Async clients and semaphores are bound to the event loop they were first used in
+        self.async_states = weakref.WeakKeyDictionary()
+
+        self.stats_lock = threading.Lock()
+        self.latency = Histogram()
+        self.counters = dict.fromkeys(['calls', 'successes', 'failures', 'retries', 'rejected'], 0)
+
+    @classmethod
+    def from_settings(cls):
+        if settings.LLM_BACKEND not in ('groq', 'simulator'):
+            raise ImproperlyConfigured(f"LLM_BACKEND must be 'groq' or 'simulator', not {settings.LLM_BACKEND!r}")
+        simulator = LLMSimulator.from_settings(settings) if settings.LLM_BACKEND == 'simulator' else None
+        recorder = LLMRecorder(settings.LLM_RECORDINGS) if settings.LLM_RECORDINGS and simulator is None else None
+        return cls(
+            api_key=os.getenv("GROQ_API_KEY"),
+            base_url=settings.LLM_BASE_URL,
+            timeout=settings.LLM_TIMEOUT,
+            deadline=settings.LLM_DEADLINE,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff=settings.LLM_RETRY_BACKOFF,
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            reset_timeout=settings.LLM_BREAKER_RESET_SECONDS,
+            max_concurrency=settings.AI_MAX_CONCURRENCY,
+            async_clients=settings.LLM_ASYNC_CLIENTS,
+            simulator=simulator,
+            recorder=recorder,
+        )
+
+    @property
+    def client(self):
+        """The sync client, built on first use"""
+        if self._client is UNSET:
+            with self.client_lock:
+                if self._client is UNSET:
+                    self._client = self.make_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def get_limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    def make_client(self):
+        if self.simulator is not None:
+            return self.simulator.make_client()
+        if not self.api_key:
+            return None
+        import groq
+        import httpx
+        # Retries are ours, the SDK's own would multiply with them
+        return groq.Groq(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout,
+                         http_client=httpx.Client(limits=self.get_limits()))
+
+    def make_async_client(self):
+        if self.simulator is not None:
+            return self.simulator.make_async_client()
+        if not self.api_key:
+            return None
+        import groq
+        import httpx
+        return groq.AsyncGroq(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout,
+                              http_client=httpx.AsyncClient(limits=self.get_limits()))
+
+    def get_async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self.async_states.get(loop)
+        if state is None:
+            state = (self.make_async_client(), asyncio.Semaphore(self.max_concurrency))
+            self.async_states[loop] = state
+        return state
+
+    # Bookkeeping shared by the sync and async paths
+
+    def count(self, counter):
+        with self.stats_lock:
+            self.counters[counter] += 1
+
+    def start_call(self, client):
+        if client is None:
+            raise LLMUnavailable("Groq client not initialized, check GROQ_API_KEY")
+        self.count('calls')
+        if not self.breaker.allow():
+            self.count('rejected')
+            raise LLMUnavailable("LLM circuit is open")
+        return time.monotonic() + self.deadline
+
+    def get_attempt_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return min(self.timeout, remaining)
+
+    def get_retry_delay(self, attempt, error, deadline):
+        """Seconds to wait before the next attempt, None when giving up"""
+        if attempt >= self.max_retries or not isinstance(error, get_retryable_errors()):
+            return None
+        # Full jitter, so clients that failed together don't retry together
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self.count('retries')
+        return delay
+
+    def succeed(self, started, request, completion):
+        if self.recorder is not None:
+            self.recorder.record(request, completion.choices[0].message.content)
+        self.breaker.record_success()
+        self.count('successes')
+        self.latency.observe(time.monotonic() - started)
+
+    def fail(self, started, error):
+        self.breaker.record_failure()
+        self.count('failures')
+        self.latency.observe(time.monotonic() - started)
+        logger.warning("LLM call failed: %s", error)
+        raise LLMUnavailable(str(error)) from error
+
+    def complete(self, **request):
+        """chat.completions.create(**request) with deadline, retries and the circuit breaker"""
+        import groq
+        deadline = self.start_call(self.client)
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                timeout = self.get_attempt_timeout(deadline)
+                if timeout is None:
+                    self.fail(started, TimeoutError("LLM deadline exceeded"))
+                try:
+                    completion = self.client.chat.completions.create(timeout=timeout, **request)
+                except groq.GroqError as e:
+                    delay = self.get_retry_delay(attempt, e, deadline)
+                    if delay is None:
+                        self.fail(started, e)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.succeed(started, request, completion)
+                return completion
+        except LLMUnavailable:
+            raise
+        except BaseException:
+            self.breaker.abandon()
+            raise
+
+    async def acomplete(self, **request):
+        """Async complete(), at most max_concurrency calls in flight per event loop"""
+        if not self.async_clients:
+            # A loop per request (WSGI): a client on it would never be reused nor closed
+            return await sync_to_async(self.complete, thread_sensitive=False)(**request)
+        import groq
+        async_client, semaphore = self.get_async_state()
+        deadline = self.start_call(async_client)
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    async with semaphore:
+                        # Time spent queueing for the semaphore counts against the deadline
+                        timeout = self.get_attempt_timeout(deadline)
+                        if timeout is None:
+                            self.fail(started, TimeoutError("LLM deadline exceeded"))
+                        completion = await async_client.chat.completions.create(timeout=timeout, **request)
+                except groq.GroqError as e:
+                    delay = self.get_retry_delay(attempt, e, deadline)
+                    if delay is None:
+                        self.fail(started, e)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.succeed(started, request, completion)
+                return completion
+        except LLMUnavailable:
+            raise
+        except BaseException:
+            # Cancelled when the client disconnects under ASGI
+            self.breaker.abandon()
+            raise
+
+    def get_stats(self):
+        with self.stats_lock:
+            counters = dict(self.counters)
+        finished = counters['successes'] + counters['failures']
+        return {
+            **counters,
+            'error_rate': round(counters['failures'] / finished, 4) if finished else 0.0,
+            'breaker_state': self.breaker.get_state(),
+            'latency': self.latency.snapshot(),
+            **({'simulator': self.simulator.get_stats()} if self.simulator is not None else {}),
+        }
@@ -0,0 +1,212 @@
+"""
+Local stand-in for the Groq API, selected with LLM_BACKEND = 'simulator'.
+
+It replays responses recorded from the real API (LLM_RECORDINGS, written
+while running on Groq) and synthesizes deterministic answers for prompts it
+has no recording of. Latency follows a log-normal distribution around
+LLM_SIM_LATENCY_MS, and LLM_SIM_ERRORS injects the failures the gateway has
+to handle: timeouts, 429s and 5xx.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from .local_parser import get_item_phrase, parse_amounts
+from .prompts import BATCH_PARSE_SYSTEM_PROMPT, PARSE_SYSTEM_PROMPT
+
+ERROR_KINDS = ('timeout', 'rate_limit', 'server')
+CATEGORY_HINTS = {
+    'Food': ('food', 'pizza', 'burger', 'coffee', 'lunch', 'dinner', 'breakfast', 'grocer', 'swiggy', 'zomato'),
+    'Transport': ('uber', 'ola', 'taxi', 'cab', 'bus', 'metro', 'train', 'fuel', 'petrol'),
+    'Bills': ('bill', 'electricity', 'recharge', 'internet', 'wifi', 'rent'),
+    'Shopping': ('shirt', 'shoes', 'amazon', 'flipkart', 'clothes'),
+    'Health': ('doctor', 'medicine', 'pharmacy', 'hospital', 'gym'),
+    'Entertainment': ('movie', 'netflix', 'concert', 'game'),
+}
+ADVICE_TIPS = (
+    "Your top category takes most of your spending, set a weekly cap on it and review it every Sunday.",
+    "Cooking at home twice more a week would cut your largest expense noticeably.",
+    "Move recurring bills to cheaper plans, small monthly savings add up over the year.",
+)
+BATCH_LINE_RE = re.compile(r'^(\d+): (.*)$', re.MULTILINE)
+
+
+def get_request_key(request):
+    """Recordings are keyed on the model and the exact messages"""
+    payload = json.dumps({'model': request.get('model'), 'messages': request.get('messages')}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def parse_error_rates(value):
+    """'server:0.02,timeout:0.01' to {'server': 0.02, 'timeout': 0.01}"""
+    rates = {}
+    for part in filter(None, (part.strip() for part in (value or '').split(','))):
+        kind, _, rate = part.partition(':')
+        if kind not in ERROR_KINDS:
+            raise ValueError(f"Unknown simulated error {kind!r}, expected one of {', '.join(ERROR_KINDS)}")
+        rates[kind] = float(rate)
+    return rates
+
+
+def load_recordings(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+class LLMRecorder:
+    """Saves every successful completion to a JSON file for the simulator to replay"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.responses = None
+
+    def record(self, request, content):
+        with self.lock:
+            if self.responses is None:
+                self.responses = load_recordings(self.path)
+            self.responses[get_request_key(request)] = content
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump(self.responses, file, ensure_ascii=False, indent=1)
+            os.replace(temporary, self.path)
+
+
+def guess_category(text):
+    lowered = text.lower()
+    for category, hints in CATEGORY_HINTS.items():
+        if any(hint in lowered for hint in hints):
+            return category
+    return 'Others'
+
+
+def synthesize_parse(text):
+    amounts = parse_amounts(text)
+    phrase = get_item_phrase(text, amounts[0][1]) if len(amounts) == 1 else text
+    return {
+        'item': ' '.join(word.capitalize() for word in phrase.split()) or 'Miscellaneous',
+        'amount': float(sum(amount for amount, _ in amounts)),
+        'category': guess_category(text),
+    }
+
+
+def synthesize_response(request):
+    """What the model would plausibly answer, for prompts without a recording"""
+    system, prompt = request['messages'][0]['content'], request['messages'][-1]['content']
+    if system == BATCH_PARSE_SYSTEM_PROMPT:
+        return json.dumps([
+            {'index': int(index), **synthesize_parse(text)} for index, text in BATCH_LINE_RE.findall(prompt)
+        ])
+    if system == PARSE_SYSTEM_PROMPT:
+        return json.dumps(synthesize_parse(prompt))
+    digest = int(hashlib.sha1(prompt.encode('utf-8')).hexdigest(), 16)
+    return ADVICE_TIPS[digest % len(ADVICE_TIPS)]
+
+
+def make_completion(request, content):
+    prompt_tokens = sum(len(message['content']) for message in request['messages']) // 4
+    completion_tokens = len(content) // 4
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=content), finish_reason='stop')],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens),
+        model=request.get('model'),
+    )
+
+
+class LLMSimulator:
+    """
+    Deterministic for a given seed: the sequence of latencies and injected
+    errors only depends on the order of the calls.
+    """
+
+    def __init__(self, recordings=None, latency_ms=800, latency_sigma=0.5, error_rates=None, seed=0):
+        self.recordings = recordings or {}
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rates = error_rates or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.replayed = 0
+        self.synthesized = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            recordings=load_recordings(settings.LLM_RECORDINGS),
+            latency_ms=settings.LLM_SIM_LATENCY_MS,
+            latency_sigma=settings.LLM_SIM_LATENCY_SIGMA,
+            error_rates=parse_error_rates(settings.LLM_SIM_ERRORS),
+            seed=settings.LLM_SIM_SEED,
+        )
+
+    def draw(self, timeout):
+        """(seconds to wait, error kind or None) of the next call"""
+        with self.lock:
+            latency = self.latency_ms / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+            roll = self.random.random()
+        error = None
+        for kind, rate in self.error_rates.items():
+            if roll < rate:
+                error = kind
+                break
+            roll -= rate
+        if error == 'timeout' or (timeout is not None and latency > timeout):
+            return (timeout if timeout is not None else latency), 'timeout'
+        return latency, error
+
+    def raise_error(self, error):
+        # The SDK's exceptions, imported as late as the gateway imports the SDK
+        import groq
+        import httpx
+        http_request = httpx.Request('POST', 'http://llm-simulator/openai/v1/chat/completions')
+        if error == 'timeout':
+            raise groq.APITimeoutError(request=http_request)
+        if error == 'rate_limit':
+            raise groq.RateLimitError("Simulated rate limit", response=httpx.Response(429, request=http_request),
+                                      body=None)
+        raise groq.InternalServerError("Simulated server error",
+                                       response=httpx.Response(503, request=http_request), body=None)
+
+    def answer(self, request, error):
+        if error is not None:
+            self.raise_error(error)
+        content = self.recordings.get(get_request_key(request))
+        with self.lock:
+            if content is None:
+                self.synthesized += 1
+            else:
+                self.replayed += 1
+        if content is None:
+            content = synthesize_response(request)
+        return make_completion(request, content)
+
+    def create(self, timeout=None, **request):
+        delay, error = self.draw(timeout)
+        time.sleep(delay)
+        return self.answer(request, error)
+
+    async def acreate(self, timeout=None, **request):
+        delay, error = self.draw(timeout)
+        await asyncio.sleep(delay)
+        return self.answer(request, error)
+
+    def make_client(self):
+        """An object shaped like groq.Groq as far as the gateway is concerned"""
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+    def make_async_client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.acreate)))
+
+    def get_stats(self):
+        with self.lock:
+            return {'replayed': self.replayed, 'synthesized': self.synthesized}
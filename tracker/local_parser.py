@@ -0,0 +1,175 @@
+"""
+Deterministic parser for simply structured expense texts ("uber 350",
+"spent Rs 1200 on pizza"), tried before the LLM.
+
+Amounts come from a tokenizer, categories from a keyword index learned from
+the user's own past expenses. Anything ambiguous (several amounts, unknown or
+disputed keywords) is left to the LLM, parse_fallback() takes over when the
+LLM can't be reached.
+"""
+import re
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Expense
+
+# Past expenses the keyword index is learned from
+KEYWORD_INDEX_ROWS = 1000
+KEYWORD_INDEX_TIMEOUT = 3600
+# Past expenses that must agree on a keyword before it is trusted
+MIN_SUPPORT = 2
+
+AMOUNT_TOKEN_RE = re.compile(
+    r'(?<![\w.])(?:(?:rs\.?|inr|₹|\$)\s*)?'
+    r'(\d{1,3}(?:,\d{2,3})+|\d+)(\.\d{1,2})?\s*(k\b)?'
+    r'(?:\s*(?:rs\b\.?|rupees\b|inr\b|/-))?',
+    re.IGNORECASE,
+)
+WORD_RE = re.compile(r"[a-z][a-z'&-]*")
+FILLER_WORDS = {
+    'a', 'an', 'and', 'at', 'bought', 'buy', 'for', 'from', 'i', 'in', 'inr', 'my', 'of', 'on',
+    'paid', 'pay', 'rs', 'rupees', 'spend', 'spent', 'the', 'to', 'today', 'was', 'with', 'yesterday',
+}
+
+
+def parse_amounts(text):
+    """Every amount in `text` as (Decimal, match)"""
+    amounts = []
+    for match in AMOUNT_TOKEN_RE.finditer(text):
+        try:
+            amount = Decimal(match.group(1).replace(',', '') + (match.group(2) or ''))
+        except InvalidOperation:
+            continue
+        if match.group(3):
+            amount *= 1000
+        amounts.append((amount, match))
+    return amounts
+
+
+def get_keywords(phrase):
+    return [word for word in WORD_RE.findall(phrase.lower()) if len(word) > 2 and word not in FILLER_WORDS]
+
+
+def get_item_phrase(text, match):
+    """The words around the amount, without leading/trailing filler ("spent ... on")"""
+    words = (text[:match.start()] + ' ' + text[match.end():]).split()
+    while words and words[0].lower().strip('.,!') in FILLER_WORDS:
+        words.pop(0)
+    while words and words[-1].lower().strip('.,!') in FILLER_WORDS:
+        words.pop()
+    return ' '.join(words).strip(' .,!-:')
+
+
+def get_keyword_index_cache_key(user_id):
+    return f"keyword_index:{user_id}"
+
+
+def invalidate_keyword_index(user_id):
+    transaction.on_commit(lambda: cache.delete(get_keyword_index_cache_key(user_id)))
+
+
+def build_keyword_index(user):
+    """
+    {'items': {lower item: (item, {category: count})}, 'keywords': {word: {category: count}}}
+    from the user's latest expenses.
+    """
+    items = {}
+    item_categories = defaultdict(Counter)
+    keywords = defaultdict(Counter)
+    rows = Expense.objects.filter(user=user).order_by('-created_at').values_list(
+        'item', 'category__name'
+    )[:KEYWORD_INDEX_ROWS]
+    for item, category in rows:
+        if not item or not category:
+            continue
+        key = item.lower()
+        items.setdefault(key, item)
+        item_categories[key][category] += 1
+        for word in set(get_keywords(item)):
+            keywords[word][category] += 1
+    return {
+        'items': {key: (items[key], dict(counts)) for key, counts in item_categories.items()},
+        'keywords': {word: dict(counts) for word, counts in keywords.items()},
+    }
+
+
+def get_keyword_index(user):
+    key = get_keyword_index_cache_key(user.pk)
+    index = cache.get(key)
+    if index is None:
+        index = build_keyword_index(user)
+        cache.set(key, index, KEYWORD_INDEX_TIMEOUT)
+    return index
+
+
+def guess_category(phrase, index):
+    """
+    (category, confidence) from the past expenses with the same item, or from
+    those sharing the phrase's keywords while the item itself is too rare. Confidence is the winning category's share.
+    """
+    known = index['items'].get(phrase.lower())
+    votes = Counter(known[1] if known else {})
+    if sum(votes.values()) < MIN_SUPPORT:
+        votes = Counter()
+        for word in get_keywords(phrase):
+            votes.update(index['keywords'].get(word, {}))
+    if not votes:
+        return None, 0.0
+    category, top = votes.most_common(1)[0]
+    if top < MIN_SUPPORT:
+        return category, 0.0
+    return category, top / sum(votes.values())
+
+
+def parse_locally(text, user):
+    """
+    Parse result in the LLM's format, or None when the text is not simple
+    enough to be parsed with AI_LOCAL_PARSE_MIN_CONFIDENCE.
+    """
+    amounts = parse_amounts(text)
+    if len(amounts) != 1:
+        return None
+    amount, match = amounts[0]
+    phrase = get_item_phrase(text, match)
+    if not phrase or not get_keywords(phrase):
+        return None
+
+    index = get_keyword_index(user)
+    category, confidence = guess_category(phrase, index)
+    if confidence < settings.AI_LOCAL_PARSE_MIN_CONFIDENCE:
+        return None
+    known = index['items'].get(phrase.lower())
+    return {
+        # Reuse the user's own spelling of the item when there is one
+        'item': known[0] if known else ' '.join(word.capitalize() for word in phrase.split()),
+        'amount': float(amount),
+        'category': category,
+    }
+
+
+def parse_fallback(text, user=None):
+    """
+    Best effort parse for when the LLM is unavailable: any text with exactly
+    one amount is accepted, with the best category guess (or Others) whatever
+    its confidence. None when there is no single amount.
+    """
+    amounts = parse_amounts(text)
+    if len(amounts) != 1:
+        return None
+    amount, match = amounts[0]
+    phrase = get_item_phrase(text, match)
+    category = None
+    known = None
+    if phrase and user is not None:
+        index = get_keyword_index(user)
+        category, _ = guess_category(phrase, index)
+        known = index['items'].get(phrase.lower())
+    return {
+        'item': known[0] if known else ' '.join(word.capitalize() for word in phrase.split()) or 'Miscellaneous',
+        'amount': float(amount),
+        'category': category or 'Others',
+    }
@@ -0,0 +1,174 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from rest_framework import permissions, views
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from tracker import advice, ai_utils
+from tracker.advice import get_month_summary, get_savings_advice
+from tracker.benchmarks import drop_bench_user, percentile, seed_bench_user
+from tracker.llm_gateway import LLMGateway
+from tracker.rollups import rebuild_rollups
+
+URL = '/api/advice/'
+
+
+def make_completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class SimulatedCompletions:
+    """Stands in for the clients' chat.completions, answers after a random delay"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        with self.lock:
+            return self.random.uniform(*self.latency)
+
+    async def acreate(self, **kwargs):
+        await asyncio.sleep(self.draw())
+        return make_completion("Cook at home more often.")
+
+    def create(self, **kwargs):
+        time.sleep(self.draw())
+        return make_completion("Cook at home more often.")
+
+
+def simulated_gateway(latency):
+    """A gateway built from the current settings whose clients are simulated"""
+    completions = SimulatedCompletions(latency)
+    gateway = LLMGateway.from_settings()
+    gateway.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=completions.create)))
+    gateway.make_async_client = lambda: SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=completions.acreate)))
+    return gateway
+
+
+class Unshared:
+    """Stands in for the single flight: every request waits on a model call of its own"""
+
+    def do(self, key, fn, *args):
+        return fn(*args)
+
+    async def ado(self, key, fn, *args):
+        return await fn(*args)
+
+
+def uncached(gateway):
+    """
+    The bench user's advice would be cached (and shared in flight) after the
+    first request, each request has to reach the model for the comparison
+    """
+    return [
+        mock.patch.object(ai_utils, 'get_gateway', return_value=gateway),
+        mock.patch.object(ai_utils, 'get_single_flight', return_value=Unshared()),
+        mock.patch.object(advice, 'lookup_advice', side_effect=lambda user: (get_month_summary(user), None)),
+    ]
+
+
+class SyncAdviceView(views.APIView):
+    """/api/advice/ as it was before the async views: the worker thread waits out the LLM call"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response({'advice': get_savings_advice(request.user)})
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'elapsed': elapsed,
+    }
+
+
+class Command(BaseCommand):
+    help = "Load test /api/advice/ with simulated LLM latency: sync workers vs one event loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Sync (WSGI) worker threads of the baseline (default: 8)")
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help="Requests in flight against the ASGI handler (default: 100)")
+        parser.add_argument('--latency', type=float, nargs=2, default=[1.0, 3.0], metavar=('MIN', 'MAX'),
+                            help="Simulated model latency range in seconds (default: 1 3)")
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        user = seed_bench_user(20)
+        # The advice is built from the month's rollups, which the seeding bulk insert skips
+        rebuild_rollups([user])
+        try:
+            self.stdout.write(f"{'mode':<34} {'req/s':>8} {'p50':>7} {'p95':>7} {'wall':>8}")
+            self.report(f"sync, {options['workers']} WSGI workers", self.run_sync(user, options))
+            for limit in sorted({options['concurrency'], 32}):
+                with override_settings(AI_MAX_CONCURRENCY=limit):
+                    result = asyncio.run(self.run_async(user, options))
+                self.report(f"async, AI_MAX_CONCURRENCY={limit}", result)
+        finally:
+            drop_bench_user(user)
+
+    def report(self, mode, result):
+        self.stdout.write(
+            f"{mode:<34} {result['rps']:>8.1f} {result['p50']:>6.2f}s {result['p95']:>6.2f}s {result['elapsed']:>7.1f}s"
+        )
+
+    def run_sync(self, user, options):
+        """The old sync view, every worker thread is blocked for the whole LLM round trip"""
+        view = SyncAdviceView.as_view()
+        factory = APIRequestFactory()
+
+        def request(_):
+            started = time.perf_counter()
+            http_request = factory.get(URL)
+            force_authenticate(http_request, user=user)
+            response = view(http_request)
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+
+        with ExitStack() as stack:
+            for patcher in uncached(simulated_gateway(options['latency'])):
+                stack.enter_context(patcher)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['workers']) as pool:
+                latencies = list(pool.map(request, range(options['requests'])))
+            return summarize(latencies, time.perf_counter() - started)
+
+    async def run_async(self, user, options):
+        """All requests share one event loop and its async client, like under an ASGI server"""
+        http = AsyncClient()
+        await http.aforce_login(user)
+        gate = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with gate:
+                started = time.perf_counter()
+                response = await http.get(URL)
+                assert response.status_code == 200, response.status_code
+                return time.perf_counter() - started
+
+        gateway = simulated_gateway(options['latency'])
+        gateway.async_clients = True
+        with ExitStack() as stack:
+            for patcher in uncached(gateway):
+                stack.enter_context(patcher)
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*[request() for _ in range(options['requests'])])
+            return summarize(latencies, time.perf_counter() - started)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.test.utils import override_settings
+
+from tracker import ai_utils
+from tracker.benchmarks import drop_bench_user, percentile, seed_bench_user
+from tracker.llm_gateway import LLMGateway
+from tracker.llm_simulator import LLMSimulator, load_recordings, parse_error_rates
+from tracker.rollups import rebuild_rollups
+
+FLOWS = {
+    'add': ('post', '/api/expenses/add_with_ai/'),
+    'advice': ('get', '/api/advice/'),
+}
+ITEMS = [
+    'pizza', 'uber to office', 'coffee', 'electricity bill', 'movie tickets', 'groceries', 'gym membership',
+    'metro card recharge', 'new shoes', 'doctor visit', 'netflix', 'lunch with team', 'petrol', 'internet bill',
+]
+
+
+def make_texts(count, seed):
+    """Expense texts with the repetition of real traffic: a few items, amounts that vary"""
+    rng = random.Random(seed)
+    return [f"{rng.choice(['spent', 'paid', ''])} {rng.randrange(50, 3000)} on {rng.choice(ITEMS)}".strip()
+            for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = ("Latency percentiles and throughput of the add-expense and advice flows under load, "
+            "with the LLM simulated (recorded responses, log-normal latency, injected errors)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flows', nargs='+', choices=list(FLOWS), default=list(FLOWS))
+        parser.add_argument('--requests', type=int, default=300, help="Requests per flow (default: 300)")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight (default: 50)")
+        parser.add_argument('--users', type=int, default=20, help="Seeded users the requests are spread over")
+        parser.add_argument('--latency-ms', type=float, default=settings.LLM_SIM_LATENCY_MS,
+                            help="Median simulated model latency (default: LLM_SIM_LATENCY_MS)")
+        parser.add_argument('--sigma', type=float, default=settings.LLM_SIM_LATENCY_SIGMA,
+                            help="Log-normal sigma of the latency (default: LLM_SIM_LATENCY_SIGMA)")
+        parser.add_argument('--errors', default=settings.LLM_SIM_ERRORS,
+                            help="Injected errors, e.g. server:0.05,timeout:0.01 (default: LLM_SIM_ERRORS)")
+        parser.add_argument('--seed', type=int, default=settings.LLM_SIM_SEED)
+        parser.add_argument('--json', action='store_true', help="Print one JSON object per flow, for CI")
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        try:
+            error_rates = parse_error_rates(options['errors'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        users = [seed_bench_user(50, categories=4) for _ in range(options['users'])]
+        rebuild_rollups(users)
+        try:
+            if not options['json']:
+                self.stdout.write(f"{'flow':<8} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}  sources")
+            for flow in options['flows']:
+                simulator = LLMSimulator(
+                    recordings=load_recordings(settings.LLM_RECORDINGS), latency_ms=options['latency_ms'],
+                    latency_sigma=options['sigma'], error_rates=error_rates, seed=options['seed'],
+                )
+                gateway = LLMGateway(
+                    api_key=None, timeout=settings.LLM_TIMEOUT, deadline=settings.LLM_DEADLINE,
+                    max_retries=settings.LLM_MAX_RETRIES, backoff=settings.LLM_RETRY_BACKOFF,
+                    failure_threshold=settings.LLM_BREAKER_FAILURES, reset_timeout=settings.LLM_BREAKER_RESET_SECONDS,
+                    max_concurrency=settings.AI_MAX_CONCURRENCY, simulator=simulator,
+                )
+                # Every flow starts cold: no cached parses or advice
+                cache.clear()
+                ai_utils.get_parse_cache().clear()
+                with mock.patch.object(ai_utils, 'get_gateway', return_value=gateway), \
+                        mock.patch.object(ai_utils, 'get_single_flight', return_value=ai_utils.SingleFlight()):
+                    result = asyncio.run(self.run_flow(flow, users, options))
+                result['llm'] = gateway.get_stats()
+                self.report(flow, result, options)
+        finally:
+            for user in users:
+                drop_bench_user(user)
+
+    async def run_flow(self, flow, users, options):
+        method, url = FLOWS[flow]
+        rng = random.Random(options['seed'])
+        texts = make_texts(options['requests'], options['seed'])
+        clients = {}
+        for user in users:
+            clients[user.pk] = AsyncClient()
+            await clients[user.pk].aforce_login(user)
+        gate = asyncio.Semaphore(options['concurrency'])
+
+        async def request(number):
+            http = clients[rng.choice(users).pk]
+            async with gate:
+                started = time.perf_counter()
+                if method == 'post':
+                    response = await http.post(url, {'text': texts[number]}, content_type='application/json')
+                else:
+                    response = await http.get(url)
+                return time.perf_counter() - started, response.status_code, response.get('X-Parse-Source', '')
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[request(number) for number in range(options['requests'])])
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for latency, _, _ in results)
+        return {
+            'flow': flow,
+            'requests': len(results),
+            'errors': sum(status >= 400 for _, status, _ in results),
+            'rps': round(len(results) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'sources': dict(Counter(source for _, _, source in results if source)),
+        }
+
+    def report(self, flow, result, options):
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+            return
+        sources = ', '.join(f"{source} {count}" for source, count in sorted(result['sources'].items())) or '-'
+        llm = result['llm']
+        self.stdout.write(
+            f"{flow:<8} {result['rps']:>8.1f} {result['p50_ms']:>6.0f}ms {result['p95_ms']:>6.0f}ms "
+            f"{result['p99_ms']:>6.0f}ms {result['errors']:>7}  {sources}"
+        )
+        self.stdout.write(
+            f"{'':<8} llm calls {llm['calls']}, retries {llm['retries']}, failures {llm['failures']}, "
+            f"rejected {llm['rejected']}, breaker {llm['breaker_state']}"
+        )
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+
+from tracker.benchmarks import drop_bench_user, percentile, seed_bench_user
+
+# (CONN_MAX_AGE, CONN_HEALTH_CHECKS) of each mode, None keeps the configured value
+MODES = {
+    'per_request': (0, False),
+    'persistent': (600, False),
+    'health_checked': (600, True),
+    'configured': (None, None),
+}
+
+
+class Command(BaseCommand):
+    help = ("Per-request latency of a cheap API endpoint with a new database connection per request "
+            "against persistent (and health checked) connections, through the WSGI handler")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--requests', type=int, default=500, help="Requests per mode (default: 500)")
+        parser.add_argument('--threads', type=int, default=4, help="Server threads (default: 4)")
+        parser.add_argument('--url', default='/api/categories/', help="Endpoint to request (default: /api/categories/)")
+        parser.add_argument('--json', action='store_true', help="Print one JSON object per mode, for CI")
+
+    # DEBUG would log every query, production runs without it
+    @override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False)
+    def handle(self, *args, **options):
+        user = seed_bench_user(10, categories=4)
+        client = Client()
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        database = connections['default'].settings_dict
+        configured = (database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS'])
+        # The seeding connection of this thread must not be reused by the first mode
+        connection.close()
+        try:
+            if not options['json']:
+                self.stdout.write(f"{database['ENGINE'].rsplit('.', 1)[-1]}, {options['threads']} threads, "
+                                  f"configured CONN_MAX_AGE={configured[0]} CONN_HEALTH_CHECKS={configured[1]}")
+                self.stdout.write(f"{'mode':<15} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'connects':>9}")
+            for mode in options['modes']:
+                max_age, health_checks = MODES[mode]
+                database['CONN_MAX_AGE'] = configured[0] if max_age is None else max_age
+                database['CONN_HEALTH_CHECKS'] = configured[1] if health_checks is None else health_checks
+                result = self.run_mode(options, cookie)
+                self.report(mode, result, options)
+        finally:
+            database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS'] = configured
+            drop_bench_user(user)
+
+    def run_mode(self, options, cookie):
+        handler = WSGIHandler()
+        environ = RequestFactory()._base_environ(PATH_INFO=options['url'], REQUEST_METHOD='GET', HTTP_COOKIE=cookie)
+        lock = threading.Lock()
+        connects = 0
+
+        def count_connect(sender, **kwargs):
+            nonlocal connects
+            with lock:
+                connects += 1
+
+        def request(_):
+            started = time.perf_counter()
+            response = handler(dict(environ), lambda status, headers: None)
+            b''.join(response)
+            # What the WSGI server does at the end of a request: fires request_finished,
+            # which closes the connection unless it is persistent
+            response.close()
+            return time.perf_counter() - started, response.status_code
+
+        barrier = threading.Barrier(options['threads'])
+
+        def close_connection(_):
+            # The barrier makes every thread of the pool take one of these
+            barrier.wait()
+            connection.close()
+
+        connection_created.connect(count_connect)
+        try:
+            with ThreadPoolExecutor(options['threads']) as pool:
+                started = time.perf_counter()
+                results = list(pool.map(request, range(options['requests'])))
+                elapsed = time.perf_counter() - started
+                # Persistent connections belong to the pool's threads, close them before the next mode
+                list(pool.map(close_connection, range(options['threads'])))
+        finally:
+            connection_created.disconnect(count_connect)
+
+        latencies = sorted(latency for latency, _ in results)
+        return {
+            'requests': len(results),
+            'errors': sum(status >= 400 for _, status in results),
+            'rps': round(len(results) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'connects': connects,
+        }
+
+    def report(self, mode, result, options):
+        if options['json']:
+            self.stdout.write(json.dumps({'mode': mode, **result}))
+            return
+        self.stdout.write(
+            f"{mode:<15} {result['rps']:>8.1f} {result['p50_ms']:>6.2f}ms {result['p95_ms']:>6.2f}ms "
+            f"{result['p99_ms']:>6.2f}ms {result['connects']:>9}"
+            + (f"  ({result['errors']} errors)" if result['errors'] else "")
+        )
@@ -0,0 +1,173 @@
+import argparse
+import csv
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from openpyxl import Workbook
+from xhtml2pdf import pisa
+
+from tracker.benchmarks import drop_bench_user, format_kb, measure, run_case_in_subprocess, seed_bench_user
+from tracker.exports import get_export_queryset
+from tracker.views import export_expenses
+
+
+def legacy_csv_export(user):
+    """The pre-streaming implementation, kept as the baseline"""
+    expenses = get_export_queryset(user)
+    response = HttpResponse(content_type='text/csv')
+    writer = csv.writer(response)
+    writer.writerow(['Date', 'Item', 'Category', 'Amount', 'Original Text'])
+    for expense in expenses:
+        writer.writerow([
+            expense.created_at.strftime("%Y-%m-%d %H:%M"),
+            expense.item,
+            expense.category.name if expense.category else "Uncategorized",
+            expense.amount,
+            expense.raw_text
+        ])
+    return response
+
+
+def legacy_excel_export(user):
+    """The pre write-only implementation, kept as the baseline"""
+    expenses = get_export_queryset(user)
+    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Expenses"
+    ws.append(['Date', 'Item', 'Category', 'Amount', 'Original Text'])
+    for expense in expenses:
+        ws.append([
+            expense.created_at.strftime("%Y-%m-%d %H:%M"),
+            expense.item,
+            expense.category.name if expense.category else "Uncategorized",
+            float(expense.amount),
+            expense.raw_text
+        ])
+    wb.save(response)
+    return response
+
+
+def legacy_pdf_export(user):
+    """The xhtml2pdf implementation (one HTML table for the whole history), kept as the baseline"""
+    expenses = get_export_queryset(user)
+    context = {
+        'expenses': expenses,
+        'user': user,
+        'today': timezone.now(),
+        'total_amount': expenses.aggregate(total=Sum('amount'))['total'] or 0
+    }
+    response = HttpResponse(content_type='application/pdf')
+    html = get_template('tracker/expense_report_pdf.html').render(context)
+    pisa_status = pisa.CreatePDF(html, dest=response)
+    if pisa_status.err:
+        raise CommandError('We had some errors while generating PDF.')
+    return response
+
+
+def current_export(format):
+    def export(user):
+        request = RequestFactory().get(f'/export/{format}/')
+        request.user = user
+        # Measure rendering itself, large histories would otherwise just be queued
+        with override_settings(EXPORT_ASYNC_THRESHOLD=float('inf')):
+            return export_expenses(request, format)
+    return export
+
+
+# format -> implementation name -> callable(user) returning a response
+CASES = {
+    'csv': {
+        'buffered': legacy_csv_export,
+        'streaming': current_export('csv'),
+    },
+    'excel': {
+        'in-memory': legacy_excel_export,
+        'write-only': current_export('excel'),
+    },
+    'pdf': {
+        'xhtml2pdf': legacy_pdf_export,
+        'reportlab': current_export('pdf'),
+    },
+}
+
+
+# History sizes each format is measured at when --rows isn't given
+DEFAULT_ROWS = {
+    'csv': [10000, 100000],
+    'excel': [10000, 100000, 500000],
+    'pdf': [1000, 10000, 100000],
+}
+# Baselines that take too long above this size in a default run (xhtml2pdf needs hours at 100000)
+DEFAULT_MAX_ROWS = {('pdf', 'xhtml2pdf'): 10000}
+
+
+def consume(response):
+    """Read the whole body like a client would and return its size in bytes"""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = "Benchmark wall time and peak RSS of the expense exports at several history sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+',
+                            help="History sizes to benchmark, for every format (default: CSV 10000 100000, "
+                                 "Excel 10000 100000 500000, PDF 1000 10000 100000)")
+        parser.add_argument('--formats', nargs='+', choices=sorted(CASES), default=sorted(CASES))
+        parser.add_argument('--implementations', nargs='+', metavar='NAME',
+                            help="Only run these implementations, e.g. to skip slow baselines at large sizes")
+        # Internal: measure a single case in this process
+        parser.add_argument('--run-case', nargs=2, metavar=('FORMAT', 'IMPLEMENTATION'), help=argparse.SUPPRESS)
+        parser.add_argument('--user-id', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['run_case']:
+            self.run_case(*options['run_case'], user_id=options['user_id'])
+            return
+
+        sizes = {
+            format: options['rows'] or DEFAULT_ROWS[format]
+            for format in options['formats']
+        }
+        self.stdout.write(f"{'rows':>8}  {'format':<7} {'implementation':<15} {'time':>9}  {'peak RSS growth':>16}  {'size':>10}")
+        for rows in sorted(set().union(*sizes.values())):
+            user = seed_bench_user(rows)
+            try:
+                for format in options['formats']:
+                    if rows not in sizes[format]:
+                        continue
+                    for implementation in CASES[format]:
+                        if options['implementations'] and implementation not in options['implementations']:
+                            continue
+                        if not options['rows'] and rows > DEFAULT_MAX_ROWS.get((format, implementation), rows):
+                            self.stdout.write(f"{rows:>8}  {format:<7} {implementation:<15} {'skipped':>9}  (pass --rows to run it)")
+                            continue
+                        result = run_case_in_subprocess(
+                            'bench_exports', '--run-case', format, implementation, '--user-id', user.pk
+                        )
+                        self.stdout.write(
+                            f"{rows:>8}  {format:<7} {implementation:<15} {result['seconds']:>8.2f}s  "
+                            f"{format_kb(result['peak_rss_growth_kb']):>16}  {format_kb(result['result'] / 1024):>10}"
+                        )
+            finally:
+                drop_bench_user(user)
+
+    def run_case(self, format, implementation, user_id):
+        try:
+            export = CASES[format][implementation]
+        except KeyError:
+            raise CommandError(f"Unknown case {format}/{implementation}")
+        user = User.objects.get(pk=user_id)
+        result = measure(lambda: consume(export(user)))
+        self.stdout.write(json.dumps(result))
+
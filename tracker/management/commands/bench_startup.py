@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.benchmarks import format_kb, run_startup
+
+# The server entry points also load the URLconf, as their first request would
+URLCONF = "from django.urls import get_resolver; get_resolver().url_patterns"
+TARGETS = {
+    'wsgi': ['-c', f"import core.wsgi; {URLCONF}"],
+    'asgi': ['-c', f"import core.asgi; {URLCONF}"],
+    'check': ['manage.py', 'check'],
+}
+
+
+class Command(BaseCommand):
+    help = ("Cold start of the WSGI/ASGI entry points and `manage.py check`: wall time, import time "
+            "(python -X importtime) and peak RSS, each in a fresh process")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS))
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per target, the fastest is kept (default: 5)")
+        parser.add_argument('--top', type=int, default=8, help="Slowest packages to list per target (default: 8)")
+        parser.add_argument('--json', action='store_true', help="Print one JSON object per target, for CI")
+
+    def handle(self, *args, **options):
+        # The subprocesses use the same settings as this command
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings.SETTINGS_MODULE
+        if not options['json']:
+            self.stdout.write(f"{'target':<8} {'wall':>8} {'imports':>8} {'modules':>8} {'peak RSS':>10}")
+        for target in options['targets']:
+            try:
+                runs = [run_startup(TARGETS[target]) for _ in range(max(options['repeat'], 1))]
+            except subprocess.CalledProcessError as e:
+                raise CommandError(f"{target} failed:\n{e.stderr[-2000:]}")
+            result = min(runs, key=lambda run: run['seconds'])
+            result['peak_rss_kb'] = min(run['peak_rss_kb'] for run in runs)
+            packages = sorted(result.pop('packages').items(), key=lambda item: item[1], reverse=True)
+            result['slowest_packages'] = {name: round(us / 1000, 1) for name, us in packages[:options['top']]}
+            self.report(target, result, options)
+
+    def report(self, target, result, options):
+        if options['json']:
+            self.stdout.write(json.dumps({'target': target, **result}))
+            return
+        self.stdout.write(
+            f"{target:<8} {result['seconds'] * 1000:>6.0f}ms {result['import_us'] / 1000:>6.0f}ms "
+            f"{result['modules']:>8} {format_kb(result['peak_rss_kb']):>10}"
+        )
+        self.stdout.write(f"{'':<8} " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in result['slowest_packages'].items()))
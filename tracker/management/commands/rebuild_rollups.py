@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild or verify the spending rollups from the raw expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Only compare stored rollups with the raw expenses, don't write anything")
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Limit to this user (can be repeated)")
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        if options['verify']:
+            mismatches = verify_rollups(users)
+            for (user_id, category_id, granularity, period_start), expected, stored in sorted(mismatches, key=str):
+                self.stdout.write(
+                    f"user={user_id} category={category_id} {granularity} {period_start}: "
+                    f"expected {expected}, stored {stored}"
+                )
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} rollup bucket(s) out of sync, run without --verify to rebuild")
+            self.stdout.write(self.style.SUCCESS("Rollups match the raw expenses."))
+            return
+
+        count = rebuild_rollups(users)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup bucket(s)."))
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.advice import is_advice_cache_shared, refresh_savings_advice
+
+
+class Command(BaseCommand):
+    help = "Precompute the savings advice of users whose month's spending changed (e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Limit to this user (can be repeated)")
+
+    def handle(self, *args, **options):
+        if not is_advice_cache_shared():
+            # The advice would go into a cache that dies with this command
+            raise CommandError("The default cache is local to this process, set CACHE_BACKEND to file or redis "
+                               "so the server processes see the precomputed advice")
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        refreshed, fresh, failed = refresh_savings_advice(users)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} advice(s), {fresh} already up to date."))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} advice(s) not refreshed, the LLM is unavailable."))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.enrichment import claim_pending_expenses, enrich_expenses, requeue_stale_expenses
+
+
+class Command(BaseCommand):
+    help = "Parse expenses saved with deferred AI enrichment, in batches (run as many workers as needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the pending expenses and exit instead of polling forever")
+        parser.add_argument('--batch-size', type=int, default=40,
+                            help="Expenses claimed and parsed together (default: 40)")
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help="Seconds to sleep when nothing is pending (default: 2)")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued, failed = requeue_stale_expenses()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale expense(s)."))
+            if failed:
+                self.stdout.write(self.style.ERROR(f"Gave up on {failed} expense(s) that stalled every attempt."))
+
+            expenses = claim_pending_expenses(options['batch_size'])
+            if not expenses:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            counts = enrich_expenses(expenses)
+            self.stdout.write(
+                f"Enriched {counts['done']} of {len(expenses)} expense(s): "
+                f"{counts['retry']} to retry, {counts['failed']} failed, {counts['skipped']} edited meanwhile"
+            )
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.jobs import claim_next_job, purge_expired_jobs, requeue_stale_jobs, run_export_job
+
+
+class Command(BaseCommand):
+    help = "Process queued report exports (run as many workers as needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the queue and exit instead of polling forever")
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help="Seconds to sleep when the queue is empty (default: 2)")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued, failed = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale job(s)."))
+            if failed:
+                self.stdout.write(self.style.ERROR(f"Gave up on {failed} job(s) that stalled every attempt."))
+            purge_expired_jobs()
+
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Export job {job.pk}: {job.format} for {job.user.username} ({job.total_rows} rows)")
+            job = run_export_job(job)
+            if job.status == job.DONE:
+                self.stdout.write(self.style.SUCCESS(f"Export job {job.pk} done: {job.file_name}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"Export job {job.pk} failed: {job.error}"))
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+
+from tracker.models import TokenUsage
+
+
+class Command(BaseCommand):
+    help = "Calls and tokens spent on the LLM per purpose over the last days"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Days to report, today included (default: 7)")
+        parser.add_argument('--by-day', action='store_true', help="One line per day and purpose")
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        fields = ['day', 'purpose'] if options['by_day'] else ['purpose']
+        rows = TokenUsage.objects.filter(day__gte=since).values(*fields).annotate(
+            calls=Sum('calls'), prompt=Sum('prompt_tokens'), completion=Sum('completion_tokens')
+        ).order_by(*fields)
+
+        day_column = "{:<11} " if options['by_day'] else ""
+        self.stdout.write(day_column.format('day') +
+                          f"{'purpose':<12} {'calls':>8} {'prompt':>10} {'completion':>11} {'tokens/call':>12}")
+        for row in rows:
+            per_call = (row['prompt'] + row['completion']) / row['calls'] if row['calls'] else 0
+            self.stdout.write(day_column.format(str(row.get('day'))) +
+                              f"{row['purpose']:<12} {row['calls']:>8} {row['prompt']:>10} "
+                              f"{row['completion']:>11} {per_call:>12.1f}")
+        if not rows:
+            self.stdout.write(f"No LLM calls since {since}.")
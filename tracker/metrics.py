@@ -0,0 +1,65 @@
+"""
+Process-local counters for the AI layer, served by /api/ai/stats/.
+Each worker keeps its own numbers, they are reset on restart.
+"""
+import threading
+
+
+class LatencyStats:
+    """Call count and latency per label (e.g. which parser served a request)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.labels = {}
+
+    def record(self, label, seconds):
+        with self.lock:
+            count, total, slowest = self.labels.get(label, (0, 0.0, 0.0))
+            self.labels[label] = (count + 1, total + seconds, max(slowest, seconds))
+
+    def snapshot(self):
+        with self.lock:
+            labels = dict(self.labels)
+        return {
+            label: {
+                'count': count,
+                'avg_ms': round(total * 1000 / count, 2),
+                'max_ms': round(slowest * 1000, 2),
+            }
+            for label, (count, total, slowest) in labels.items()
+        }
+
+    def reset(self):
+        with self.lock:
+            self.labels.clear()
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus style (count per upper bound)"""
+
+    DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        with self.lock:
+            buckets = {f'le_{bound}': count for bound, count in zip(self.buckets, self.counts)}
+            buckets['le_inf'] = self.count
+            return {'count': self.count, 'sum_seconds': round(self.sum, 4), 'buckets': buckets}
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.sum = 0.0
+            self.counts = [0] * len(self.buckets)
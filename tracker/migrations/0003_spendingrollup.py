@@ -0,0 +1,60 @@
+# Generated by Django 5.2.10 on 2026-10-17 20:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_rollups(apps, schema_editor):
+    """Aggregate existing expenses into day, month and year buckets"""
+    from collections import defaultdict
+    from decimal import Decimal
+    from django.db.models import Count, Sum
+    from django.db.models.functions import TruncDate
+
+    Expense = apps.get_model('tracker', 'Expense')
+    SpendingRollup = apps.get_model('tracker', 'SpendingRollup')
+
+    buckets = defaultdict(lambda: [Decimal('0'), 0])
+    day_rows = Expense.objects.annotate(day=TruncDate('created_at')).values(
+        'user_id', 'category_id', 'day'
+    ).annotate(total=Sum('amount'), expense_count=Count('id')).order_by()
+    for row in day_rows:
+        day = row['day']
+        for granularity, period_start in (('day', day), ('month', day.replace(day=1)), ('year', day.replace(month=1, day=1))):
+            bucket = buckets[(row['user_id'], row['category_id'], granularity, period_start)]
+            bucket[0] += row['total']
+            bucket[1] += row['expense_count']
+
+    SpendingRollup.objects.bulk_create([
+        SpendingRollup(user_id=user_id, category_id=category_id, granularity=granularity,
+                       period_start=period_start, total=total, count=count)
+        for (user_id, category_id, granularity, period_start), (total, count) in buckets.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0002_budget'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Day'), ('month', 'Month'), ('year', 'Year')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tracker.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'granularity', 'period_start'], name='rollup_user_gran_start_idx')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
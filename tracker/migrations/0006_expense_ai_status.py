@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-17 21:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0005_exportjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='ai_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='ai_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='ai_status',
+            field=models.CharField(choices=[('done', 'Done'), ('pending', 'Pending'), ('processing', 'Processing'), ('failed', 'Failed')], default='done', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['ai_status', 'created_at'], name='expense_ai_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_buckets(apps, schema_editor):
+    """Fold buckets created twice by concurrent first writes into one row"""
+    from django.db.models import Count, Min, Sum
+
+    SpendingRollup = apps.get_model('tracker', 'SpendingRollup')
+    duplicates = SpendingRollup.objects.filter(category__isnull=False).values(
+        'user_id', 'granularity', 'period_start', 'category_id'
+    ).annotate(rows=Count('id'), keep_id=Min('id'), sum_total=Sum('total'), sum_count=Sum('count')).filter(rows__gt=1).order_by()
+    for row in duplicates:
+        SpendingRollup.objects.filter(pk=row['keep_id']).update(total=row['sum_total'], count=row['sum_count'])
+        SpendingRollup.objects.filter(
+            user_id=row['user_id'], granularity=row['granularity'],
+            period_start=row['period_start'], category_id=row['category_id'],
+        ).exclude(pk=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0009_exportjob_attempts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # The constraint goes in before the old index goes out: MySQL needs an index on user_id for its foreign key
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='spendingrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'granularity', 'period_start', 'category'), name='rollup_unique_bucket'),
+        ),
+        migrations.RemoveIndex(
+            model_name='spendingrollup',
+            name='rollup_user_gran_start_idx',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.10 on 2026-10-17 22:38
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_uncategorized_buckets(apps, schema_editor):
+    """Fold uncategorized buckets split over rows (deleted categories, concurrent first writes) into one row"""
+    from django.db.models import Count, Min, Sum
+
+    SpendingRollup = apps.get_model('tracker', 'SpendingRollup')
+    duplicates = SpendingRollup.objects.filter(category__isnull=True).values(
+        'user_id', 'granularity', 'period_start'
+    ).annotate(rows=Count('id'), keep_id=Min('id'), sum_total=Sum('total'), sum_count=Sum('count')).filter(rows__gt=1).order_by()
+    for row in duplicates:
+        SpendingRollup.objects.filter(pk=row['keep_id']).update(total=row['sum_total'], count=row['sum_count'])
+        SpendingRollup.objects.filter(
+            user_id=row['user_id'], granularity=row['granularity'],
+            period_start=row['period_start'], category__isnull=True,
+        ).exclude(pk=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_spendingrollup_unique_bucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # The new constraint goes in before the old one goes out: MySQL needs an index on user_id for its foreign key
+    operations = [
+        migrations.RunPython(merge_uncategorized_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='spendingrollup',
+            constraint=models.UniqueConstraint(models.F('user'), models.F('granularity'), models.F('period_start'), django.db.models.functions.comparison.Coalesce('category', 0, output_field=models.BigIntegerField()), name='rollup_unique_bucket_key'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='spendingrollup',
+            name='rollup_unique_bucket',
+        ),
+    ]
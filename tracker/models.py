@@ -1,5 +1,5 @@
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 
 # Create your models here.
 from django.contrib.auth.models import User
@@ -19,15 +19,49 @@ class Category(models.Model):
 # Main Expense Model
 
 class Expense(models.Model):
-  user=models.ForeignKey(User,on_delete=models.CASCADE)
+  # AI enrichment: "pending" expenses were saved with a local guess and wait for
+  # run_enrichment_worker to parse them, see tracker.enrichment
+  AI_DONE = 'done'
+  AI_PENDING = 'pending'
+  AI_PROCESSING = 'processing'
+  AI_FAILED = 'failed'
+  AI_STATUS_CHOICES = [
+    (AI_DONE, 'Done'),
+    (AI_PENDING, 'Pending'),
+    (AI_PROCESSING, 'Processing'),
+    (AI_FAILED, 'Failed'),
+  ]
+  
+  user=models.ForeignKey(User,on_delete=models.CASCADE,db_index=False) #covered by the composite indexes below
   item=models.CharField(max_length=255) #For AI extraction 
   amount=models.DecimalField(max_digits=10,decimal_places=2) #For AI extraction 
   category=models.ForeignKey(Category,on_delete=models.SET_NULL,null=True,blank=True)
   raw_text=models.TextField() #whatever user write here
   created_at=models.DateTimeField(auto_now_add=True)
+  updated_at=models.DateTimeField(auto_now=True) #incremental sync (?updated_since=)
+  ai_status=models.CharField(max_length=10,choices=AI_STATUS_CHOICES,default=AI_DONE)
+  ai_attempts=models.PositiveSmallIntegerField(default=0)
+  ai_claimed_at=models.DateTimeField(null=True,blank=True) #when a worker took it, to requeue dead claims
+  
+  class Meta:
+    indexes = [
+      # History, exports, API listing and date range filters per user
+      models.Index(fields=['user', 'created_at'], name='expense_user_created_idx'),
+      # Category scoped date ranges per user (category budgets)
+      models.Index(fields=['user', 'category', 'created_at'], name='expense_user_cat_created_idx'),
+      # Enrichment queue, oldest pending first
+      models.Index(fields=['ai_status', 'created_at'], name='expense_ai_status_created_idx'),
+      # Incremental sync, rows changed since the client's last pull
+      models.Index(fields=['user', 'updated_at'], name='expense_user_updated_idx'),
+    ]
   
   def __str__(self):
     return f"{self.item} - {self.amount} ({self.user.username})"
+  
+  def save(self, *args, **kwargs):
+    # Spending rollups are updated by signals, keep them in the same transaction
+    with transaction.atomic():
+      super().save(*args, **kwargs)
 
 # Budget Model for Budget Alerts
 class Budget(models.Model):
@@ -56,45 +90,145 @@ class Budget(models.Model):
     
     def get_spent_amount(self):
         """Calculate spent amount for this budget period"""
-        from django.utils import timezone
-        from datetime import timedelta
-        
-        now = timezone.now()
-        
-        if self.period == 'daily':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        elif self.period == 'weekly':
-            start_date = now - timedelta(days=now.weekday())
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        elif self.period == 'monthly':
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        elif self.period == 'yearly':
-            start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        else:
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        expenses = Expense.objects.filter(
-            user=self.user,
-            created_at__gte=start_date
-        )
-        
-        if self.category:
-            expenses = expenses.filter(category=self.category)
+        return self.get_status().spent
+    
+    def get_status(self):
+        """Evaluate this budget once; prefer budget_utils.evaluate_budgets for many budgets"""
+        from .budget_utils import evaluate_budgets
         
-        return expenses.aggregate(total=Sum('amount'))['total'] or 0
+        return evaluate_budgets(self.user_id, [self])[0]
     
     def get_remaining_amount(self):
         """Calculate remaining budget"""
-        spent = self.get_spent_amount()
-        return float(self.amount) - float(spent)
+        return self.get_status().remaining
     
     def get_percentage_used(self):
         """Calculate percentage of budget used"""
-        spent = self.get_spent_amount()
-        if float(self.amount) == 0:
-            return 0
-        return (float(spent) / float(self.amount)) * 100
+        return self.get_status().percentage
     
     def is_exceeded(self):
         """Check if budget is exceeded"""
-        return self.get_spent_amount() > self.amount
\ No newline at end of file
+        return self.get_status().exceeded
+
+
+# Pre-aggregated spending per user/category/day, month and year.
+# Maintained by tracker.signals on every Expense write, rebuilt with `manage.py rebuild_rollups`.
+class SpendingRollup(models.Model):
+    DAY = 'day'
+    MONTH = 'month'
+    YEAR = 'year'
+    GRANULARITY_CHOICES = [
+        (DAY, 'Day'),
+        (MONTH, 'Month'),
+        (YEAR, 'Year'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # covered by the composite index
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    granularity = models.CharField(max_length=5, choices=GRANULARITY_CHOICES)
+    period_start = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        # Also the index of the (user, granularity, period_start) range reads.
+        # NULLs would be distinct, uncategorized buckets are keyed as category 0
+        constraints = [
+            models.UniqueConstraint(
+                'user', 'granularity', 'period_start', Coalesce('category', 0, output_field=models.BigIntegerField()),
+                name='rollup_unique_bucket_key',
+            ),
+        ]
+
+    def __str__(self):
+        cat_name = self.category.name if self.category else "Uncategorized"
+        return f"{self.user.username} - {cat_name} ({self.granularity} {self.period_start}): Rs. {self.total}"
+
+
+# Report exports that are too large to render inside a request.
+# Created by the export view, processed by `manage.py run_export_worker`.
+class ExportJob(models.Model):
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('excel', 'Excel'),
+        ('pdf', 'PDF'),
+    ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)  # claims by a worker, see EXPORT_JOB_MAX_ATTEMPTS
+    file_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.format} export ({self.status})"
+    
+    def get_progress(self):
+        """Percentage of rows written so far"""
+        if self.status == self.DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(self.processed_rows * 100 // self.total_rows, 100)
+    
+    def get_file_path(self):
+        from django.conf import settings
+        from pathlib import Path
+        
+        return Path(settings.EXPORT_ROOT) / self.file_name if self.file_name else None
+
+
+# LLM tokens spent per day, call purpose (parse, parse_batch, advice) and model.
+# Written by tracker.token_usage after every completion, read by `manage.py token_report`.
+class TokenUsage(models.Model):
+    day = models.DateField()
+    purpose = models.CharField(max_length=20)
+    model = models.CharField(max_length=100)
+    calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'purpose', 'model'], name='tokenusage_day_purpose_model_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.purpose}: {self.prompt_tokens} + {self.completion_tokens} tokens"
+
+
+class DataVersion(models.Model):
+    """
+    Change counter of a user's expenses and budgets, bumped on every write.
+    The ETag / Last-Modified of their API responses, see tracker.conditional.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
@@ -0,0 +1,138 @@
+import base64
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj, direction):
+    """Opaque cursor pointing at an object's (created_at, id) position"""
+    raw = f"{direction}|{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, created_at, pk = raw.split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    # Cursors are only ever encoded from aware datetimes
+    if direction not in ('next', 'prev') or created_at is None or timezone.is_naive(created_at):
+        raise InvalidCursor(cursor)
+    return direction, created_at, pk
+
+
+@dataclass(frozen=True)
+class KeysetPage:
+    object_list: list
+    next_cursor: str = None
+    previous_cursor: str = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+
+def paginate_by_keyset(queryset, cursor=None, page_size=None):
+    """
+    Newest first page of `queryset` after/before `cursor`, keyed on (created_at, id).
+    Each page is a range scan on the (user, created_at) index, so its cost does not
+    depend on how deep the cursor is, and rows inserted meanwhile never shift pages.
+    """
+    page_size = page_size or settings.EXPENSE_PAGE_SIZE
+    direction = 'next'
+    if cursor:
+        direction, created_at, pk = decode_cursor(cursor)
+        # The plain bound on created_at lets the index seek straight to the cursor,
+        # the OR only breaks ties between rows sharing the same timestamp
+        if direction == 'next':
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(pk__lt=pk), created_at__lte=created_at)
+        else:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(pk__gt=pk), created_at__gte=created_at)
+
+    if direction == 'next':
+        rows = list(queryset.order_by('-created_at', '-pk')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        has_next, has_previous = has_more, bool(cursor)
+    else:
+        rows = list(queryset.order_by('created_at', 'pk')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next, has_previous = True, has_more
+
+    return KeysetPage(
+        object_list=rows,
+        next_cursor=encode_cursor(rows[-1], 'next') if rows and has_next else None,
+        previous_cursor=encode_cursor(rows[0], 'prev') if rows and has_previous else None,
+    )
+
+
+class ExpenseCursorPagination(BasePagination):
+    """DRF pagination over paginate_by_keyset, used by the Expense API"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.EXPENSE_PAGE_SIZE
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate_by_keyset(
+                queryset,
+                cursor=request.query_params.get(self.cursor_query_param),
+                page_size=self.get_page_size(request),
+            )
+        except InvalidCursor:
+            # A malformed query parameter; the history page answers 404 like for a missing page
+            raise ValidationError({self.cursor_query_param: "Invalid cursor"})
+        return self.page.object_list
+
+    def get_link(self, cursor):
+        if not cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,58 @@
+"""
+Prompt templates of the LLM calls.
+
+Every prompt token is paid for and adds latency on each call, so the
+instructions are kept to one short system message and the user message only
+carries the data, clipped to the AI_* token caps. Bump a prompt's version
+whenever its template changes: answers cached for older versions are then
+ignored.
+"""
+PARSE_PROMPT_VERSION = 2
+ADVICE_PROMPT_VERSION = 2
+
+CATEGORIES = "Food, Transport, Shopping, Bills, Health, Entertainment, Education, Housing, Others"
+
+PARSE_SYSTEM_PROMPT = (
+    'Extract the expense from the text. Reply with JSON only: '
+    '{"item": "<capitalized item>", "amount": <number without currency>, "category": "<category>"}. '
+    f'Category is one of {CATEGORIES}, Others if unclear. '
+    'Several amounts for one expense: sum them.'
+)
+BATCH_PARSE_SYSTEM_PROMPT = (
+    'Each line is "<index>: <text>", extract one expense per line. Reply with a JSON array only, one '
+    '{"index": <index>, "item": "<capitalized item>", "amount": <number without currency>, "category": "<category>"} '
+    f'per expense. Category is one of {CATEGORIES}, Others if unclear. '
+    'Several amounts for one expense: sum them. Skip lines that are not expenses.'
+)
+ADVICE_SYSTEM_PROMPT = (
+    'You are a financial advisor. Give ONE specific, actionable savings tip (max 2 sentences) '
+    'focused on the highest spending category. No generic advice.'
+)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), for texts the API didn't count"""
+    return len(text) // 4 + 1
+
+
+def clip_text(text, max_tokens):
+    """`text` on one line, cut to about max_tokens tokens"""
+    text = ' '.join(text.split())
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars]
+
+
+def format_batch_lines(texts, max_tokens):
+    return '\n'.join(f"{index}: {clip_text(text, max_tokens)}" for index, text in enumerate(texts))
+
+
+def format_summary(summary, max_categories):
+    """
+    "Monthly spending (Rs): Food 5000, Bills 1450" with the largest
+    max_categories categories, the smaller ones summed into "Other categories".
+    """
+    items = sorted(summary, key=lambda item: item['total'], reverse=True)
+    if len(items) > max_categories:
+        rest = sum(item['total'] for item in items[max_categories - 1:])
+        items = items[:max_categories - 1] + [{'category': 'Other categories', 'total': rest}]
+    return "Monthly spending (Rs): " + ", ".join(f"{item['category']} {item['total']:.0f}" for item in items)
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Expense, SpendingRollup
+
+DAY = SpendingRollup.DAY
+MONTH = SpendingRollup.MONTH
+YEAR = SpendingRollup.YEAR
+
+
+def get_bucket_starts(day):
+    """Map a local date to the start date of its day, month and year buckets"""
+    return {
+        DAY: day,
+        MONTH: day.replace(day=1),
+        YEAR: day.replace(month=1, day=1),
+    }
+
+
+def get_expense_state(expense):
+    """The fields of an expense that rollups depend on"""
+    amount = Expense._meta.get_field('amount').to_python(expense.amount)
+    return (
+        expense.user_id,
+        expense.category_id,
+        timezone.localtime(expense.created_at).date(),
+        amount.quantize(Decimal('0.01')),
+    )
+
+
+def add_to_bucket(user_id, category_id, granularity, period_start, amount, count):
+    bucket = SpendingRollup.objects.filter(
+        user_id=user_id,
+        category_id=category_id,
+        granularity=granularity,
+        period_start=period_start,
+    )
+
+    def update():
+        rows = bucket
+        if category_id is None:
+            # Backends without expression indexes (MariaDB) can't enforce the unique
+            # constraint, so uncategorized buckets may be split: only the first row takes the delta
+            rows = SpendingRollup.objects.filter(pk__in=list(bucket.order_by('pk').values_list('pk', flat=True)[:1]))
+        return rows.update(total=F('total') + amount, count=F('count') + count)
+
+    if update():
+        return
+    try:
+        with transaction.atomic():
+            SpendingRollup.objects.create(
+                user_id=user_id,
+                category_id=category_id,
+                granularity=granularity,
+                period_start=period_start,
+                total=amount,
+                count=count,
+            )
+    except IntegrityError:
+        # Another request created the bucket first
+        update()
+
+
+def apply_delta(user_id, category_id, day, amount, count):
+    """Add `amount` and `count` to every bucket containing `day`"""
+    for granularity, period_start in get_bucket_starts(day).items():
+        add_to_bucket(user_id, category_id, granularity, period_start, amount, count)
+
+
+def fold_into_uncategorized(category_id):
+    """
+    Before a category is deleted: move its buckets into the uncategorized ones,
+    the way its expenses are set to no category, instead of leaving the
+    SET_NULL to collide with the existing uncategorized buckets.
+    """
+    rollups = SpendingRollup.objects.filter(category_id=category_id)
+    for rollup in rollups.iterator():
+        add_to_bucket(rollup.user_id, None, rollup.granularity, rollup.period_start, rollup.total, rollup.count)
+    rollups.delete()
+
+
+def record_expense_change(previous_state, expense):
+    """Move an expense out of its previous buckets (if any) and into its current ones"""
+    current_state = get_expense_state(expense)
+    if previous_state == current_state:
+        return
+    if previous_state:
+        user_id, category_id, day, amount = previous_state
+        apply_delta(user_id, category_id, day, -amount, -1)
+    user_id, category_id, day, amount = current_state
+    apply_delta(user_id, category_id, day, amount, 1)
+
+
+def record_expense_removal(expense):
+    user_id, category_id, day, amount = get_expense_state(expense)
+    apply_delta(user_id, category_id, day, -amount, -1)
+
+
+def record_expenses_added(expenses):
+    """For bulk_create paths, which don't send save signals"""
+    for expense in expenses:
+        record_expense_change(None, expense)
+
+
+# Rebuild / verify
+
+def compute_expected_rollups(users=None):
+    """Aggregate raw expenses into {(user_id, category_id, granularity, period_start): [total, count]}"""
+    expenses = Expense.objects.all()
+    if users is not None:
+        expenses = expenses.filter(user__in=users)
+
+    day_rows = expenses.annotate(day=TruncDate('created_at')).values(
+        'user_id', 'category_id', 'day'
+    ).annotate(total=Sum('amount'), expense_count=Count('id')).order_by()
+
+    expected = defaultdict(lambda: [Decimal('0'), 0])
+    for row in day_rows:
+        for granularity, period_start in get_bucket_starts(row['day']).items():
+            bucket = expected[(row['user_id'], row['category_id'], granularity, period_start)]
+            bucket[0] += row['total']
+            bucket[1] += row['expense_count']
+    return expected
+
+
+def compute_stored_rollups(users=None):
+    rollups = SpendingRollup.objects.all()
+    if users is not None:
+        rollups = rollups.filter(user__in=users)
+
+    stored = {}
+    rows = rollups.values('user_id', 'category_id', 'granularity', 'period_start').annotate(
+        total=Sum('total'), expense_count=Sum('count')
+    ).order_by()
+    for row in rows:
+        if row['expense_count'] == 0 and row['total'] == 0:
+            continue
+        key = (row['user_id'], row['category_id'], row['granularity'], row['period_start'])
+        stored[key] = [row['total'], row['expense_count']]
+    return stored
+
+
+def verify_rollups(users=None):
+    """Return the list of (key, expected, stored) buckets that disagree"""
+    expected = compute_expected_rollups(users)
+    stored = compute_stored_rollups(users)
+    mismatches = []
+    for key in set(expected) | set(stored):
+        if expected.get(key) != stored.get(key):
+            mismatches.append((key, expected.get(key), stored.get(key)))
+    return mismatches
+
+
+def rebuild_rollups(users=None):
+    """Replace stored rollups with fresh aggregates of the raw expenses"""
+    expected = compute_expected_rollups(users)
+    rollups = SpendingRollup.objects.all()
+    if users is not None:
+        rollups = rollups.filter(user__in=users)
+    with transaction.atomic():
+        rollups.delete()
+        SpendingRollup.objects.bulk_create([
+            SpendingRollup(
+                user_id=user_id,
+                category_id=category_id,
+                granularity=granularity,
+                period_start=period_start,
+                total=total,
+                count=count,
+            )
+            for (user_id, category_id, granularity, period_start), (total, count) in expected.items()
+        ], batch_size=1000)
+    return len(expected)
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Expense, Category, Budget
+from .budget_utils import evaluate_budgets
+from .categories import get_category_registry
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,17 +14,32 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
+class CategoryField(serializers.PrimaryKeyRelatedField):
+    """Category id validated against the in-process registry instead of a query"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        category = get_category_registry().get(data)
+        if category is None:
+            try:
+                int(data)
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(data).__name__)
+            self.fail('does_not_exist', pk_value=data)
+        return category
+
 class ExpenseSerializer(serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField()
-    category = serializers.PrimaryKeyRelatedField(
+    category = CategoryField(
         queryset=Category.objects.all(), 
         allow_null=True
     )
 
     class Meta:
         model = Expense
-        fields = ['id', 'user', 'item', 'amount', 'category', 'category_name', 'raw_text', 'created_at']
-        read_only_fields = ['user', 'created_at']
+        fields = ['id', 'user', 'item', 'amount', 'category', 'category_name', 'raw_text', 'created_at', 'updated_at', 'ai_status']
+        read_only_fields = ['user', 'created_at', 'updated_at', 'ai_status']
 
     def get_category_name(self, obj):
         return obj.category.name if obj.category else "Uncategorized"
@@ -47,14 +64,28 @@ class BudgetSerializer(serializers.ModelSerializer):
     def get_category_name(self, obj):
         return obj.category.name if obj.category else "Overall"
 
+    def _get_budget_status(self, obj):
+        """
+        Statuses are evaluated once for all of the user's budgets and shared
+        through the context, so list responses don't query per row.
+        """
+        statuses = self.context.setdefault('budget_statuses', {})
+        if obj.pk not in statuses:
+            budgets = Budget.objects.filter(user=obj.user_id).select_related('category')
+            for status in evaluate_budgets(obj.user_id, budgets):
+                statuses[status.budget.pk] = status
+        if obj.pk not in statuses:
+            statuses[obj.pk] = evaluate_budgets(obj.user_id, [obj])[0]
+        return statuses[obj.pk]
+
     def get_spent_amount(self, obj):
-        return obj.get_spent_amount()
+        return self._get_budget_status(obj).spent
 
     def get_remaining_amount(self, obj):
-        return obj.get_remaining_amount()
+        return self._get_budget_status(obj).remaining
 
     def get_percentage_used(self, obj):
-        return obj.get_percentage_used()
+        return self._get_budget_status(obj).percentage
 
     def get_is_exceeded(self, obj):
-        return obj.is_exceeded()
+        return self._get_budget_status(obj).exceeded
@@ -0,0 +1,67 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import rollups
+from .categories import invalidate_categories
+from .conditional import bump_data_version
+from .local_parser import invalidate_keyword_index
+from .models import Budget, Category, Expense
+
+
+@receiver(pre_save, sender=Expense)
+def remember_expense_state(sender, instance, raw=False, **kwargs):
+    """Snapshot the stored row so post_save can move it between rollup buckets"""
+    instance._rollup_previous_state = None
+    if raw or instance._state.adding:
+        return
+    previous = Expense.objects.filter(pk=instance.pk).first()
+    if previous:
+        instance._rollup_previous_state = rollups.get_expense_state(previous)
+
+
+@receiver(post_save, sender=Expense)
+def update_rollups_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rollups.record_expense_change(getattr(instance, '_rollup_previous_state', None), instance)
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollups_on_delete(sender, instance, origin=None, **kwargs):
+    # When the whole user is deleted their rollups are cascaded away as well
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is User:
+        return
+    rollups.record_expense_removal(instance)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def bump_user_data_version(sender, instance, raw=False, origin=None, **kwargs):
+    # ETag / Last-Modified of the user's API responses and the namespace of everything
+    # cached for them (tracker.user_cache); their row goes with a deleted user
+    origin_model = getattr(origin, 'model', type(origin))
+    if raw or origin_model is User:
+        return
+    bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def invalidate_keyword_index_cache(sender, instance, **kwargs):
+    invalidate_keyword_index(instance.user_id)
+
+
+@receiver(pre_delete, sender=Category)
+def fold_rollups_of_deleted_category(sender, instance, **kwargs):
+    # Its expenses become uncategorized, so do its rollup buckets
+    rollups.fold_into_uncategorized(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_registry(sender, instance, **kwargs):
+    invalidate_categories()
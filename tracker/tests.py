@@ -1,3 +1,1583 @@
+import asyncio
+import base64
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet, Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import advice, ai_utils, analytics, exports
+from .ai_cache import templatize
+from .analytics import build_dashboard_payload
+from .benchmarks import parse_importtime
+from .budget_utils import evaluate_budgets, get_period_start
+from .categories import CategoryRegistry, get_category_registry
+from .conditional import get_data_version
+from .enrichment import claim_pending_expenses, enrich_expenses, requeue_stale_expenses
+from .exports import EXPORT_HEADERS, get_export_row
+from .ingest import create_expense
+from .jobs import claim_next_job, enqueue_export, purge_expired_jobs, requeue_stale_jobs, run_export_job
+from .llm_gateway import LLMGateway, LLMUnavailable
+from .llm_simulator import LLMRecorder, LLMSimulator, load_recordings
+from .models import Budget, Category, DataVersion, Expense, ExportJob, SpendingRollup, TokenUsage
+from .pagination import paginate_by_keyset
+from .prompts import ADVICE_SYSTEM_PROMPT, format_summary
+from .rollups import apply_delta, verify_rollups
+from .user_cache import get_user_cache_version
 
 # Create your tests here.
+
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN the hot queries on the suite's database and check they hit the composite indexes"""
+
+    EXPENSE_INDEXES = ('expense_user_created_idx', 'expense_user_cat_created_idx')
+    ROLLUP_INDEXES = ('rollup_unique_bucket_key',)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('indexed', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        for owner in (cls.user, other):
+            for i in range(20):
+                Expense.objects.create(user=owner, item=f'Item {i}', amount=10 + i,
+                                       category=cls.food if i % 2 else None, raw_text=f'item {i}')
+        Budget.objects.create(user=cls.user, category=cls.food, amount=500, period='monthly')
+        Budget.objects.create(user=cls.user, category=None, amount=900, period='weekly')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+            return ' '.join(str(cell) for row in cursor.fetchall() for cell in row)
+
+    def assert_queries_use_indexes(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        checked = 0
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            # Only the FROM clause matters, joins against categories are fine
+            from_clause = sql.split(' FROM ', 1)[1].split(' ')[0].strip('`"')
+            if from_clause == 'tracker_expense':
+                indexes = self.EXPENSE_INDEXES
+            elif from_clause == 'tracker_spendingrollup':
+                indexes = self.ROLLUP_INDEXES
+            else:
+                continue
+            plan = self.explain(sql)
+            self.assertTrue(any(name in plan for name in indexes), f"{sql}\n-> {plan}")
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_dashboard_queries_use_indexes(self):
+        self.assert_queries_use_indexes(reverse('dashboard'))
+
+    def test_expense_list_queries_use_indexes(self):
+        self.assert_queries_use_indexes(reverse('expense_list'))
+
+    def test_budget_queries_use_indexes(self):
+        self.assert_queries_use_indexes(reverse('budget_list'))
+
+    def test_api_expense_list_uses_index(self):
+        self.assert_queries_use_indexes('/api/expenses/')
+
+    def test_category_range_uses_category_index(self):
+        queryset = Expense.objects.filter(user=self.user, category=self.food, created_at__gte=timezone.now() - timedelta(days=30))
+        self.assertIn('expense_user_cat_created_idx', queryset.explain())
+
+
+class QueryCountTests(TestCase):
+    """Listing endpoints must not run extra queries per row"""
+
+    ENDPOINTS = [
+        reverse('dashboard'),
+        reverse('expense_list'),
+        reverse('budget_list'),
+        reverse('export_expenses', args=['csv']),
+        reverse('export_expenses', args=['excel']),
+        reverse('export_expenses', args=['pdf']),
+        '/api/expenses/',
+        '/api/budgets/',
+        '/admin/tracker/expense/',
+        '/admin/tracker/budget/',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('counted', password='pw')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        offset = Category.objects.count()
+        for i in range(offset, offset + count):
+            category = Category.objects.create(name=f'Category {i}')
+            Expense.objects.create(user=self.user, item=f'Item {i}', amount=10 + i,
+                                   category=category, raw_text=f'item {i}')
+            Budget.objects.create(user=self.user, category=category, amount=100, period='monthly')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_scale_with_rows(self):
+        self.add_rows(2)
+        baseline = {url: self.count_queries(url) for url in self.ENDPOINTS}
+        self.add_rows(4)
+        for url in self.ENDPOINTS:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), baseline[url])
+
+
+class SpendingRollupTests(TestCase):
+    """The expense signals keep the day/month/year buckets in step with the raw rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('rolled', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        cls.travel = Category.objects.create(name='Travel')
+
+    def buckets(self):
+        return {
+            (rollup.category_id, rollup.granularity, rollup.period_start): (rollup.total, rollup.count)
+            for rollup in SpendingRollup.objects.filter(user=self.user).exclude(count=0)
+        }
+
+    def test_create_edit_and_delete_move_the_totals(self):
+        expense = Expense.objects.create(user=self.user, item='Pizza', amount=300, category=self.food, raw_text='pizza')
+        Expense.objects.create(user=self.user, item='Tea', amount=50, category=self.food, raw_text='tea')
+        day = timezone.localtime(expense.created_at).date()
+        self.assertEqual(self.buckets(), {
+            (self.food.pk, 'day', day): (350, 2),
+            (self.food.pk, 'month', day.replace(day=1)): (350, 2),
+            (self.food.pk, 'year', day.replace(month=1, day=1)): (350, 2),
+        })
+
+        # Another category and another day
+        expense.category = self.travel
+        expense.created_at -= timedelta(days=1)
+        expense.amount = 400
+        expense.save()
+        previous_day = timezone.localtime(expense.created_at).date()
+        buckets = self.buckets()
+        self.assertEqual(buckets[(self.food.pk, 'day', day)], (50, 1))
+        self.assertEqual(buckets[(self.travel.pk, 'day', previous_day)], (400, 1))
+        self.assertNotIn((self.travel.pk, 'day', day), buckets)
+        self.assertEqual(verify_rollups([self.user]), [])
+
+        expense.delete()
+        self.assertNotIn((self.travel.pk, 'day', previous_day), self.buckets())
+        self.assertEqual(verify_rollups([self.user]), [])
+
+    def test_bucket_created_by_a_concurrent_write_is_updated(self):
+        expense = Expense.objects.create(user=self.user, item='Pizza', amount=300, category=self.food, raw_text='pizza')
+        day = timezone.localtime(expense.created_at).date()
+        real_update = QuerySet.update
+        calls = []
+
+        def lose_the_race(queryset, **kwargs):
+            # The first update runs before the other request's insert is visible
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=lose_the_race):
+            apply_delta(self.user.pk, self.food.pk, day, Decimal('100'), 1)
+
+        self.assertEqual(SpendingRollup.objects.filter(user=self.user, granularity='day').count(), 1)
+        self.assertEqual(self.buckets()[(self.food.pk, 'day', day)], (400, 2))
+
+    def test_deleted_category_is_folded_into_uncategorized(self):
+        expense = Expense.objects.create(user=self.user, item='Taxi', amount=150, category=self.travel, raw_text='taxi')
+        Expense.objects.create(user=self.user, item='Gift', amount=20, category=None, raw_text='gift')
+        day = timezone.localtime(expense.created_at).date()
+        travel_id = self.travel.pk
+        self.travel.delete()
+        Expense.objects.create(user=self.user, item='Tip', amount=10, category=None, raw_text='tip')
+
+        self.assertEqual(SpendingRollup.objects.filter(user=self.user, category=None, granularity='day').count(), 1)
+        self.assertEqual(self.buckets()[(None, 'day', day)], (180, 3))
+        self.assertFalse(SpendingRollup.objects.filter(category_id=travel_id).exists())
+        self.assertEqual(verify_rollups([self.user]), [])
+        budget = Budget.objects.create(user=self.user, category=None, amount=1000, period='daily')
+        self.assertEqual(budget.get_spent_amount(), 180)
+
+    def test_verify_reports_drift_and_rebuild_fixes_it(self):
+        Expense.objects.create(user=self.user, item='Pizza', amount=300, category=self.food, raw_text='pizza')
+        out = StringIO()
+        call_command('rebuild_rollups', '--verify', stdout=out)
+        self.assertIn('match', out.getvalue())
+
+        SpendingRollup.objects.filter(user=self.user, granularity='month').update(total=1)
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 rollup bucket(s) out of sync'):
+            call_command('rebuild_rollups', '--verify', '--user', 'rolled', stdout=out)
+        self.assertIn('expected', out.getvalue())
+
+        call_command('rebuild_rollups', '--user', 'rolled', stdout=StringIO())
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+        self.assertEqual(verify_rollups([self.user]), [])
+
+
+class BudgetEvaluationTests(TestCase):
+    """evaluate_budgets matches the old per-budget aggregate over the raw expenses, in two queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('budgeted', password='pw')
+        other = User.objects.create_user('spender', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        cls.bills = Category.objects.create(name='Bills')
+        now = timezone.now()
+        for days_ago, amount, category in [(0, 120, cls.food), (0, 80, None), (1, 300, cls.bills), (3, 45, cls.food),
+                                           (6, 500, cls.bills), (12, 70, cls.food), (35, 900, cls.food),
+                                           (200, 60, cls.bills), (400, 1000, cls.food)]:
+            expense = Expense.objects.create(user=cls.user, item='Item', amount=amount, category=category, raw_text='item')
+            expense.created_at = now - timedelta(days=days_ago)
+            expense.save()
+        Expense.objects.create(user=other, item='Item', amount=5000, category=cls.food, raw_text='item')
+        for category in (cls.food, cls.bills, None):
+            for period, amount in [('daily', 100), ('weekly', 400), ('monthly', 1000), ('yearly', 3000)]:
+                Budget.objects.create(user=cls.user, category=category, amount=amount, period=period)
+
+    @staticmethod
+    def old_spent_amount(budget):
+        # Budget.get_spent_amount() before the rollups
+        expenses = Expense.objects.filter(user=budget.user, created_at__gte=get_period_start(budget.period))
+        if budget.category:
+            expenses = expenses.filter(category=budget.category)
+        return expenses.aggregate(total=Sum('amount'))['total'] or 0
+
+    def test_statuses_match_the_per_budget_computation(self):
+        with self.assertNumQueries(2):
+            statuses = evaluate_budgets(self.user)
+        self.assertEqual(len(statuses), 12)
+        for status in statuses:
+            budget = status.budget
+            with self.subTest(category=budget.category_id, period=budget.period):
+                spent = self.old_spent_amount(budget)
+                self.assertEqual(status.spent, spent)
+                self.assertAlmostEqual(status.remaining, float(budget.amount) - float(spent))
+                self.assertAlmostEqual(status.percentage, float(spent) / float(budget.amount) * 100)
+                self.assertEqual(status.exceeded, spent > budget.amount)
+        # A budget's own helpers agree
+        budget = statuses[0].budget
+        self.assertEqual(budget.get_spent_amount(), self.old_spent_amount(budget))
+
+
+class DashboardPayloadTests(TestCase):
+    """Every dashboard series comes from one cached payload, also served at /api/dashboard/"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('charted', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        cls.bills = Category.objects.create(name='Bills')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def add(self, amount, category, when=None):
+        expense = Expense.objects.create(user=self.user, item='Item', amount=amount, category=category, raw_text='item')
+        if when is not None:
+            expense.created_at = timezone.make_aware(datetime(when.year, when.month, when.day, 12))
+            expense.save()
+        return expense
+
+    def test_monthly_trend_shows_the_latest_six_months(self):
+        today = timezone.localdate()
+        month = today.replace(day=1)
+        months = []
+        for _ in range(8):
+            months.append(month)
+            month = (month - timedelta(days=1)).replace(day=1)
+        for amount, month in enumerate(reversed(months), start=1):
+            self.add(amount * 100, self.food, month)
+
+        payload = build_dashboard_payload(self.user)
+        self.assertEqual(payload['monthly_labels'], [month.strftime('%b %Y') for month in reversed(months[:6])])
+        self.assertEqual(payload['monthly_values'], [300.0, 400.0, 500.0, 600.0, 700.0, 800.0])
+        # The totals still cover the whole history
+        self.assertEqual((payload['total_spent'], payload['total_expenses']), (3600.0, 8))
+
+    def test_average_and_categories_come_from_the_same_totals(self):
+        old = timezone.localdate() - timedelta(days=400)
+        self.add(100, self.food)
+        self.add(200, self.food, old)
+        self.add(600, self.bills)
+        self.add(50, None)
+
+        payload = build_dashboard_payload(self.user)
+        self.assertEqual(dict(zip(payload['labels'], payload['values'])),
+                         {'Food': 300.0, 'Bills': 600.0, 'Uncategorized': 50.0})
+        self.assertEqual((payload['total_spent'], payload['total_expenses'], payload['avg_expense']),
+                         (950.0, 4, 237.5))
+        self.assertEqual(sum(payload['trend_amounts']), 750.0)
+
+    def test_api_serves_the_payload(self):
+        for amount in range(1, 8):
+            self.add(amount * 10, self.food)
+        Budget.objects.create(user=self.user, category=self.food, amount=200, period='monthly')
+
+        response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data, json.loads(json.dumps(build_dashboard_payload(self.user))))
+        self.assertEqual([expense['amount'] for expense in data['recent_expenses']], [70.0, 60.0, 50.0, 40.0, 30.0])
+        self.assertEqual([(alert['category_name'], alert['spent'], alert['exceeded']) for alert in data['budget_alerts']],
+                         [('Food', 280.0, True)])
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+
+    def test_cached_payload_is_dropped_once_a_change_commits(self):
+        self.add(100, self.food)
+        with mock.patch.object(analytics, 'build_dashboard_payload', wraps=analytics.build_dashboard_payload) as build:
+            self.assertEqual(self.client.get('/api/dashboard/').json()['total_spent'], 100.0)
+            self.assertEqual(self.client.get('/api/dashboard/').json()['total_spent'], 100.0)
+            self.assertEqual(build.call_count, 1)
+
+            # A rolled back write leaves the cache alone
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.add(50, self.food)
+                raise RuntimeError
+            self.assertEqual(self.client.get('/api/dashboard/').json()['total_spent'], 100.0)
+            self.assertEqual(build.call_count, 1)
+
+            self.add(50, self.food)
+            Budget.objects.create(user=self.user, category=None, amount=160, period='monthly')
+            data = self.client.get('/api/dashboard/').json()
+            self.assertEqual((data['total_spent'], len(data['budget_alerts'])), (150.0, 1))
+            self.assertEqual(build.call_count, 2)
+
+
+
+class KeysetPaginationTests(TestCase):
+    """Expense pages are keyed on (created_at, id), cursors survive inserts and reject tampering"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', password='pw')
+        cls.other = User.objects.create_user('neighbour', password='pw')
+        start = timezone.now() - timedelta(days=1)
+        for i in range(7):
+            expense = Expense.objects.create(user=cls.user, item=f'Item {i}', amount=10, raw_text='x')
+            # Two rows share a timestamp, the id breaks the tie
+            Expense.objects.filter(pk=expense.pk).update(created_at=start + timedelta(minutes=min(i, 5)))
+        Expense.objects.create(user=cls.other, item='Not mine', amount=10, raw_text='x')
+        cls.newest_first = list(Expense.objects.filter(user=cls.user).order_by('-created_at', '-pk')
+                                .values_list('pk', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def ids(self, page):
+        return [expense.pk for expense in page]
+
+    @staticmethod
+    def forge(raw):
+        """A cursor encoded like the real ones"""
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def test_cursor_round_trip(self):
+        queryset = Expense.objects.filter(user=self.user)
+        pages = [paginate_by_keyset(queryset, page_size=3)]
+        while pages[-1].next_cursor:
+            pages.append(paginate_by_keyset(queryset, cursor=pages[-1].next_cursor, page_size=3))
+        self.assertEqual([self.ids(page) for page in pages],
+                         [self.newest_first[:3], self.newest_first[3:6], self.newest_first[6:]])
+        self.assertIsNone(pages[0].previous_cursor)
+
+        back = paginate_by_keyset(queryset, cursor=pages[2].previous_cursor, page_size=3)
+        self.assertEqual(self.ids(back), self.newest_first[3:6])
+        back = paginate_by_keyset(queryset, cursor=back.previous_cursor, page_size=3)
+        self.assertEqual((self.ids(back), back.previous_cursor), (self.newest_first[:3], None))
+
+    def test_pages_are_stable_while_rows_are_inserted(self):
+        queryset = Expense.objects.filter(user=self.user)
+        first = paginate_by_keyset(queryset, page_size=3)
+        Expense.objects.create(user=self.user, item='New', amount=10, raw_text='x')
+        second = paginate_by_keyset(queryset, cursor=first.next_cursor, page_size=3)
+        self.assertEqual(self.ids(second), self.newest_first[3:6])
+
+    def test_api_links(self):
+        response = self.client.get('/api/expenses/', {'page_size': 3})
+        self.assertIsNone(response.data['previous'])
+        ids = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            self.assertIn('page_size=3', response.data['next'])
+            response = self.client.get(response.data['next'])
+            ids += [row['id'] for row in response.data['results']]
+        self.assertEqual(ids, self.newest_first)
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], self.newest_first[3:6])
+
+    def test_invalid_and_tampered_cursors(self):
+        aware = timezone.now().isoformat()
+        naive = timezone.now().replace(tzinfo=None).isoformat()
+        cursors = ['garbage', self.forge(f"sideways|{aware}|1"), self.forge(f"next|{naive}|1"),
+                   self.forge(f"next|{aware}|one")]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('expense_list'), {'cursor': cursor}).status_code, 404)
+                response = self.client.get('/api/expenses/', {'cursor': cursor})
+                self.assertEqual((response.status_code, response.data), (400, {'cursor': 'Invalid cursor'}))
+
+        # A well formed cursor only positions the scan, it can't reach another user's rows
+        response = self.client.get('/api/expenses/', {'cursor': self.forge(f"next|{aware}|999999")})
+        self.assertEqual([row['id'] for row in response.data['results']], self.newest_first)
+
+class ParseCacheTests(TestCase):
+    """Repeated phrases must not reach the model again"""
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        patcher = mock.patch.object(ai_utils, 'request_expense_parse', side_effect=self.fake_parse)
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_parse(text):
+        amounts = [float(token) for token in text.split() if token.isdigit()]
+        return {'item': 'Coffee', 'amount': sum(amounts) or 42, 'category': 'Food'}
+
+    def test_same_template_reuses_item_and_category(self):
+        self.assertEqual(ai_utils.parse_expense_with_ai('Coffee 200'),
+                         {'item': 'Coffee', 'amount': 200.0, 'category': 'Food', 'source': 'llm'})
+        self.assertEqual(ai_utils.parse_expense_with_ai('  coffee   250 '),
+                         {'item': 'Coffee', 'amount': 250.0, 'category': 'Food', 'source': 'cache'})
+        self.assertEqual(ai_utils.parse_expense_with_ai('coffee 100 and 50')['amount'], 150)
+        self.assertEqual(ai_utils.parse_expense_with_ai('coffee 10 and 5')['amount'], 15.0)
+        self.assertEqual(self.model.call_count, 2)
+
+        stats = ai_utils.get_parse_cache().get_stats()
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['templated_hits']), (2, 2, 2))
+
+    def test_currency_marker_inside_a_word_is_kept(self):
+        self.assertEqual(templatize('Flowers 200'), ('flowers #', [200]))
+        self.assertEqual(templatize('rent rs. 1,200 and $4.50'), ('rent # and #', [1200, Decimal('4.50')]))
+        ai_utils.parse_expense_with_ai('flowers 200')
+        self.assertEqual(ai_utils.parse_expense_with_ai('flowers 350')['amount'], 350.0)
+        # Would share "flowe #" with "flowers 200" if the "rs" went with the amount
+        ai_utils.parse_expense_with_ai('flowe 200')
+        self.assertEqual(self.model.call_count, 2)
+
+    def test_amount_not_in_text_is_cached_per_phrase(self):
+        ai_utils.parse_expense_with_ai('morning coffee')
+        self.assertEqual(ai_utils.parse_expense_with_ai('Morning coffee!')['amount'], 42)
+        ai_utils.parse_expense_with_ai('evening coffee')
+        self.assertEqual(self.model.call_count, 2)
+
+    def test_shared_tier_serves_other_processes(self):
+        ai_utils.parse_expense_with_ai('coffee 200')
+        # A fresh local tier, like another worker would have
+        ai_utils.get_parse_cache().local.clear()
+        self.assertEqual(ai_utils.parse_expense_with_ai('coffee 300')['amount'], 300.0)
+        self.assertEqual(self.model.call_count, 1)
+        self.assertEqual(ai_utils.get_parse_cache().get_stats()['shared_hits'], 1)
+
+
+class LocalParserTests(TestCase):
+    """Simple texts are parsed from the user's own history, without the LLM"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('parser', password='pw')
+        transport = Category.objects.create(name='Transport')
+        food = Category.objects.create(name='Food')
+        for item, category in [('Uber', transport), ('Uber', transport), ('Uber eats', food),
+                               ('Coffee', food), ('Cold coffee', food)]:
+            Expense.objects.create(user=cls.user, item=item, amount=100, category=category, raw_text=item)
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        patcher = mock.patch.object(ai_utils, 'request_expense_parse',
+                                    return_value={'item': 'Pizza', 'amount': 1200, 'category': 'Food'})
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def parse(self, text):
+        return ai_utils.parse_expense_with_ai(text, user=self.user)
+
+    def test_known_items_are_parsed_locally(self):
+        self.assertEqual(self.parse('uber 350'),
+                         {'item': 'Uber', 'amount': 350.0, 'category': 'Transport', 'source': 'local'})
+        self.assertEqual(self.parse('Spent Rs 1,200.50 on coffee beans'),
+                         {'item': 'Coffee Beans', 'amount': 1200.5, 'category': 'Food', 'source': 'local'})
+        self.assertEqual(self.parse('paid 1.5k for coffee')['amount'], 1500.0)
+        self.model.assert_not_called()
+
+    def test_ambiguous_texts_fall_back_to_the_model(self):
+        for text in ['spent 1200 on pizza',  # never seen
+                     'uber ride 300',  # Uber and Uber eats disagree
+                     'coffee 2 cups 200',  # two amounts
+                     'groceries']:  # no amount
+            with self.subTest(text=text):
+                self.assertEqual(self.parse(text)['source'], 'llm')
+
+    def test_new_expenses_update_the_index(self):
+        self.assertEqual(self.parse('spent 1200 on pizza')['source'], 'llm')
+        food = Category.objects.get(name='Food')
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(2):
+                Expense.objects.create(user=self.user, item='Pizza', amount=1200, category=food, raw_text='pizza')
+        self.assertEqual(self.parse('pizza 900')['source'], 'local')
+
+
+class BatchIngestTests(TestCase):
+    """add_batch_with_ai sends the unknown lines to the model together and saves all rows at once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('batch', password='pw')
+        transport = Category.objects.create(name='Transport')
+        for _ in range(2):
+            Expense.objects.create(user=cls.user, item='Uber', amount=100, category=transport, raw_text='uber 100')
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        self.client.force_login(self.user)
+        patcher = mock.patch.object(ai_utils, 'request_expense_parse_batch', side_effect=self.fake_parse_batch)
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_parse_batch(texts):
+        parsed = {
+            'coffee 200': {'item': 'Coffee', 'amount': 200, 'category': 'Food'},
+            'electricity bill 1,450': {'item': 'Electricity Bill', 'amount': 1450.0, 'category': 'Bills'},
+            'free sample': {'item': 'Sample', 'amount': 0, 'category': 'Others'},
+        }
+        return [parsed.get(text) for text in texts]
+
+    def test_batch_is_parsed_and_saved_in_bulk(self):
+        lines = ['uber 350', 'coffee 200', '', 'electricity bill 1,450', 'free sample', 'asdf']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/add_batch_with_ai/', {'lines': lines},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 2))
+        self.assertEqual(
+            [(result['line'], result.get('source'), 'error' in result) for result in response.data['results']],
+            [(1, 'local', False), (2, 'llm', False), (4, 'llm', False), (5, None, True), (6, None, True)],
+        )
+        self.assertEqual(response.data['results'][2]['expense']['amount'], '1450.00')
+        self.assertEqual(response.data['results'][2]['expense']['category_name'], 'Bills')
+        self.assertTrue(all(result['expense']['id'] for result in response.data['results'][:3]))
+        # Only the lines the local parser didn't know, in one call
+        self.model.assert_called_once_with(['coffee 200', 'electricity bill 1,450', 'free sample', 'asdf'])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(verify_rollups([self.user]), [])
+
+    def test_backend_without_returned_ids_saves_row_by_row(self):
+        # MySQL: bulk_create doesn't set the pks
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/add_batch_with_ai/', {'lines': ['coffee 200', 'uber 350']},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        for result in response.data['results']:
+            self.assertEqual(Expense.objects.get(pk=result['expense']['id']).raw_text, result['text'])
+        self.assertEqual(verify_rollups([self.user]), [])
+
+    def test_nothing_parsed_is_a_bad_request(self):
+        response = self.client.post('/api/expenses/add_batch_with_ai/', {'text': 'asdf\nqwerty'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+
+
+class DeferredEnrichmentTests(TestCase):
+    """Deferred expenses are saved at once and parsed by the enrichment worker"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('deferred', password='pw')
+        transport = Category.objects.create(name='Transport')
+        food = Category.objects.create(name='Food')
+        for _ in range(2):
+            Expense.objects.create(user=cls.user, item='Uber', amount=100, category=transport, raw_text='uber 100')
+        Budget.objects.create(user=cls.user, category=food, amount=1000, period='monthly')
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        self.client.force_login(self.user)
+        patcher = mock.patch.object(ai_utils, 'request_expense_parse_batch',
+                                    return_value=[{'item': 'Pizza', 'amount': 1200.0, 'category': 'Food'}])
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, text):
+        return self.client.post('/api/expenses/add_with_ai/', {'text': text, 'defer': True},
+                                content_type='application/json')
+
+    def poll(self, *ids):
+        response = self.client.get('/api/expenses/enrichment_status/', {'ids': ','.join(map(str, ids))})
+        return {result['id']: result for result in response.data['results']}
+
+    def drain(self):
+        call_command('run_enrichment_worker', '--once', stdout=mock.Mock())
+
+    def test_pending_expense_is_enriched_by_the_worker(self):
+        response = self.add('Spent Rs 1,200 on pizza')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['X-Parse-Source'], 'pending')
+        self.assertEqual((response.data['ai_status'], response.data['amount'], response.data['category_name']),
+                         ('pending', '1200.00', 'Uncategorized'))
+        pending_id = response.data['id']
+        # Known texts don't need the worker
+        response = self.add('uber 300')
+        self.assertEqual((response.status_code, response.data['ai_status']), (201, 'done'))
+        self.assertEqual(self.poll(pending_id)[pending_id]['ai_status'], 'pending')
+
+        self.drain()
+        self.model.assert_called_once_with(['Spent Rs 1,200 on pizza'])
+        result = self.poll(pending_id)[pending_id]
+        self.assertEqual((result['ai_status'], result['item'], result['category_name']), ('done', 'Pizza', 'Food'))
+        self.assertEqual(len(result['budget_alerts']), 1)
+        self.assertIn('Budget Exceeded', result['budget_alerts'][0])
+        self.assertEqual(verify_rollups([self.user]), [])
+
+    def test_failed_parses_are_retried_then_given_up(self):
+        self.model.return_value = [None]
+        expense_id = self.add('something 450').data['id']
+        self.drain()
+        self.drain()  # still inside the retry delay
+        self.assertEqual(self.model.call_count, 1)
+        with self.settings(AI_ENRICH_RETRY_SECONDS=0):
+            self.drain()
+        self.assertEqual(self.model.call_count, 3)
+        expense = Expense.objects.get(pk=expense_id)
+        self.assertEqual((expense.ai_status, expense.ai_attempts, expense.amount), ('failed', 3, 450))
+
+    def test_stalled_claims_count_as_attempts(self):
+        expense_id = self.add('something 450').data['id']
+        stale = timezone.now() - timedelta(seconds=settings.AI_ENRICH_STALE_SECONDS + 1)
+        for attempt in range(1, settings.AI_ENRICH_MAX_ATTEMPTS + 1):
+            # The worker claims the row and dies
+            self.assertEqual([expense.pk for expense in claim_pending_expenses(10)], [expense_id])
+            Expense.objects.filter(pk=expense_id).update(ai_claimed_at=stale)
+            expected = (0, 1) if attempt == settings.AI_ENRICH_MAX_ATTEMPTS else (1, 0)
+            self.assertEqual(requeue_stale_expenses(), expected)
+        expense = Expense.objects.get(pk=expense_id)
+        self.assertEqual((expense.ai_status, expense.ai_attempts), ('failed', 3))
+
+    def test_parse_errors_release_the_claimed_rows(self):
+        expense_id = self.add('something 450').data['id']
+        self.model.side_effect = RuntimeError("boom")
+        self.assertEqual(enrich_expenses(claim_pending_expenses(10)), {'done': 0, 'retry': 1, 'failed': 0,
+                                                                       'skipped': 0})
+        expense = Expense.objects.get(pk=expense_id)
+        self.assertEqual((expense.ai_status, expense.ai_attempts), ('pending', 1))
+
+    def test_manual_edit_settles_the_expense(self):
+        expense_id = self.add('Spent 1200 on pizza').data['id']
+        food = Category.objects.get(name='Food')
+        response = self.client.patch(f'/api/expenses/{expense_id}/', {'category': food.pk},
+                                     content_type='application/json')
+        self.assertEqual(response.data['ai_status'], 'done')
+        self.drain()
+        self.model.assert_not_called()
+
+    def test_web_form_defers_when_enabled(self):
+        with self.settings(AI_DEFER_ENRICHMENT=True):
+            response = self.client.post(reverse('add_expense'), {'raw_text': 'pizza 1200'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(Expense.objects.get(user=self.user, raw_text='pizza 1200').ai_status, 'pending')
+
+
+class AsyncAIViewTests(TestCase):
+    """The AI endpoints await the async client instead of blocking on the sync one"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        self.client.force_login(self.user)
+        completions = SimpleNamespace(create=mock.AsyncMock(side_effect=self.fake_completion))
+        gateway = LLMGateway(api_key='test')
+        gateway.make_async_client = lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        self.sync_client = gateway.client = mock.Mock()
+        patcher = mock.patch.object(ai_utils, 'get_gateway', return_value=gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    parse_answer = '{"item": "Burger", "amount": 500, "category": "Food"}'
+
+    async def fake_completion(self, **kwargs):
+        await asyncio.sleep(0)
+        content = 'Cook at home.' if kwargs['messages'][0]['content'] == ADVICE_SYSTEM_PROMPT else self.parse_answer
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def test_add_with_ai(self):
+        response = self.client.post('/api/expenses/add_with_ai/', {'text': 'Spent 500 on burger'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['item'], response.data['category_name']), ('Burger', 'Food'))
+        self.assertEqual(response['X-Parse-Source'], 'llm')
+
+        response = self.client.post(reverse('add_expense'), {'raw_text': 'burger 250'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+        self.sync_client.chat.completions.create.assert_not_called()
+
+    def test_malformed_answers_fall_back_to_the_local_parser(self):
+        answers = ['{"item": "Tea", "amount": "", "category": "Food"}', '{"item": "Tea", "amount": null}', '[1, 2]', '42']
+        for number, answer in enumerate(answers, start=1):
+            with self.subTest(answer=answer):
+                self.parse_answer = answer
+                response = self.client.post('/api/expenses/add_with_ai/', {'text': f'Spent {number}0 on tea'},
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response['X-Parse-Source'], 'fallback')
+                self.assertEqual(response.data['amount'], f'{number}0.00')
+
+        self.sync_client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=answers[0]))])
+        self.assertEqual(ai_utils.parse_expense_with_ai('Spent 45 on tea')['source'], 'fallback')
+
+    def test_advice(self):
+        Expense.objects.create(user=self.user, item='Burger', amount=500, raw_text='burger 500')
+        for url in ['/api/advice/', reverse('get_savings_tip')]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).json(), {'advice': 'Cook at home.'})
+        self.sync_client.chat.completions.create.assert_not_called()
+
+    def test_authentication_is_still_enforced(self):
+        self.client.logout()
+        response = self.client.post('/api/expenses/add_with_ai/', {'text': 'burger 500'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+class SavingsAdviceTests(TestCase):
+    """Advice is only asked for again when the month's spending changed materially"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('advice', password='pw')
+        cls.food = Category.objects.create(name='Food')
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(advice, 'request_budget_advice', return_value='Cook at home.')
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spend(self, amount):
+        Expense.objects.create(user=self.user, item='Groceries', amount=amount, category=self.food, raw_text='x')
+
+    def test_advice_is_reused_until_spending_changes(self):
+        self.assertEqual(advice.get_savings_advice(self.user), advice.NO_EXPENSES_ADVICE)
+        self.spend(5000)
+        self.assertEqual(advice.get_savings_advice(self.user), 'Cook at home.')
+        self.spend(20)
+        self.assertEqual(advice.get_savings_advice(self.user), 'Cook at home.')
+        self.assertEqual(self.model.call_count, 1)
+
+        self.spend(3000)
+        advice.get_savings_advice(self.user)
+        self.model.assert_called_with([{'category': 'Food', 'total': 8020.0}])
+        self.assertEqual(self.model.call_count, 2)
+
+    def test_fallback_is_not_cached(self):
+        self.spend(1000)
+        self.model.return_value = None
+        self.assertIn('100% on Food', advice.get_savings_advice(self.user))
+        self.model.return_value = 'Cook at home.'
+        self.assertEqual(advice.get_savings_advice(self.user), 'Cook at home.')
+        self.assertEqual(self.model.call_count, 2)
+
+    def test_refresh_precomputes_advice(self):
+        self.spend(1000)
+        advice.refresh_savings_advice()
+        self.assertEqual(advice.refresh_savings_advice(), (0, 1, 0))
+        self.assertEqual(self.model.call_count, 1)
+        self.assertEqual(advice.get_savings_advice(self.user), 'Cook at home.')
+        self.assertEqual(self.model.call_count, 1)
+
+    def test_refresh_command_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, "CACHE_BACKEND"):
+            call_command('refresh_savings_advice', stdout=mock.Mock())
+        with tempfile.TemporaryDirectory() as directory, self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}):
+            self.spend(1000)
+            out = StringIO()
+            call_command('refresh_savings_advice', stdout=out)
+            self.assertIn("Refreshed 1 advice(s)", out.getvalue())
+
+
+class SingleFlightTests(TestCase):
+    """Identical concurrent LLM calls make one upstream request"""
+    CALLERS = 8
+
+    def setUp(self):
+        cache.clear()
+        self.flight = ai_utils.SingleFlight()
+        patcher = mock.patch.object(ai_utils, 'get_single_flight', return_value=self.flight)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_followers(self, flight, followers):
+        for _ in range(500):
+            if flight.get_stats()['followers'] >= followers:
+                return
+            time.sleep(0.01)
+        self.fail("callers never joined the call in flight")
+
+    def test_threads_share_one_parse(self):
+        release = threading.Event()
+
+        def fetch(user_text):
+            release.wait(5)
+            return {'item': 'Coffee', 'amount': 200.0, 'category': 'Food'}
+
+        with mock.patch.object(ai_utils, 'fetch_expense_parse', side_effect=fetch) as model:
+            with ThreadPoolExecutor(self.CALLERS) as pool:
+                texts = ['Coffee 200'] * (self.CALLERS - 1) + ['  coffee 200!']
+                results = [pool.submit(ai_utils.request_expense_parse, text) for text in texts]
+                self.wait_for_followers(self.flight, self.CALLERS - 1)
+                release.set()
+                results = [result.result() for result in results]
+
+        self.assertEqual(model.call_count, 1)
+        self.assertEqual(results, [{'item': 'Coffee', 'amount': 200.0, 'category': 'Food'}] * self.CALLERS)
+        # Each caller has its own copy
+        self.assertEqual(len({id(result) for result in results}), self.CALLERS)
+        self.assertEqual(self.flight.get_stats(),
+                         {'leaders': 1, 'followers': self.CALLERS - 1, 'shared': 0, 'in_flight': 0})
+
+    def test_tasks_share_one_advice(self):
+        async def fetch(summary):
+            await asyncio.sleep(0.05)
+            return 'Cook at home.'
+
+        async def ask_all():
+            summary = [{'category': 'Food', 'total': 500.0}]
+            return await asyncio.gather(*[ai_utils.arequest_budget_advice(summary) for _ in range(self.CALLERS)])
+
+        with mock.patch.object(ai_utils, 'afetch_budget_advice', side_effect=fetch) as model:
+            self.assertEqual(asyncio.run(ask_all()), ['Cook at home.'] * self.CALLERS)
+            # Once the call finished the next one goes upstream again
+            asyncio.run(ask_all())
+        self.assertEqual(model.call_count, 2)
+
+    def test_errors_reach_every_caller(self):
+        release = threading.Event()
+
+        def fetch(summary):
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        with mock.patch.object(ai_utils, 'fetch_budget_advice', side_effect=fetch):
+            with ThreadPoolExecutor(2) as pool:
+                results = [pool.submit(ai_utils.request_budget_advice, []) for _ in range(2)]
+                self.wait_for_followers(self.flight, 1)
+                release.set()
+                for result in results:
+                    with self.assertRaises(RuntimeError):
+                        result.result()
+        self.assertEqual(self.flight.get_stats()['in_flight'], 0)
+
+    def test_cancelled_leader_hands_over_to_a_follower(self):
+        calls = []
+
+        async def fetch(summary):
+            calls.append(summary)
+            await asyncio.sleep(0.05)
+            return {'tip': 'Cook at home.'}
+
+        async def ask_and_cancel_leader():
+            leader = asyncio.ensure_future(self.flight.ado('advice', fetch, 'first'))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(self.flight.ado('advice', fetch, 'second'))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(ask_and_cancel_leader()), {'tip': 'Cook at home.'})
+        self.assertEqual(calls, ['first', 'second'])
+        self.assertEqual(self.flight.get_stats()['in_flight'], 0)
+
+    def test_leader_result_is_not_shared(self):
+        release = threading.Event()
+
+        def fetch():
+            release.wait(5)
+            return {'item': 'Coffee'}
+
+        with ThreadPoolExecutor(2) as pool:
+            leading = pool.submit(self.flight.do, 'parse', fetch)
+            time.sleep(0.05)
+            following = pool.submit(self.flight.do, 'parse', fetch)
+            self.wait_for_followers(self.flight, 1)
+            release.set()
+            result = leading.result()
+            # What finish_parse does to the leader's result
+            result['source'] = 'llm'
+            self.assertEqual(following.result(), {'item': 'Coffee'})
+
+    def test_processes_share_through_the_cache(self):
+        # Two instances on one cache alias stand in for two worker processes
+        first, second = ai_utils.SingleFlight(alias='default'), ai_utils.SingleFlight(alias='default')
+        release = threading.Event()
+        leader = mock.Mock(side_effect=lambda: release.wait(5) and 'Cook at home.')
+        follower = mock.Mock(return_value='Eat out less.')
+
+        with ThreadPoolExecutor(2) as pool:
+            leading = pool.submit(first.do, 'advice:food', leader)
+            for _ in range(500):
+                if leader.called:
+                    break
+                time.sleep(0.01)
+            following = pool.submit(second.do, 'advice:food', follower)
+            time.sleep(0.1)
+            release.set()
+            self.assertEqual((leading.result(), following.result()), ('Cook at home.', 'Cook at home.'))
+        follower.assert_not_called()
+        self.assertEqual(second.get_stats()['shared'], 1)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Answers chat completions from the server's script of (status, delay) steps"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(self.client_address)
+        status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        time.sleep(delay)
+        content = '{"item": "Burger", "amount": 500, "category": "Food"}'
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+        } if status == 200 else {'error': {'message': 'stub error'}}).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client timed out and hung up
+
+    def log_message(self, *args):
+        pass
+
+
+class LLMGatewayTests(TestCase):
+    """Retries, timeouts and the circuit breaker against a local stand-in for the Groq API"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubLLMHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        self.server.script = []
+        self.server.requests = []
+
+    def make_gateway(self, **options):
+        options = {'timeout': 2, 'deadline': 5, 'max_retries': 2, 'backoff': 0.01, **options}
+        return LLMGateway(api_key='test', base_url=f'http://127.0.0.1:{self.server.server_port}', **options)
+
+    def complete(self, gateway):
+        return gateway.complete(**ai_utils.get_parse_request('burger 500'))
+
+    def test_transient_errors_are_retried_on_the_same_connection(self):
+        gateway = self.make_gateway()
+        self.server.script = [(500, 0), (503, 0)]
+        self.assertEqual(ai_utils.read_parse_response(self.complete(gateway))['item'], 'Burger')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(set(self.server.requests)), 1)
+
+        self.server.script = [(500, 0)]
+        completion = asyncio.run(gateway.acomplete(**ai_utils.get_parse_request('burger 500')))
+        self.assertEqual(ai_utils.read_parse_response(completion)['amount'], 500)
+
+        stats = gateway.get_stats()
+        self.assertEqual((stats['calls'], stats['successes'], stats['retries']), (2, 2, 3))
+        self.assertEqual(stats['latency']['count'], 2)
+
+    def test_async_calls_use_the_sync_client_without_long_lived_loops(self):
+        gateway = self.make_gateway(async_clients=False)
+        for _ in range(2):
+            # A new event loop per call, like async views under WSGI
+            completion = asyncio.run(gateway.acomplete(**ai_utils.get_parse_request('burger 500')))
+            self.assertEqual(ai_utils.read_parse_response(completion)['item'], 'Burger')
+        self.assertEqual(len(gateway.async_states), 0)
+        self.assertEqual(len(set(self.server.requests)), 1)
+
+    def test_client_errors_are_not_retried(self):
+        gateway = self.make_gateway()
+        self.server.script = [(400, 0)]
+        with self.assertRaises(LLMUnavailable):
+            self.complete(gateway)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_slow_answers_time_out(self):
+        gateway = self.make_gateway(timeout=0.2, max_retries=0)
+        self.server.script = [(200, 1)]
+        started = time.monotonic()
+        with self.assertRaises(LLMUnavailable):
+            self.complete(gateway)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_open_circuit_fails_fast_and_parses_fall_back(self):
+        gateway = self.make_gateway(max_retries=0, failure_threshold=2, reset_timeout=60)
+        self.server.script = [(500, 0)] * 2
+        with mock.patch.object(ai_utils, 'get_gateway', return_value=gateway):
+            for _ in range(2):
+                self.assertIsNone(ai_utils.request_expense_parse('burger 500'))
+            self.assertEqual(gateway.get_stats()['breaker_state'], 'open')
+
+            self.assertEqual(ai_utils.parse_expense_with_ai('Spent 450 on burger'),
+                             {'item': 'Burger', 'amount': 450.0, 'category': 'Others', 'source': 'fallback'})
+            self.assertIsNone(ai_utils.parse_expense_with_ai('burger'))
+            self.assertEqual(ai_utils.get_ai_budget_advice([{'category': 'Food', 'total': 600.0},
+                                                            {'category': 'Bills', 'total': 400.0}]),
+                             "You spent 60% on Food this month. Cutting it by 10% would save you Rs. 60.")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(gateway.get_stats()['rejected'], 3)
+
+        # After reset_timeout a trial call closes the circuit again
+        gateway.breaker.opened_at -= 60
+        self.assertEqual(ai_utils.read_parse_response(self.complete(gateway))['item'], 'Burger')
+        self.assertEqual(gateway.get_stats()['breaker_state'], 'closed')
+
+
+    def test_abandoned_trial_call_gives_the_trial_back(self):
+        gateway = self.make_gateway(failure_threshold=1, reset_timeout=0)
+        gateway.breaker.record_failure()
+
+        async def hang(**request):
+            await asyncio.sleep(60)
+
+        async def cancel_trial():
+            task = asyncio.ensure_future(gateway.acomplete(**ai_utils.get_parse_request('burger 500')))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=hang)))
+        with mock.patch.object(gateway, 'make_async_client', return_value=async_client):
+            asyncio.run(cancel_trial())
+        self.assertEqual((gateway.breaker.state, gateway.breaker.trial_running), ('half_open', False))
+
+        # Same for an error the gateway doesn't handle
+        with mock.patch.object(gateway.client.chat.completions, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.complete(gateway)
+        self.assertFalse(gateway.breaker.trial_running)
+
+        # The next call is the new trial, and closes the circuit
+        self.assertEqual(ai_utils.read_parse_response(self.complete(gateway))['item'], 'Burger')
+        self.assertEqual(gateway.get_stats()['breaker_state'], 'closed')
+
+class LLMSimulatorTests(TestCase):
+    """The simulator backend answers like the model, replays recordings and injects failures"""
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+
+    def use_simulator(self, simulator):
+        gateway = LLMGateway(api_key=None, max_retries=1, backoff=0, simulator=simulator)
+        patcher = mock.patch.object(ai_utils, 'get_gateway', return_value=gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return gateway
+
+    def test_synthesized_answers_go_through_the_pipeline(self):
+        with self.settings(LLM_BACKEND='simulator', LLM_SIM_LATENCY_MS=1):
+            self.use_simulator(LLMGateway.from_settings().simulator)
+        self.assertEqual(ai_utils.parse_expense_with_ai('Spent 450 on pizza'),
+                         {'item': 'Pizza', 'amount': 450.0, 'category': 'Food', 'source': 'llm'})
+        self.assertEqual(ai_utils.parse_expenses_with_ai(['uber 120', 'electricity bill 900'])[1]['category'],
+                         'Bills')
+        self.assertTrue(ai_utils.get_ai_budget_advice([{'category': 'Food', 'total': 500.0}]))
+
+    def test_recorded_responses_are_replayed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'recordings.json')
+            request = ai_utils.get_parse_request('burger 500')
+            LLMRecorder(path).record(request, '{"item": "Veg Burger", "amount": 500, "category": "Food"}')
+            simulator = LLMSimulator(recordings=load_recordings(path), latency_ms=1)
+        self.use_simulator(simulator)
+        self.assertEqual(ai_utils.parse_expense_with_ai('burger 500')['item'], 'Veg Burger')
+        self.assertEqual(ai_utils.parse_expense_with_ai('pizza 300')['item'], 'Pizza')
+        self.assertEqual(simulator.get_stats(), {'replayed': 1, 'synthesized': 1})
+
+    def test_injected_errors_and_timeouts(self):
+        gateway = self.use_simulator(LLMSimulator(latency_ms=1, error_rates={'server': 1.0}))
+        self.assertEqual(ai_utils.parse_expense_with_ai('Spent 450 on pizza')['source'], 'fallback')
+        self.assertEqual((gateway.get_stats()['failures'], gateway.get_stats()['retries']), (1, 1))
+
+        slow = LLMSimulator(latency_ms=5000)
+        gateway = LLMGateway(api_key=None, timeout=0.05, max_retries=0, simulator=slow)
+        started = time.monotonic()
+        with self.assertRaises(LLMUnavailable):
+            gateway.complete(**ai_utils.get_parse_request('pizza 300'))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_same_seed_same_run(self):
+        draws = [[simulator.draw(None) for _ in range(20)]
+                 for simulator in (LLMSimulator(error_rates={'server': 0.3}, seed=7) for _ in range(2))]
+        self.assertEqual(draws[0], draws[1])
+        self.assertIn('server', [error for _, error in draws[0]])
+
+
+class PromptBudgetTests(TestCase):
+    """Prompts stay within the token caps and every call's tokens are booked"""
+
+    def setUp(self):
+        cache.clear()
+        ai_utils.get_parse_cache().clear()
+        gateway = LLMGateway(api_key=None, max_retries=0, simulator=LLMSimulator(latency_ms=1))
+        patcher = mock.patch.object(ai_utils, 'get_gateway', return_value=gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_long_texts_are_clipped(self):
+        with self.settings(AI_PARSE_TEXT_MAX_TOKENS=8):
+            request = ai_utils.get_parse_request('spent   450\n on ' + 'pizza ' * 100)
+        self.assertEqual(request['messages'][1]['content'], 'spent 450 on pizza pizza pizza p')
+        self.assertEqual(request['max_tokens'], 64)
+
+    def test_small_categories_are_summed(self):
+        summary = [{'category': f"Cat{number}", 'total': 100.0 * number} for number in range(1, 6)]
+        self.assertEqual(format_summary(summary, 3), "Monthly spending (Rs): Cat5 500, Cat4 400, Other categories 600")
+        self.assertEqual(format_summary(summary[:2], 3), "Monthly spending (Rs): Cat2 200, Cat1 100")
+
+    def test_token_usage_is_recorded(self):
+        ai_utils.parse_expense_with_ai('Spent 450 on pizza')
+        ai_utils.parse_expenses_with_ai(['uber 120', 'electricity bill 900'])
+        ai_utils.get_ai_budget_advice([{'category': 'Food', 'total': 500.0}])
+        ai_utils.get_ai_budget_advice([{'category': 'Food', 'total': 900.0}])
+
+        usage = {row.purpose: row for row in TokenUsage.objects.all()}
+        self.assertEqual({purpose: row.calls for purpose, row in usage.items()},
+                         {'parse': 1, 'parse_batch': 1, 'advice': 2})
+        self.assertTrue(all(row.prompt_tokens and row.completion_tokens for row in usage.values()))
+
+        output = StringIO()
+        call_command('token_report', stdout=output)
+        self.assertRegex(output.getvalue(), r'advice\s+2\s+\d+')
+
+
+class CategoryRegistryTests(TestCase):
+    """Categories are resolved in memory: no per-insert get_or_create, no duplicates by case"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('registry', password='pw')
+        cls.food = Category.objects.create(name='Food')
+
+    def setUp(self):
+        cache.clear()
+        get_category_registry().clear()
+        self.client.force_login(self.user)
+
+    def category_queries(self, queries):
+        return [query['sql'] for query in queries if 'tracker_category' in query['sql']]
+
+    def test_names_resolve_without_queries(self):
+        get_category_registry().all()
+        with CaptureQueriesContext(connection) as queries:
+            expense = create_expense(self.user, 'burger 200', {'item': 'Burger', 'amount': 200, 'category': ' food '})
+        self.assertEqual(expense.category, self.food)
+        self.assertEqual(self.category_queries(queries), [])
+
+        create_expense(self.user, 'tea 20', {'item': 'Tea', 'amount': 20, 'category': 'Snacks'})
+        create_expense(self.user, 'chips 30', {'item': 'Chips', 'amount': 30, 'category': 'SNACKS'})
+        self.assertEqual(list(Category.objects.filter(name__iexact='snacks').values_list('name', flat=True)),
+                         ['Snacks'])
+
+    def test_serializer_validates_against_registry(self):
+        get_category_registry().all()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/expenses/', {'item': 'Pizza', 'amount': '300', 'raw_text': 'pizza 300',
+                                                           'category': self.food.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.category_queries(queries), [])
+        response = self.client.post('/api/expenses/', {'item': 'Pizza', 'amount': '300', 'raw_text': 'pizza 300',
+                                                       'category': 999999}, content_type='application/json')
+        self.assertEqual(response.json(), {'category': ['Invalid pk "999999" - object does not exist.']})
+        self.assertEqual(self.client.post(reverse('budget_create'), {'category': 999999, 'amount': 10,
+                                                                     'period': 'monthly'}).status_code, 404)
+
+    def test_other_processes_pick_up_changes(self):
+        # Two processes, each with its own registry and its own cache
+        other = CategoryRegistry(check_interval=60)
+        self.assertEqual(other.get_by_name('Food'), self.food)
+        # Created without signals, as by another process: an unknown name reloads once
+        Category.objects.bulk_create([Category(name='Travel')])
+        travel = other.get_by_name('travel')
+        self.assertEqual(travel.name, 'Travel')
+        travel_pk = travel.pk
+
+        get_category_registry().load()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get(pk=self.food.pk).save()
+            Category.objects.filter(pk=self.food.pk).update(name='Groceries')
+            travel.delete()
+        cache.clear()
+        self.assertEqual(get_category_registry().get(self.food.pk).name, 'Groceries')
+        self.assertEqual(other.get(self.food.pk).name, 'Food')
+
+        loads = other.loads
+        other.loaded_at -= 60
+        self.assertEqual(other.get(self.food.pk).name, 'Groceries')
+        self.assertIsNone(other.get(travel_pk))
+        self.assertEqual(other.loads, loads + 2)
+
+
+class StartupTests(TestCase):
+    """Booting the app doesn't import the export and LLM libraries"""
+
+    def test_heavy_libraries_are_imported_lazily(self):
+        code = ("import sys, core.wsgi; from django.urls import get_resolver; get_resolver().url_patterns; "
+                "print(' '.join(sorted({'groq', 'httpx', 'openpyxl', 'reportlab'} & set(sys.modules))))")
+        # core.wsgi preloads the categories, from an empty database rather than the configured one
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE,
+               'DB_ENGINE': 'sqlite', 'DB_NAME': ':memory:', 'DB_POOL': 'False'}
+        output = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                                env=env, check=True)
+        self.assertEqual(output.stdout.strip(), '')
+
+        with mock.patch.object(LLMGateway, 'make_client') as make_client:
+            gateway = LLMGateway(api_key='test')
+            make_client.assert_not_called()
+            self.assertIs(gateway.client, gateway.client)
+            make_client.assert_called_once_with()
+
+    def test_parse_importtime(self):
+        output = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |     groq._types",
+            "import time:       200 |        300 |   groq",
+            "import time:        50 |        350 | tracker.ai_utils",
+            "import time:        40 |         40 | json",
+        ])
+        self.assertEqual(parse_importtime(output), {
+            'import_us': 390, 'modules': 4, 'packages': {'groq': 300, 'tracker': 50, 'json': 40},
+        })
+
+
+class UserCacheTests(TestCase):
+    """Cached pages and API lists are per user and dropped when that user's data changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cached', password='pw')
+        cls.other = User.objects.create_user('bystander', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        Expense.objects.create(user=cls.user, item='Pizza', amount=300, category=cls.food, raw_text='pizza 300')
+        Budget.objects.create(user=cls.user, category=cls.food, amount=1000, period='monthly')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_cached_until_the_users_data_changes(self):
+        urls = ['/api/expenses/', '/api/budgets/', reverse('budget_list'), reverse('dashboard')]
+        for url in urls:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            responses = [self.client.get(url) for url in urls]
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        # Only the user's data version is looked up, for the namespace and the ETags
+        self.assertFalse([query['sql'] for query in queries
+                          if 'tracker_' in query['sql'] and 'tracker_dataversion' not in query['sql']])
+
+        other_version = get_user_cache_version(self.other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(user=self.user, item='Burger', amount=200, category=self.food, raw_text='burger')
+        self.assertEqual(get_user_cache_version(self.other.pk), other_version)
+        self.assertEqual(len(self.client.get('/api/expenses/').json()['results']), 2)
+        self.assertEqual(self.client.get('/api/budgets/').json()[0]['spent_amount'], 500.0)
+
+    def test_write_from_another_process_is_seen(self):
+        self.assertEqual(self.client.get('/api/budgets/').json()[0]['spent_amount'], 300.0)
+        # Saves only touch the database (row, rollups, data version), the same as in another worker
+        expense = Expense.objects.get(user=self.user)
+        expense.amount = 450
+        expense.save()
+        self.assertEqual(self.client.get('/api/budgets/').json()[0]['spent_amount'], 450.0)
+
+
+class ConditionalGetTests(TestCase):
+    """Polled API responses carry validators and come back as 304 until the user's data changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('poller', password='pw')
+        cls.other = User.objects.create_user('quiet', password='pw')
+        cls.food = Category.objects.create(name='Food')
+        cls.expense = Expense.objects.create(user=cls.user, item='Pizza', amount=300, category=cls.food,
+                                             raw_text='pizza 300')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        # Last-Modified is only sent once the second of the last change is over
+        DataVersion.objects.filter(user=self.user).update(changed_at=timezone.now() - timedelta(minutes=1))
+
+    def test_not_modified_until_a_write(self):
+        for url in ['/api/expenses/', '/api/budgets/', '/api/dashboard/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            with CaptureQueriesContext(connection) as queries:
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+            self.assertEqual([query['sql'] for query in queries if 'tracker_' in query['sql']
+                              and 'tracker_dataversion' not in query['sql']], [])
+
+        etag = self.client.get('/api/expenses/')['ETag']
+        self.assertNotEqual(self.client.get('/api/expenses/?ordering=x')['ETag'], etag)
+        other_version = get_data_version(self.other.pk)
+        Budget.objects.create(user=self.user, category=self.food, amount=1000, period='monthly')
+        self.assertEqual(get_data_version(self.other.pk), other_version)
+        self.assertEqual(self.client.get('/api/expenses/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.expense.delete()
+        # Setup expense, budget, delete
+        self.assertEqual(DataVersion.objects.get(user=self.user).version, 3)
+
+    def test_no_last_modified_within_the_second_of_a_write(self):
+        response = self.client.get('/api/budgets/')
+        Budget.objects.create(user=self.user, category=self.food, amount=1000, period='monthly')
+        # A client that only sends If-Modified-Since can't miss a second write in the same second
+        fresh = self.client.get('/api/budgets/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertFalse(fresh.has_header('Last-Modified'))
+        Budget.objects.create(user=self.user, category=None, amount=5000, period='monthly')
+        self.assertEqual(self.client.get('/api/budgets/', HTTP_IF_MODIFIED_SINCE=http_date()).status_code, 200)
+
+    def test_fallback_advice_is_not_kept(self):
+        with mock.patch.object(advice, 'arequest_budget_advice', mock.AsyncMock(return_value=None)):
+            response = self.client.get('/api/advice/')
+        self.assertIn('100% on Food', response.json()['advice'])
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        with mock.patch.object(advice, 'arequest_budget_advice', mock.AsyncMock(return_value='Cook at home.')):
+            response = self.client.get('/api/advice/')
+        self.assertEqual(response.json()['advice'], 'Cook at home.')
+        self.assertEqual(self.client.get('/api/advice/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_updated_since(self):
+        since = timezone.now()
+        self.assertLess(self.expense.updated_at, since + timedelta(seconds=1))
+        Expense.objects.filter(pk=self.expense.pk).update(updated_at=since - timedelta(hours=1))
+        newer = Expense.objects.create(user=self.user, item='Tea', amount=20, category=self.food, raw_text='tea 20')
+        response = self.client.get('/api/expenses/', {'updated_since': since.isoformat()})
+        self.assertEqual([row['id'] for row in response.json()['results']], [newer.pk])
+        self.assertEqual(self.client.get('/api/expenses/', {'updated_since': 'yesterday'}).status_code, 400)
+
+
+class ExportFormatTests(TestCase):
+    """The downloaded files open in the tools they are made for"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reporter', password='pw')
+        food = Category.objects.create(name='Food')
+        for amount in ('1200.50', '99.99', '3000'):
+            Expense.objects.create(user=cls.user, item='Pizza', amount=amount, category=food, raw_text='pizza')
+        Expense.objects.create(user=cls.user, item='Gift', amount=10, category=None, raw_text='gift')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def download(self, format):
+        response = self.client.get(reverse('export_expenses', args=[format]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_csv_rows_across_batches(self):
+        food = Category.objects.get(name='Food')
+        for i in range(6):
+            Expense.objects.create(user=self.user, item=f'Item {i}', amount=i + 1, category=food, raw_text=f'item, "{i}"')
+        # Ties on created_at straddle the batch boundaries, the id breaks them
+        same_time = timezone.now() - timedelta(days=1)
+        Expense.objects.filter(user=self.user, item__in=['Item 1', 'Item 2', 'Item 3', 'Item 4']).update(created_at=same_time)
+        Expense.objects.create(user=User.objects.create_user('other', password='pw'), item='Hidden', amount=1, raw_text='x')
+
+        with mock.patch.object(exports, 'EXPORT_BATCH_SIZE', 3):
+            response = self.client.get(reverse('export_expenses', args=['csv']))
+            chunks = list(response.streaming_content)
+        rows = list(csv.reader(StringIO(b''.join(chunks).decode())))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(rows[0], EXPORT_HEADERS)
+        expected = [
+            [str(value) for value in get_export_row(expense)]
+            for expense in Expense.objects.filter(user=self.user).select_related('category').order_by('-created_at', '-pk')
+        ]
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(rows[1:], expected)
+
+    def test_excel_workbook(self):
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(BytesIO(self.download('excel')))['Expenses']
+        rows = list(sheet.iter_rows())
+        self.assertEqual([cell.value for cell in rows[0]], EXPORT_HEADERS)
+        self.assertEqual(len(rows), 5)
+        newest = Expense.objects.filter(user=self.user).latest('created_at')
+        date, item, category, amount, raw_text = rows[1]
+        self.assertEqual((item.value, category.value, amount.value, raw_text.value), ('Gift', 'Uncategorized', 10, 'gift'))
+        # Local wall clock time, Excel keeps milliseconds
+        self.assertAlmostEqual(date.value, timezone.localtime(newest.created_at).replace(tzinfo=None),
+                               delta=timedelta(milliseconds=1))
+        self.assertEqual([row[3].value for row in rows[2:]], [3000, 99.99, 1200.5])
+        for date, _, _, amount, _ in rows[1:]:
+            self.assertEqual((date.number_format, amount.number_format), ('yyyy-mm-dd hh:mm', '#,##0.00'))
+
+    def test_pdf_report(self):
+        content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        # Page contents are ASCII85 encoded and deflated
+        text = b''.join(zlib.decompress(base64.a85decode(stream.strip().removesuffix(b'~>'))) for stream in
+                        re.findall(rb'/ASCII85Decode /FlateDecode \].*?stream\r?\n(.*?)endstream', content, re.DOTALL))
+        self.assertIn(b'(Total Spent: Rs. 4310.49)', text)
+        self.assertIn(b'(reporter)', text)
+        self.assertEqual(text.count(b'(Pizza)'), 3)
+
+
+class ExportJobTests(TestCase):
+    """Large exports go through the job queue, each user only sees their own jobs"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('exporter', password='pw')
+        cls.other = User.objects.create_user('snoop', password='pw')
+        food = Category.objects.create(name='Food')
+        for amount in (100, 200, 300):
+            Expense.objects.create(user=cls.user, item='Pizza', amount=amount, category=food, raw_text='pizza')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(self.settings(EXPORT_ROOT=directory.name, EXPORT_ASYNC_THRESHOLD=2))
+
+    def test_threshold_routes_to_the_queue_once(self):
+        response = self.client.get(reverse('export_expenses', args=['csv']))
+        job = ExportJob.objects.get()
+        self.assertRedirects(response, reverse('export_job_detail', args=[job.pk]))
+        self.assertEqual((job.format, job.status, job.total_rows), ('csv', ExportJob.PENDING, 3))
+        # A refresh of the link joins the pending job
+        self.client.get(reverse('export_expenses', args=['csv']))
+        self.client.get(reverse('export_expenses', args=['pdf']))
+        self.assertEqual(ExportJob.objects.filter(format='csv').count(), 1)
+        self.assertEqual(ExportJob.objects.count(), 2)
+
+        with self.settings(EXPORT_ASYNC_THRESHOLD=3):
+            response = self.client.get(reverse('export_expenses', args=['csv']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+    def test_claimed_run_and_downloaded_by_the_owner_only(self):
+        job = enqueue_export(self.user, 'csv')
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (job.pk, ExportJob.RUNNING, 1))
+        self.assertIsNone(claim_next_job())
+
+        job = run_export_job(claimed)
+        self.assertEqual(job.status, ExportJob.DONE)
+        status = self.client.get(reverse('export_job_status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['progress']), ('done', 100))
+        response = self.client.get(status['download_url'])
+        self.assertEqual(b''.join(response.streaming_content).decode().count('Pizza'), 3)
+
+        self.client.force_login(self.other)
+        for name in ('export_job_detail', 'export_job_status', 'export_job_download'):
+            self.assertEqual(self.client.get(reverse(name, args=[job.pk])).status_code, 404)
+
+    def test_stale_jobs_are_requeued_until_the_attempts_run_out(self):
+        job = enqueue_export(self.user, 'pdf')
+        stale = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS + 1)
+        for attempt in range(1, settings.EXPORT_JOB_MAX_ATTEMPTS + 1):
+            self.assertEqual(claim_next_job().attempts, attempt)
+            ExportJob.objects.filter(pk=job.pk).update(updated_at=stale)
+            expected = (0, 1) if attempt == settings.EXPORT_JOB_MAX_ATTEMPTS else (1, 0)
+            self.assertEqual(requeue_stale_jobs(), expected)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIsNone(claim_next_job())
+
+    def test_expired_jobs_are_purged_with_their_file(self):
+        enqueue_export(self.user, 'csv')
+        job = run_export_job(claim_next_job())
+        path = job.get_file_path()
+        self.assertTrue(path.exists())
+        self.assertEqual(purge_expired_jobs(), 0)
+        ExportJob.objects.filter(pk=job.pk).update(
+            finished_at=timezone.now() - timedelta(hours=settings.EXPORT_RETENTION_HOURS + 1))
+        self.assertEqual(purge_expired_jobs(), 1)
+        self.assertFalse(path.exists())
+        self.assertFalse(ExportJob.objects.exists())
@@ -0,0 +1,37 @@
+"""
+Token accounting of the LLM calls, one counter row per day, purpose and model.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TokenUsage
+from .prompts import estimate_tokens
+
+
+def get_call_tokens(request, chat_completion):
+    """(prompt tokens, completion tokens) as counted by the API, estimated when it didn't say"""
+    usage = getattr(chat_completion, 'usage', None)
+    if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+        return usage.prompt_tokens, usage.completion_tokens or 0
+    prompt_tokens = sum(estimate_tokens(message['content']) for message in request['messages'])
+    return prompt_tokens, estimate_tokens(chat_completion.choices[0].message.content or '')
+
+
+def record_token_usage(purpose, request, chat_completion):
+    prompt_tokens, completion_tokens = get_call_tokens(request, chat_completion)
+    counters = {'day': timezone.localdate(), 'purpose': purpose, 'model': request.get('model', '')}
+    deltas = {
+        'calls': F('calls') + 1,
+        'prompt_tokens': F('prompt_tokens') + prompt_tokens,
+        'completion_tokens': F('completion_tokens') + completion_tokens,
+    }
+    if TokenUsage.objects.filter(**counters).update(**deltas):
+        return
+    try:
+        with transaction.atomic():
+            TokenUsage.objects.create(**counters, calls=1, prompt_tokens=prompt_tokens,
+                                      completion_tokens=completion_tokens)
+    except IntegrityError:
+        # Another process created today's row first
+        TokenUsage.objects.filter(**counters).update(**deltas)
@@ -21,8 +21,15 @@ urlpatterns = [
     path('expense/<int:expense_id>/delete/', views.delete_expense, name='delete_expense'),
     path('get-savings-tip/', views.get_savings_tip, name='get_savings_tip'),
     path('export/<str:format>/', views.export_expenses, name='export_expenses'),
+    path('exports/<int:job_id>/', views.export_job_detail, name='export_job_detail'),
+    path('exports/<int:job_id>/status/', views.export_job_status, name='export_job_status'),
+    path('exports/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
     
     # API Endpoints
+    # Async view, routed ahead of the router so it isn't taken for an expense id
+    path('api/expenses/add_with_ai/', api_views.AddExpenseWithAIView.as_view(), name='expense-add-with-ai'),
     path('api/', include(router.urls)),
     path('api/advice/', api_views.AISavingsAdviceView.as_view(), name='api_advice'),
+    path('api/dashboard/', api_views.DashboardView.as_view(), name='api_dashboard'),
+    path('api/ai/stats/', api_views.AIStatsView.as_view(), name='api_ai_stats'),
 ]
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+Per-user cache namespace.
+
+Everything cached for a user (dashboard payload, budget statuses, API list
+responses) is keyed under the user's data version: the DataVersion counter in
+the database that every write to their expenses or budgets bumps (see
+tracker.conditional). Once a change commits, every process reads the new
+version and moves to new keys, whichever CACHES backend each one uses, for one
+primary key lookup per read. The old entries just expire.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .conditional import get_data_version
+
+
+def get_user_cache_version(user_id):
+    version, _ = get_data_version(user_id)
+    return version
+
+
+def get_user_cache_key(user_id, name, *parts):
+    return ':'.join(['user', str(user_id), str(get_user_cache_version(user_id)), name, *map(str, parts)])
+
+
+def cached_for_user(user_id, name, build, parts=(), timeout=None):
+    """build() cached under the user's namespace, for `timeout` seconds (USER_CACHE_TIMEOUT by default)"""
+    key = get_user_cache_key(user_id, name, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, settings.USER_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
@@ -1,57 +1,67 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib import messages
-from django.utils import timezone
-from datetime import timedelta, datetime
-from django.http import JsonResponse
-from .models import Expense, Category, Budget
-from .ai_utils import parse_expense_with_ai, get_ai_budget_advice
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncDate, TruncMonth
+from django.utils.dateparse import parse_datetime
+from django.http import JsonResponse, Http404
+from .models import Expense, Budget, ExportJob
+from .advice import aget_savings_advice
+from .ai_utils import aparse_expense_with_ai
+from .enrichment import defer_expense
+from .ingest import create_expense
+from .budget_utils import get_cached_budget_statuses, get_expense_alerts
+from .categories import get_category_registry
+from .analytics import get_dashboard_payload
+from .pagination import InvalidCursor, paginate_by_keyset
+from .exports import EXPORT_FORMATS, csv_response, excel_response, get_export_filename, get_export_queryset, write_pdf
+from .jobs import enqueue_export, should_run_in_background
 import json
-import csv
-from django.http import HttpResponse
-from openpyxl import Workbook
-from xhtml2pdf import pisa
-from django.template.loader import get_template
-from io import BytesIO
+from django.http import HttpResponse, FileResponse
 
 @login_required
-def add_expense(request):
+async def add_expense(request):
     if request.method == "POST":
         user_text = request.POST.get('raw_text')
+        user = await request.auser()
+        if settings.AI_DEFER_ENRICHMENT:
+            return await sync_to_async(save_deferred_expense)(request, user, user_text)
         
-        # AI Extraction
-        ai_data = parse_expense_with_ai(user_text)
-        
-        if ai_data:
-            # Safely handle category mapping
-            category_name = ai_data.get('category', 'Others')
-            cat_obj, _ = Category.objects.get_or_create(name=category_name)
-            
-            # Save Expense
-            expense = Expense.objects.create(
-                user=request.user,
-                item=ai_data.get('item', 'Miscellaneous'),
-                amount=ai_data.get('amount', 0),
-                category=cat_obj,
-                raw_text=user_text
-            )
-            
-            # Check for budget alerts after expense creation
-            check_budget_alerts(request, request.user, expense)
-            
-            messages.success(request, f"Expense added: {expense.item} - {expense.amount}")
-            return redirect('dashboard') 
-        else:
-            messages.error(request, 'AI could not process this. Please try again with more detail.')
-            return render(request, 'tracker/add_expense.html', {
-                'error': 'AI could not process this. Please try again with more detail.'
-            })
+        # AI Extraction, awaited without holding a worker thread
+        ai_data = await aparse_expense_with_ai(user_text, user=user)
+        return await sync_to_async(save_ai_expense)(request, user, user_text, ai_data)
             
-    return render(request, 'tracker/add_expense.html')
+    return await sync_to_async(render)(request, 'tracker/add_expense.html')
+
+def save_ai_expense(request, user, user_text, ai_data):
+    if ai_data:
+        # Save Expense
+        expense = create_expense(user, user_text, ai_data)
+        
+        # Check for budget alerts after expense creation
+        check_budget_alerts(request, user, expense)
+        
+        messages.success(request, f"Expense added: {expense.item} - {expense.amount}")
+        return redirect('dashboard') 
+    else:
+        messages.error(request, 'AI could not process this. Please try again with more detail.')
+        return render(request, 'tracker/add_expense.html', {
+            'error': 'AI could not process this. Please try again with more detail.'
+        })
+
+def save_deferred_expense(request, user, user_text):
+    if not user_text or not user_text.strip():
+        return render(request, 'tracker/add_expense.html', {'error': 'Please describe the expense.'})
+    expense, _ = defer_expense(user, user_text)
+    if expense.ai_status == Expense.AI_PENDING:
+        messages.info(request, f"Expense saved: {expense.item} - {expense.amount}. AI is categorizing it in the background.")
+    else:
+        check_budget_alerts(request, user, expense)
+        messages.success(request, f"Expense added: {expense.item} - {expense.amount}")
+    return redirect('dashboard')
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -97,33 +107,13 @@ def logout_view(request):
 
 def check_budget_alerts(request, user, expense):
     """Check if expense triggers any budget alerts"""
-    budgets = Budget.objects.filter(user=user)
-    for budget in budgets:
-        if budget.category == expense.category or budget.category is None:
-            if budget.is_exceeded():
-                messages.warning(
-                    request,
-                    f"⚠️ Budget Exceeded! {budget.category.name if budget.category else 'Overall'} budget ({budget.period}) exceeded by Rs. {abs(budget.get_remaining_amount()):.2f}"
-                )
-            elif budget.get_percentage_used() >= 90:
-                messages.warning(
-                    request,
-                    f"⚠️ Budget Alert! {budget.category.name if budget.category else 'Overall'} budget ({budget.period}) is {budget.get_percentage_used():.1f}% used."
-                )
+    for alert in get_expense_alerts(user, expense.category_id):
+        messages.warning(request, alert)
 
 @login_required
 def budget_list(request):
     """View all budgets"""
-    budgets = Budget.objects.filter(user=request.user).order_by('-created_at')
-    budget_data = []
-    for budget in budgets:
-        budget_data.append({
-            'budget': budget,
-            'spent': budget.get_spent_amount(),
-            'remaining': budget.get_remaining_amount(),
-            'percentage': budget.get_percentage_used(),
-            'exceeded': budget.is_exceeded()
-        })
+    budget_data = get_cached_budget_statuses(request.user)
     return render(request, 'tracker/budget_list.html', {'budgets': budget_data})
 
 @login_required
@@ -141,7 +131,9 @@ def budget_create(request):
         
         category = None
         if category_id:
-            category = get_object_or_404(Category, id=category_id)
+            category = get_category_registry().get(category_id)
+            if category is None:
+                raise Http404("No such category")
         
         if budget:
             # Update existing budget
@@ -165,7 +157,7 @@ def budget_create(request):
         
         return redirect('budget_list')
     
-    categories = Category.objects.all()
+    categories = get_category_registry().all()
     return render(request, 'tracker/budget_form.html', {
         'categories': categories,
         'budget': budget
@@ -194,175 +186,103 @@ def delete_expense(request, expense_id):
 @login_required
 def expense_list(request):
     # History page ke liye logic
-    expenses = Expense.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'tracker/expense_list.html', {'expenses': expenses})
+    expenses = Expense.objects.filter(user=request.user).select_related('category')
+    try:
+        page = paginate_by_keyset(expenses, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        raise Http404("Invalid cursor")
+    return render(request, 'tracker/expense_list.html', {'expenses': page, 'page': page})
 
 @login_required
 def dashboard(request):
-    # 1. Category-wise spending (Pie Chart)
-    data = Expense.objects.filter(user=request.user).values('category__name').annotate(total=Sum('amount'))
-    
-    labels = [item['category__name'] if item['category__name'] else "Uncategorized" for item in data]
-    values = [float(item['total']) for item in data]
-    
-    # 2. Trend Analysis - Last 30 days spending
-    end_date = timezone.now()
-    start_date = end_date - timedelta(days=30)
-    
-    daily_expenses = Expense.objects.filter(
-        user=request.user,
-        created_at__gte=start_date
-    ).annotate(
-        date=TruncDate('created_at')
-    ).values('date').annotate(
-        total=Sum('amount')
-    ).order_by('date')
-    
-    trend_dates = [item['date'].strftime('%Y-%m-%d') if item['date'] else '' for item in daily_expenses]
-    trend_amounts = [float(item['total']) for item in daily_expenses]
-    
-    # 3. Monthly Trend (Last 6 months)
-    monthly_expenses = Expense.objects.filter(
-        user=request.user
-    ).annotate(
-        month=TruncMonth('created_at')
-    ).values('month').annotate(
-        total=Sum('amount')
-    ).order_by('month')[:6]
+    # All series come from one cached payload, also served by /api/dashboard/
+    payload = get_dashboard_payload(request.user)
     
-    monthly_labels = [item['month'].strftime('%b %Y') if item['month'] else '' for item in monthly_expenses]
-    monthly_values = [float(item['total']) for item in monthly_expenses]
-    
-    # 4. Recent Transactions
-    recent_expenses = Expense.objects.filter(user=request.user).order_by('-created_at')[:5]
-    
-    # 5. Budget Alerts
-    budgets = Budget.objects.filter(user=request.user)
-    budget_alerts = []
-    for budget in budgets:
-        spent = budget.get_spent_amount()
-        percentage = budget.get_percentage_used()
-        if percentage >= 80:  # Alert if 80% or more used
-            budget_alerts.append({
-                'budget': budget,
-                'spent': spent,
-                'remaining': budget.get_remaining_amount(),
-                'percentage': percentage,
-                'exceeded': budget.is_exceeded()
-            })
-    
-    # 6. Overall Statistics
-    total_expenses = Expense.objects.filter(user=request.user).count()
-    avg_expense = Expense.objects.filter(user=request.user).aggregate(avg=Sum('amount'))['avg'] or 0
-    if total_expenses > 0:
-        avg_expense = float(avg_expense) / total_expenses
+    recent_expenses = [
+        dict(expense, created_at=parse_datetime(expense['created_at']))
+        for expense in payload['recent_expenses']
+    ]
     
     context = {
-        'labels': json.dumps(labels),
-        'values': json.dumps(values),
-        'total_spent': sum(values) if values else 0,
+        'labels': json.dumps(payload['labels']),
+        'values': json.dumps(payload['values']),
+        'total_spent': payload['total_spent'],
         'recent_expenses': recent_expenses,
-        'trend_dates': json.dumps(trend_dates),
-        'trend_amounts': json.dumps(trend_amounts),
-        'monthly_labels': json.dumps(monthly_labels),
-        'monthly_values': json.dumps(monthly_values),
-        'budget_alerts': budget_alerts,
-        'total_expenses': total_expenses,
-        'avg_expense': avg_expense,
+        'trend_dates': json.dumps(payload['trend_dates']),
+        'trend_amounts': json.dumps(payload['trend_amounts']),
+        'monthly_labels': json.dumps(payload['monthly_labels']),
+        'monthly_values': json.dumps(payload['monthly_values']),
+        'budget_alerts': payload['budget_alerts'],
+        'total_expenses': payload['total_expenses'],
+        'avg_expense': payload['avg_expense'],
     }
     return render(request, 'tracker/dashboard.html', context)
 
 @login_required
-def get_savings_tip(request):
+async def get_savings_tip(request):
     """
     API endpoint to fetch AI savings advice based on current month's spending.
     """
-    # 1. Aggregate spending by category for the current month
-    current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    expenses = Expense.objects.filter(
-        user=request.user,
-        created_at__gte=current_month
-    ).values('category__name').annotate(total=Sum('amount')).order_by('-total')
-    
-    summary = []
-    for item in expenses:
-        cat_name = item['category__name'] if item['category__name'] else "Uncategorized"
-        summary.append({'category': cat_name, 'total': float(item['total'])})
-    
-    if not summary:
-        return JsonResponse({'advice': "No expenses recorded this month yet! Add some expenses to get advice."})
-        
-    # 2. Get AI Advice
-    advice = get_ai_budget_advice(summary)
-    
+    advice = await aget_savings_advice(await request.auser())
     return JsonResponse({'advice': advice})
+
 @login_required
 def export_expenses(request, format):
     """Export expenses in specified format"""
-    expenses = Expense.objects.filter(user=request.user).order_by('-created_at')
+    if format in EXPORT_FORMATS and should_run_in_background(request.user, format):
+        # Too large to render inside the request, hand it to the export worker
+        job = enqueue_export(request.user, format)
+        return redirect('export_job_detail', job_id=job.id)
+
+    expenses = get_export_queryset(request.user)
     
     if format == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="expenses_{timezone.now().strftime("%Y%m%d")}.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Date', 'Item', 'Category', 'Amount', 'Original Text'])
-        
-        for expense in expenses:
-            writer.writerow([
-                expense.created_at.strftime("%Y-%m-%d %H:%M"),
-                expense.item,
-                expense.category.name if expense.category else "Uncategorized",
-                expense.amount,
-                expense.raw_text
-            ])
-        return response
+        # Streamed in keyset batches so memory stays flat for any history size
+        return csv_response(expenses)
 
     elif format == 'excel':
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="expenses_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Expenses"
-        
-        # Headers
-        headers = ['Date', 'Item', 'Category', 'Amount', 'Original Text']
-        ws.append(headers)
-        
-        # Data
-        for expense in expenses:
-            ws.append([
-                expense.created_at.strftime("%Y-%m-%d %H:%M"),
-                expense.item,
-                expense.category.name if expense.category else "Uncategorized",
-                float(expense.amount),
-                expense.raw_text
-            ])
-            
-        wb.save(response)
-        return response
+        # Write-only workbook in a temp file, streamed back in blocks
+        return excel_response(expenses)
 
     elif format == 'pdf':
-        template_path = 'tracker/expense_report_pdf.html'
-        context = {
-            'expenses': expenses,
-            'user': request.user,
-            'today': timezone.now(),
-            'total_amount': expenses.aggregate(total=Sum('amount'))['total'] or 0
-        }
-        
         response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="expenses_{timezone.now().strftime("%Y%m%d")}.pdf"'
-        
-        template = get_template(template_path)
-        html = template.render(context)
-        
-        pisa_status = pisa.CreatePDF(html, dest=response)
-        
-        if pisa_status.err:
-            return HttpResponse('We had some errors while generating PDF.')
+        response['Content-Disposition'] = f'attachment; filename="{get_export_filename("pdf")}"'
+        write_pdf(expenses, response, user=request.user)
         return response
 
     return redirect('expense_list')
+
+
+@login_required
+def export_job_detail(request, job_id):
+    """Progress page of a background export, polls export_job_status"""
+    job = get_object_or_404(ExportJob, id=job_id, user=request.user)
+    return render(request, 'tracker/export_job.html', {'job': job})
+
+
+@login_required
+def export_job_status(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, user=request.user)
+    return JsonResponse({
+        'id': job.id,
+        'format': job.format,
+        'status': job.status,
+        'progress': job.get_progress(),
+        'processed_rows': job.processed_rows,
+        'total_rows': job.total_rows,
+        'error': job.error,
+        'download_url': reverse('export_job_download', args=[job.id]) if job.status == ExportJob.DONE else None,
+    })
+
+
+@login_required
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, user=request.user, status=ExportJob.DONE)
+    try:
+        file = open(job.get_file_path(), 'rb')
+    except OSError:
+        raise Http404("Export file no longer available")
+    export_format = EXPORT_FORMATS[job.format]
+    # Stored as "<job id>_<name>", the id prefix only keeps names unique on disk
+    return FileResponse(file, as_attachment=True, filename=job.file_name.split('_', 1)[1],
+                        content_type=export_format.content_type)